@@ -0,0 +1,210 @@
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Measures how each compiler phase scales with the size of its input.
+
+Each field of pl0.synth.Shape is scaled in turn while the others stay
+at their defaults.  For every size, each phase is timed with the
+garbage collector off (best of at least --repeat runs, corrected for
+the machine's speed at the time) and its peak allocation is measured
+with tracemalloc in a separate run.  The slope of
+log(time) against log(tokens) is fitted for each phase and field; a
+phase that scales linearly has a slope near 1.  Any slope above
+--limit is reported and the exit status is 1.
+
+Usage: python3 bench/compiler.py [--quick] [--json FILE]
+"""
+
+import argparse
+import gc
+import io
+import json
+import math
+import os
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from pl0 import bounds
+from pl0 import driver
+from pl0 import ir
+from pl0 import jit
+from pl0 import lex
+from pl0 import parser
+from pl0 import serialize
+from pl0 import synth
+
+# Least seconds to spend timing each phase at each size.
+BUDGET = 0.25
+
+
+def spin():
+    """Times a fixed amount of work to tell how fast the machine is now."""
+    start = time.perf_counter()
+    total = 0
+    for x in range(20000):
+        total += x
+    return time.perf_counter() - start
+
+
+def phases(source):
+    """Yields (name, function, make) for each phase of compiling source.
+
+    make returns the argument to call function with and is called
+    outside of the function being measured, before every run, as hoist
+    and prepare change the program they are given.  prepare is timed
+    for the c backend, which runs every pass, and each backend is timed
+    on the program as driver.prepare leaves it for that backend.
+    """
+    tokens = list(lex.lex(source))
+    ast = parser.parse(tokens)
+
+    def generate():
+        return ir.IRGenerator().dispatch(ast)
+
+    def lower():
+        return bounds.hoist(generate())
+
+    def constant(value):
+        return lambda: value
+
+    yield 'lex', lambda x: list(lex.lex(x)), constant(source)
+    yield 'parse', parser.parse, constant(tokens)
+    yield 'ir', lambda x: ir.IRGenerator().dispatch(x), constant(ast)
+    yield 'hoist', bounds.hoist, generate
+    yield ('prepare', lambda x: driver.prepare(source, x, 'c', ()),
+           lower)
+    for name, backend in sorted(driver.BACKENDS.items()):
+        program = lower()
+        driver.prepare(source, program, name, ())
+        yield (name, lambda x, y=backend: y(io.StringIO()).dispatch(x),
+               constant(program))
+    yield 'jit', lambda x: jit.JITGenerator().dispatch(x), constant(lower())
+    program = lower()
+    yield 'save', serialize.dumpb, constant(program)
+    yield 'load', serialize.loads, constant(serialize.dumpb(program))
+
+
+def measure(source, repeat, reference):
+    """Returns {phase: (seconds, peak bytes)}.
+
+    Shared machines can run at half speed for seconds at a time, so
+    each run is scaled by how long spin() took around it compared with
+    reference, the fastest spin() seen.
+    """
+    results = {}
+    for name, function, make in phases(source):
+        best = None
+        spent = 0
+        runs = 0
+        while runs < repeat or spent < BUDGET:
+            argument = make()
+            # Collections scale with everything allocated so far and
+            # would make every phase look super-linear.
+            gc.collect()
+            gc.disable()
+            before = spin()
+            start = time.perf_counter()
+            function(argument)
+            elapsed = time.perf_counter() - start
+            after = spin()
+            gc.enable()
+            scaled = elapsed * 2 * reference / (before + after)
+            best = scaled if best is None else min(best, scaled)
+            spent += elapsed
+            runs += 1
+        argument = make()
+        tracemalloc.start()
+        function(argument)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results[name] = (best, peak)
+    return results
+
+
+def slope(xs, ys):
+    """Fits log(y) = a + b log(x), returning b."""
+    xs = [math.log(x) for x in xs]
+    ys = [math.log(max(y, 1e-9)) for y in ys]
+    mx = sum(xs) / len(xs)
+    my = sum(ys) / len(ys)
+    num = sum((x - mx) * (y - my) for x, y in zip(xs, ys))
+    den = sum((x - mx)**2 for x in xs)
+    return num / den
+
+
+def main():
+    args = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    args.add_argument('--quick', action='store_true',
+                      help='fewer and smaller sizes')
+    args.add_argument('--repeat', type=int, default=5)
+    args.add_argument('--seed', type=int, default=1)
+    args.add_argument('--limit', type=float, default=1.3,
+                      help='largest acceptable slope')
+    args.add_argument('--json', help='write the measurements to FILE')
+    args.add_argument('fields', nargs='*', default=synth.Shape.__slots__,
+                      help='Shape fields to scale, default all')
+    pargs = args.parse_args()
+
+    factors = (1, 2, 4, 8) if pargs.quick else (1, 2, 4, 8, 16, 32)
+    base = synth.Shape()
+    reference = min(spin() for _ in range(100))
+    report = []
+    bad = []
+
+    for field in pargs.fields:
+        sizes = []
+        rows = []
+        for factor in factors:
+            source = synth.generate(base.scaled(field, factor), pargs.seed)
+            sizes.append(sum(1 for _ in lex.lex(source)))
+            rows.append(measure(source, pargs.repeat, reference))
+
+        print('{} x {}'.format(field, '/'.join(map(str, factors))))
+        print('  {:10} {:>8} {:>8}  {}'.format(
+            'phase', 'time', 'memory', 'slopes; ms at ' + ' '.join(
+                '{}'.format(x) for x in sizes) + ' tokens'))
+        for phase in rows[0]:
+            times = [x[phase][0] for x in rows]
+            peaks = [x[phase][1] for x in rows]
+            fit = (slope(sizes, times), slope(sizes, peaks))
+            flag = ''
+            if fit[0] > pargs.limit or fit[1] > pargs.limit:
+                flag = '  NON-LINEAR'
+                bad.append((field, phase))
+            print('  {:10} {:8.2f} {:8.2f}  {}{}'.format(
+                phase, fit[0], fit[1], ' '.join(
+                    '{:.2f}'.format(x * 1e3) for x in times), flag))
+            report.append({'field': field,
+                           'phase': phase,
+                           'tokens': sizes,
+                           'seconds': times,
+                           'peak': peaks,
+                           'time_slope': fit[0],
+                           'memory_slope': fit[1]})
+
+    if pargs.json:
+        with open(pargs.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    if bad:
+        print('Non-linear: {}'.format(', '.join(
+            '{} in {}'.format(y, x) for x, y in bad)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
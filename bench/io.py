@@ -0,0 +1,86 @@
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Compares I/O throughput of the buffered runtime and the printf one.
+
+Usage: python3 bench/io.py [count]
+"""
+
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from pl0 import driver
+
+RUNTIMES = {
+    'printf': ['-DPL0_STDIO'],
+    'buffered': [],
+}
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000000
+    cxx = os.environ.get('CXX', 'c++')
+
+    with open(os.path.join(ROOT, 'bench', 'io.pl0'), 'r') as f:
+        source = driver.compile_source(f.read())
+
+    with tempfile.TemporaryDirectory() as work:
+        src = os.path.join(work, 'io.cc')
+        with open(src, 'w') as f:
+            f.write(source)
+
+        rng = random.Random(1)
+        data = os.path.join(work, 'input')
+        with open(data, 'w') as f:
+            f.write('{}\n'.format(count))
+            f.write('\n'.join(
+                str(rng.randint(-2**31, 2**31 - 1)) for _ in range(count)))
+            f.write('\n')
+        size = os.path.getsize(data)
+
+        outputs = {}
+        for name, flags in sorted(RUNTIMES.items()):
+            binary = os.path.join(work, name)
+            subprocess.run([cxx, '-O2', '-I', os.path.join(ROOT, 'lib')] +
+                           flags + ['-o', binary, src,
+                                    os.path.join(ROOT, 'lib', 'pl0.cc')],
+                           check=True)
+            best = None
+            for _ in range(3):
+                with open(data, 'rb') as stdin:
+                    start = time.perf_counter()
+                    result = subprocess.run([binary],
+                                            stdin=stdin,
+                                            stdout=subprocess.PIPE,
+                                            check=True)
+                    elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            outputs[name] = result.stdout
+            print('{:10} {:7.3f}s {:8.1f} MB/s {:10.0f} ints/s'.format(
+                name, best, 2 * size / best / 1e6, 2 * count / best))
+
+        if len(set(outputs.values())) != 1:
+            print('Outputs differ between runtimes')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
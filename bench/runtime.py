@@ -0,0 +1,266 @@
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Times the generated code and compares it with a stored baseline.
+
+Each program is built with every backend and, for the C backends, at
+each optimisation level.  Runs are interleaved round robin across all
+of them, after --warmup untimed rounds, so a slow patch on the machine
+is shared out instead of landing on one configuration.  Each result is
+the median wall time of --repeat runs with a distribution-free 95%
+confidence interval.
+
+With a baseline, a configuration has regressed when it is more than
+--threshold slower and a one-sided Mann-Whitney U test on the two sets
+of samples gives p below --alpha.  Regressions make the exit status 1.
+--save writes this run as the new baseline.
+
+Usage: python3 bench/runtime.py [--save] [--repeat N] [program.pl0...]
+"""
+
+import argparse
+import glob
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from pl0 import check
+from pl0 import driver
+from pl0 import ir
+from pl0 import jit
+from pl0 import lex
+from pl0 import parser
+from pl0 import runner
+
+PROGRAMS = [os.path.join(ROOT, 'examples', x)
+            for x in ('bench.pl0', 'muldiv.pl0', 'fibonacci.pl0')] + sorted(
+                glob.glob(os.path.join(ROOT, 'bench', 'kernels', '*.pl0')))
+
+BASELINE = os.path.join(ROOT, 'bench', 'baseline.json')
+
+LEVELS = ('-O0', '-O1', '-O2', '-O3')
+
+# The x86 backend's own code doesn't depend on the C compiler, so only
+# the runtime it links against is built at each level.
+CONFIGS = [('c', x) for x in LEVELS] + [('structured', x) for x in LEVELS] + [
+    ('x86', '-O2'), ('jit', None)
+]
+
+
+class Native:
+    def __init__(self, path, backend, level):
+        source = driver.compile_source(read(path), backend)
+        self.binary = runner.build(source, (level, ),
+                                   extension=driver.EXTENSIONS[backend],
+                                   suffix='.elf')
+
+    def run(self):
+        start = time.perf_counter()
+        done = subprocess.run([self.binary],
+                              stdin=subprocess.DEVNULL,
+                              stdout=subprocess.PIPE,
+                              check=True)
+        return time.perf_counter() - start, done.stdout.split()
+
+
+class JIT:
+    def __init__(self, path, backend, level):
+        program = ir.IRGenerator().dispatch(parser.parse(lex.lex(read(
+            path))))
+        self.compiled = jit.jit(program)
+
+    def run(self):
+        start = time.perf_counter()
+        out = self.compiled.run()
+        return time.perf_counter() - start, [str(x).encode() for x in out]
+
+
+def read(path):
+    with open(path, 'r') as f:
+        return f.read()
+
+
+def name(path, backend, level):
+    base = os.path.splitext(os.path.basename(path))[0]
+    return ' '.join(x for x in (base, backend, level) if x)
+
+
+def machine():
+    cc = runner.compiler_version(runner.compiler()).decode().splitlines()
+    return {'machine': platform.machine(),
+            'processor': platform.processor(),
+            'cpus': os.cpu_count(),
+            'cc': cc[0] if cc else ''}
+
+
+def median(samples):
+    ordered = sorted(samples)
+    middle = len(ordered) // 2
+    if len(ordered) % 2:
+        return ordered[middle]
+    return (ordered[middle - 1] + ordered[middle]) / 2
+
+
+def interval(samples, confidence=0.95):
+    """Returns a confidence interval for the median from order statistics.
+
+    Uses the largest k where the k-th smallest and the k-th largest
+    sample cover the median with at least the given confidence.  Falls
+    back to the range when there are too few samples for that.
+    """
+    ordered = sorted(samples)
+    n = len(ordered)
+    cover = 0
+    k = 0
+    # P(k <= rank of the median < n - k) for binomial(n, 1/2).
+    for candidate in range(n // 2, 0, -1):
+        cover = sum(math.comb(n, x)
+                    for x in range(candidate, n - candidate + 1)) / 2**n
+        if cover >= confidence:
+            k = candidate
+            break
+    if k == 0:
+        return ordered[0], ordered[-1]
+    return ordered[k - 1], ordered[n - k]
+
+
+def slower(current, baseline):
+    """Returns the one-sided Mann-Whitney U p-value that current is slower.
+
+    Uses the normal approximation with a correction for ties, which is
+    fine for the ten or so samples on each side used here.
+    """
+    merged = sorted([(x, 0) for x in baseline] + [(x, 1) for x in current])
+    ranks = [0.0] * len(merged)
+    ties = 0
+    at = 0
+    while at < len(merged):
+        end = at
+        while end + 1 < len(merged) and merged[end + 1][0] == merged[at][0]:
+            end += 1
+        for idx in range(at, end + 1):
+            ranks[idx] = (at + end) / 2 + 1
+        count = end - at + 1
+        ties += count**3 - count
+        at = end + 1
+
+    n1 = len(current)
+    n2 = len(baseline)
+    total = n1 + n2
+    u = sum(r for r, (_, side) in zip(ranks, merged) if side) - n1 * (n1 +
+                                                                      1) / 2
+    mean = n1 * n2 / 2
+    variance = n1 * n2 / 12 * ((total + 1) - ties / (total * (total - 1)))
+    if variance <= 0:
+        return 1.0
+    z = (u - mean - 0.5) / math.sqrt(variance)
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def main():
+    args = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    args.add_argument('--repeat', type=int, default=10)
+    args.add_argument('--warmup', type=int, default=2)
+    args.add_argument('--backend', action='append',
+                      help='only these backends, default all')
+    args.add_argument('--level', action='append',
+                      help='only these C optimisation levels')
+    args.add_argument('--baseline', default=BASELINE)
+    args.add_argument('--save', action='store_true',
+                      help='write the results as the new baseline')
+    args.add_argument('--threshold', type=float, default=0.05,
+                      help='slowdown to ignore, as a fraction')
+    args.add_argument('--alpha', type=float, default=0.01)
+    args.add_argument('programs', nargs='*', default=PROGRAMS)
+    pargs = args.parse_args()
+
+    configs = [(x, y) for x, y in CONFIGS
+               if (not pargs.backend or x in pargs.backend) and
+               (y is None or not pargs.level or y in pargs.level)]
+    runs = {}
+    for path in pargs.programs:
+        for backend, level in configs:
+            maker = JIT if backend == 'jit' else Native
+            runs[name(path, backend, level)] = (path,
+                                                maker(path, backend, level))
+
+    samples = {x: [] for x in runs}
+    outputs = {}
+    for round_ in range(pargs.warmup + pargs.repeat):
+        for key, (path, run) in runs.items():
+            elapsed, out = run.run()
+            outputs.setdefault(path, {})[key] = out
+            if round_ >= pargs.warmup:
+                samples[key].append(elapsed)
+
+    wrong = []
+    for path, seen in outputs.items():
+        expect = check.expectations(read(path))
+        for key, out in seen.items():
+            reference = [x.encode() for x in expect] or next(iter(
+                seen.values()))
+            if out != reference:
+                wrong.append(key)
+
+    baseline = {}
+    if os.path.exists(pargs.baseline) and not pargs.save:
+        with open(pargs.baseline, 'r') as f:
+            stored = json.load(f)
+        if stored['machine'] != machine():
+            print('Baseline is from a different machine: {}'.format(stored[
+                'machine']))
+        baseline = stored['results']
+
+    regressions = []
+    print('{:28} {:>9} {:>19} {:>8} {:>8}'.format('program', 'median',
+                                                  '95% CI', 'vs base',
+                                                  'p'))
+    for key, times in samples.items():
+        low, high = interval(times)
+        line = '{:28} {:8.2f}ms {:8.2f}-{:8.2f}ms'.format(
+            key, median(times) * 1e3, low * 1e3, high * 1e3)
+        if key in baseline:
+            before = baseline[key]
+            change = median(times) / median(before) - 1
+            p = slower(times, before)
+            line += ' {:+7.1f}% {:8.4f}'.format(change * 100, p)
+            if change > pargs.threshold and p < pargs.alpha:
+                line += '  REGRESSED'
+                regressions.append(key)
+        if key in wrong:
+            line += '  WRONG OUTPUT'
+        print(line)
+
+    if pargs.save:
+        with open(pargs.baseline, 'w') as f:
+            json.dump({'machine': machine(),
+                       'results': samples}, f, indent=1, sort_keys=True)
+            f.write('\n')
+    if wrong:
+        print('Wrong output: {}'.format(', '.join(wrong)))
+    if regressions:
+        print('Regressed: {}'.format(', '.join(regressions)))
+    if wrong or regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
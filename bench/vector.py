@@ -0,0 +1,74 @@
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Compares running bench/vector.pl0 once per record with pl0.vector.
+
+Usage: python3 bench/vector.py [records] [sample]
+
+The compiled program is run on sample records, one process each, and
+pl0.vector runs all of them in one batch.  Both report the time per
+record and the outputs of the sample must agree.
+"""
+
+import os
+import random
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from pl0 import driver
+from pl0 import runner
+from pl0 import vector
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    sample = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    with open(os.path.join(ROOT, 'bench', 'vector.pl0'), 'r') as f:
+        source = f.read()
+    rng = random.Random(1)
+    records = [[rng.randint(1, 10000), rng.randint(1, 1000),
+                rng.randint(1, 1000)] for _ in range(count)]
+
+    binary = runner.build(driver.compile_source(source), ('-O2', ),
+                          suffix='.elf')
+    expect = []
+    start = time.perf_counter()
+    for record in records[:sample]:
+        done = subprocess.run([binary],
+                              input=' '.join(map(str, record)).encode(),
+                              stdout=subprocess.PIPE,
+                              check=True)
+        expect.append([int(x) for x in done.stdout.split()])
+    each = (time.perf_counter() - start) / sample
+
+    program = vector.compile_program(source)
+    start = time.perf_counter()
+    result = vector.run(program, records)
+    batched = (time.perf_counter() - start) / count
+
+    print('{:10} {:10.2f} us/record'.format('process', each * 1e6))
+    print('{:10} {:10.2f} us/record {:8.0f}x'.format('vector', batched * 1e6,
+                                                    each / batched))
+    if [result.output(x) for x in range(sample)] != expect:
+        print('Outputs differ')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
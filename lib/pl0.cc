@@ -14,13 +14,289 @@
 //
 #include "pl0.h"
 
+#include <csignal>
+#include <cstdint>
 #include <cstdio>
+#include <cstdlib>
+#include <cstring>
+#include <sys/time.h>
+#include <sys/wait.h>
+#include <unistd.h>
+
+#ifdef PL0_STDIO
+
+// The original runtime.  Kept for comparison in bench/io.py.
 
 void write(int_t v) {
     printf("%d\n", v);
 }
 
-int main() {
+int_t pl0_read() {
+    int_t v = 0;
+    if (scanf("%d", &v) != 1) {
+        return 0;
+    }
+    return v;
+}
+
+void pl0_flush() {
+    fflush(stdout);
+}
+
+#else
+
+// Output is formatted by hand into a large buffer that is handed to
+// write(2) when full, before blocking for more input and at exit.
+// Input is read in bulk and parsed in place.
+
+static const int kBufferSize = 1 << 16;
+
+static char out[kBufferSize];
+static int out_used;
+
+static char in[kBufferSize];
+static int in_at;
+static int in_len;
+static bool in_eof;
+
+void pl0_flush() {
+    int at = 0;
+    while (at < out_used) {
+        ssize_t n = ::write(1, out + at, out_used - at);
+        if (n <= 0) {
+            break;
+        }
+        at += n;
+    }
+    out_used = 0;
+}
+
+void write(int_t v) {
+    // Longest is "-2147483648\n".
+    if (out_used > kBufferSize - 12) {
+        pl0_flush();
+    }
+    char digits[10];
+    int n = 0;
+    unsigned int u = v;
+    if (v < 0) {
+        out[out_used++] = '-';
+        u = 0u - u;
+    }
+    do {
+        digits[n++] = '0' + u % 10;
+        u /= 10;
+    } while (u != 0);
+    while (n > 0) {
+        out[out_used++] = digits[--n];
+    }
+    out[out_used++] = '\n';
+}
+
+static int peek() {
+    if (in_at == in_len) {
+        if (in_eof) {
+            return -1;
+        }
+        // So that a prompt is seen before the program waits for the
+        // answer.
+        pl0_flush();
+        ssize_t n = ::read(0, in, kBufferSize);
+        if (n <= 0) {
+            in_eof = true;
+            return -1;
+        }
+        in_at = 0;
+        in_len = n;
+    }
+    return in[in_at];
+}
+
+int_t pl0_read() {
+    int ch = peek();
+    while (ch != -1 && ch != '-' && (ch < '0' || ch > '9')) {
+        in_at++;
+        ch = peek();
+    }
+    bool negative = ch == '-';
+    if (negative) {
+        in_at++;
+        ch = peek();
+    }
+    unsigned int v = 0;
+    while (ch >= '0' && ch <= '9') {
+        v = v * 10 + (ch - '0');
+        in_at++;
+        ch = peek();
+    }
+    return negative ? 0u - v : v;
+}
+
+#endif
+
+unsigned long long pl0_children;
+
+static pl0_profile* profile;
+
+static void write_profile() {
+    const char* path = getenv("PL0_PROFILE");
+    FILE* f = fopen(path != nullptr ? path : "pl0.profile", "w");
+    if (f == nullptr) {
+        perror("pl0.profile");
+        return;
+    }
+    fprintf(f, "pl0-profile 1\nsource %s\ncycles %d\n", profile->source,
+            profile->cycles);
+    for (int i = 0; i < profile->count; i++) {
+        const pl0_site& site = profile->sites[i];
+        fprintf(f, "%s %s %d %llu %llu %llu %llu\n", site.kind, site.name,
+                site.line, profile->counts[2 * i], profile->counts[2 * i + 1],
+                profile->times[2 * i], profile->times[2 * i + 1]);
+    }
+    fclose(f);
+}
+
+void pl0_bounds(int_t index, int_t size, int line) {
+    pl0_flush();
+    fprintf(stderr, "line %d: index %d is outside an array of %d\n", line,
+            index, size);
+    exit(2);
+}
+
+// Writes out what the program wrote before dividing by zero, as
+// pl0_bounds does, and then dies of the signal as it would have.
+static void trapped(int signum) {
+    pl0_flush();
+    signal(signum, SIG_DFL);
+    raise(signum);
+}
+
+void pl0_profile_register(pl0_profile* p) {
+    profile = p;
+    atexit(write_profile);
+}
+
+// Read and written at a time by serve().
+static const int kServeBuffer = 1 << 16;
+
+extern "C" void pl0_run() {
+    run();
+    pl0_flush();
+}
+
+static bool read_all(int fd, void* data, size_t n) {
+    char* at = static_cast<char*>(data);
+    while (n > 0) {
+        ssize_t got = ::read(fd, at, n);
+        if (got <= 0) {
+            return false;
+        }
+        at += got;
+        n -= got;
+    }
+    return true;
+}
+
+static bool write_all(int fd, const void* data, size_t n) {
+    const char* at = static_cast<const char*>(data);
+    while (n > 0) {
+        ssize_t done = ::write(fd, at, n);
+        if (done <= 0) {
+            return false;
+        }
+        at += done;
+        n -= done;
+    }
+    return true;
+}
+
+// Copies n bytes from one file descriptor to another.
+static bool copy(int from, int to, uint32_t n) {
+    char buffer[kServeBuffer];
+    while (n > 0) {
+        uint32_t part = n < sizeof buffer ? n : sizeof buffer;
+        if (!read_all(from, buffer, part) || !write_all(to, buffer, part)) {
+            return false;
+        }
+        n -= part;
+    }
+    return true;
+}
+
+// Writes the length and then the contents of file to fd.
+static bool send(int file, int fd) {
+    uint32_t n = lseek(file, 0, SEEK_END);
+    lseek(file, 0, SEEK_SET);
+    return write_all(fd, &n, sizeof n) && copy(file, fd, n);
+}
+
+// Runs the program once for each job on stdin, in a child forked for
+// the job so that each run starts from fresh globals.  A job is its
+// length and a timeout in milliseconds, or 0 for none, as two native
+// uint32_t and then its input.  The reply on stdout is the child's
+// wait status as an int32_t, then the length and contents of its stdout
+// and of its stderr.  See pl0/batch.py.
+static int serve() {
+    int files[3];
+    for (int& file : files) {
+        FILE* f = tmpfile();
+        if (f == nullptr) {
+            perror("tmpfile");
+            return 1;
+        }
+        file = fileno(f);
+    }
+    uint32_t job[2];
+    while (read_all(0, job, sizeof job)) {
+        for (int file : files) {
+            if (ftruncate(file, 0) != 0) {
+                perror("ftruncate");
+                return 1;
+            }
+            lseek(file, 0, SEEK_SET);
+        }
+        if (!copy(0, files[0], job[0])) {
+            return 1;
+        }
+        lseek(files[0], 0, SEEK_SET);
+        int32_t status = -1;
+        pid_t pid = fork();
+        if (pid == 0) {
+            for (int i = 0; i < 3; i++) {
+                dup2(files[i], i);
+            }
+            if (job[1] != 0) {
+                itimerval timer;
+                memset(&timer, 0, sizeof timer);
+                timer.it_value.tv_sec = job[1] / 1000;
+                timer.it_value.tv_usec = job[1] % 1000 * 1000;
+                setitimer(ITIMER_REAL, &timer, nullptr);
+            }
+            run();
+            pl0_flush();
+            _exit(0);
+        }
+        if (pid > 0) {
+            int waited;
+            if (waitpid(pid, &waited, 0) == pid) {
+                status = waited;
+            }
+        }
+        if (!write_all(1, &status, sizeof status) || !send(files[1], 1) ||
+            !send(files[2], 1)) {
+            return 1;
+        }
+    }
+    return 0;
+}
+
+int main(int argc, char** argv) {
+    signal(SIGFPE, trapped);
+    if (argc > 1 && strcmp(argv[1], "--serve") == 0) {
+        return serve();
+    }
+    atexit(pl0_flush);
     run();
+    pl0_flush();
     return 0;
 }
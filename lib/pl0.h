@@ -15,7 +15,82 @@
 
 #pragma once
 
+#include <time.h>
+
 typedef int int_t;
 
 void write(int_t val);
+// Returns the next integer on stdin, or 0 at the end of input.
+int_t pl0_read();
+// Writes out any buffered output.
+void pl0_flush();
 void run();
+
+// Runs the program and flushes its output.  Used when the program is
+// loaded as a shared object.
+extern "C" void pl0_run();
+
+// Reports an array index out of bounds at line of the source and exits
+// with status 2.
+[[noreturn]] void pl0_bounds(int_t index, int_t size, int line);
+
+// Checks that 0 <= index < size before an array access.
+static inline void pl0_check(int_t index, int_t size, int line) {
+    if (__builtin_expect((unsigned)index >= (unsigned)size, 0)) {
+        pl0_bounds(index, size, line);
+    }
+}
+
+// Profiling support for code generated with --instrument.  See
+// pl0/profile.py.
+
+struct pl0_site {
+    const char* kind;
+    const char* name;
+    int line;
+};
+
+struct pl0_profile {
+    const char* source;
+    int cycles;
+    int count;
+    const pl0_site* sites;
+    // Two counters per site.
+    unsigned long long* counts;
+    // Inclusive and self time per site.
+    unsigned long long* times;
+};
+
+// Writes profile to $PL0_PROFILE or pl0.profile at exit.
+void pl0_profile_register(pl0_profile* profile);
+
+// Time spent in the regions nested in the current one.
+extern unsigned long long pl0_children;
+
+static inline unsigned long long pl0_clock() {
+#if defined(__x86_64__) || defined(__i386__)
+    return __builtin_ia32_rdtsc();
+#else
+    timespec now;
+    clock_gettime(CLOCK_MONOTONIC, &now);
+    return now.tv_sec * 1000000000ull + now.tv_nsec;
+#endif
+}
+
+// Starts timing a procedure or loop.
+static inline void pl0_enter(unsigned long long* start,
+                             unsigned long long* outer) {
+    *outer = pl0_children;
+    pl0_children = 0;
+    *start = pl0_clock();
+}
+
+// Stops timing a region started with pl0_enter.
+static inline void pl0_leave(unsigned long long* times,
+                             unsigned long long start,
+                             unsigned long long outer) {
+    unsigned long long total = pl0_clock() - start;
+    times[0] += total;
+    times[1] += total - pl0_children;
+    pl0_children = outer + total;
+}
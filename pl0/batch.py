@@ -0,0 +1,368 @@
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Runs one compiled program over many inputs in a pool of processes.
+
+Each job is the stdin of one run.  Jobs are sent to the workers in
+tasks of up to chunk jobs and the results come back in order.  At most
+WINDOW tasks per process are outstanding, so a large or endless input
+is read only as fast as it is run and out of order results don't pile
+up.
+
+The engines are:
+
+    serve   starts a native executable once per worker as a server that
+            forks a child to run each job, which saves exec and the
+            dynamic loader and gives each run fresh globals
+    exe     runs a native executable once per job
+    so      loads a shared object once per worker and forks a child to
+            run each job, which saves exec and the dynamic loader and
+            gives each run fresh globals
+    vector  runs each task as one batch with pl0.vector
+
+A job that runs for longer than timeout seconds is stopped.  With
+vector the timeout is per task.
+"""
+
+import collections
+import ctypes
+import faulthandler
+import multiprocessing
+import os
+import signal
+import struct
+import subprocess
+import tempfile
+import time
+
+from . import util
+
+ENGINES = ('serve', 'exe', 'so', 'vector')
+# Tasks in flight per process.
+WINDOW = 4
+
+
+class Job(util.ReprMixin):
+    """One run.  data is its stdin."""
+    __slots__ = 'index', 'name', 'data'
+
+    def __init__(self, index, name, data):
+        self.index = index
+        self.name = name
+        self.data = data
+
+
+class Outcome(util.ReprMixin):
+    """The result of a Job.
+
+    status is ok, fail or timeout.  seconds is the time the worker spent
+    on it, and latency the time from sending it to getting the result.
+    """
+    __slots__ = 'job', 'status', 'output', 'error', 'seconds', 'latency'
+
+    def __init__(self, job, status, output=b'', error=None, seconds=0.0):
+        self.job = job
+        self.status = status
+        self.output = output
+        self.error = error
+        self.seconds = seconds
+        self.latency = 0.0
+
+
+class Stats(util.ReprMixin):
+    """Throughput and latency of a batch."""
+    __slots__ = ('jobs', 'statuses', 'read', 'written', 'latencies', 'start',
+                 'elapsed', 'processes')
+
+    def __init__(self, processes):
+        self.jobs = 0
+        self.statuses = collections.Counter()
+        self.read = 0
+        self.written = 0
+        self.latencies = []
+        self.start = time.perf_counter()
+        self.elapsed = 0.0
+        self.processes = processes
+
+    def add(self, outcome):
+        self.jobs += 1
+        self.statuses[outcome.status] += 1
+        self.read += len(outcome.job.data)
+        self.written += len(outcome.output)
+        self.latencies.append(outcome.latency)
+        self.elapsed = time.perf_counter() - self.start
+
+    def percentile(self, fraction):
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def report(self):
+        elapsed = self.elapsed or 1e-9
+        return '\n'.join([
+            '{} jobs ({} ok, {} failed, {} timed out) in {:.2f} s on {} '
+            'processes'.format(self.jobs, self.statuses['ok'],
+                               self.statuses['fail'],
+                               self.statuses['timeout'], self.elapsed,
+                               self.processes),
+            '{:.1f} jobs/s, {:.2f} MB/s in, {:.2f} MB/s out'.format(
+                self.jobs / elapsed, self.read / elapsed / 1e6,
+                self.written / elapsed / 1e6),
+            'latency ms: p50 {:.2f} p90 {:.2f} p99 {:.2f} max {:.2f}'.format(
+                *[1e3 * self.percentile(x) for x in (0.5, 0.9, 0.99, 1.0)]),
+        ])
+
+
+def lines(stream):
+    """Yields a Job for each line of the binary stream."""
+    for index, line in enumerate(stream):
+        yield Job(index, str(index + 1), line)
+
+
+def files(paths):
+    """Yields a Job for each file, read as it is needed."""
+    for index, path in enumerate(paths):
+        with open(path, 'rb') as f:
+            yield Job(index, path, f.read())
+
+
+def chunks(jobs, size):
+    chunk = []
+    for job in jobs:
+        chunk.append(job)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# The state of a worker, set by _start().
+_engine = None
+_timeout = None
+
+
+def _start(engine, target, timeout):
+    """Loads target, a path or for vector the PL/0 source, once per
+    worker."""
+    global _engine, _timeout
+    # The pool stops its workers with SIGTERM, which the driver's own
+    # handler would otherwise catch.
+    for number in (signal.SIGTERM, signal.SIGHUP):
+        signal.signal(number, signal.SIG_DFL)
+    _timeout = timeout
+    if engine == 'serve':
+        _engine = Served(target)
+    elif engine == 'exe':
+        _engine = Executable(target)
+    elif engine == 'so':
+        _engine = Loaded(target)
+    else:
+        _engine = Vector(target)
+
+
+def _run(jobs):
+    # The jobs' data isn't sent back.
+    return [(x.status, x.output, x.error, x.seconds)
+            for x in _engine.run(jobs, _timeout)]
+
+
+class Executable:
+    def __init__(self, path):
+        self.path = path
+
+    def run(self, jobs, timeout):
+        return [self.one(x, timeout) for x in jobs]
+
+    def one(self, job, timeout):
+        start = time.perf_counter()
+        try:
+            done = subprocess.run([self.path],
+                                  input=job.data,
+                                  stdout=subprocess.PIPE,
+                                  stderr=subprocess.PIPE,
+                                  timeout=timeout)
+        except subprocess.TimeoutExpired as ex:
+            return Outcome(job, 'timeout', ex.stdout or b'',
+                           'timed out after {} s'.format(timeout),
+                           time.perf_counter() - start)
+        seconds = time.perf_counter() - start
+        if done.returncode != 0:
+            return Outcome(job, 'fail', done.stdout, exited(
+                done.returncode, done.stderr), seconds)
+        return Outcome(job, 'ok', done.stdout, None, seconds)
+
+
+def exited(code, stderr):
+    message = stderr.decode(errors='replace').strip()
+    return message or 'exited with {}'.format(code)
+
+
+class Loaded:
+    def __init__(self, path):
+        self.library = ctypes.CDLL(path)
+
+    def run(self, jobs, timeout):
+        return [self.one(x, timeout) for x in jobs]
+
+    def one(self, job, timeout):
+        start = time.perf_counter()
+        with tempfile.TemporaryFile() as stdin, \
+                tempfile.TemporaryFile() as stdout, \
+                tempfile.TemporaryFile() as stderr:
+            stdin.write(job.data)
+            stdin.flush()
+            stdin.seek(0)
+            pid = os.fork()
+            if pid == 0:
+                code = 1
+                try:
+                    # A crash should kill the child with its signal.
+                    faulthandler.disable()
+                    os.dup2(stdin.fileno(), 0)
+                    os.dup2(stdout.fileno(), 1)
+                    os.dup2(stderr.fileno(), 2)
+                    if timeout:
+                        signal.setitimer(signal.ITIMER_REAL, timeout)
+                    self.library.pl0_run()
+                    code = 0
+                finally:
+                    os._exit(code)
+            _, status = os.waitpid(pid, 0)
+            stdout.seek(0)
+            output = stdout.read()
+            stderr.seek(0)
+            errors = stderr.read()
+        return waited(job, status, output, errors, timeout,
+                      time.perf_counter() - start)
+
+
+class Served:
+    """Runs jobs with an executable started with --serve.  See serve() in
+    lib/pl0.cc."""
+
+    def __init__(self, path):
+        self.process = subprocess.Popen([path, '--serve'],
+                                        stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE)
+
+    def run(self, jobs, timeout):
+        return [self.one(x, timeout) for x in jobs]
+
+    def one(self, job, timeout):
+        start = time.perf_counter()
+        milliseconds = max(1, int(timeout * 1000)) if timeout else 0
+        self.process.stdin.write(
+            struct.pack('=II', len(job.data), milliseconds) + job.data)
+        self.process.stdin.flush()
+        status, = struct.unpack('=i', self.read(4))
+        output = self.read(struct.unpack('=I', self.read(4))[0])
+        errors = self.read(struct.unpack('=I', self.read(4))[0])
+        if status == -1:
+            return Outcome(job, 'fail', output, 'could not fork',
+                           time.perf_counter() - start)
+        return waited(job, status, output, errors, timeout,
+                      time.perf_counter() - start)
+
+    def read(self, size):
+        data = self.process.stdout.read(size)
+        if len(data) != size:
+            raise EOFError('The server stopped: {}'.format(
+                self.process.wait()))
+        return data
+
+
+def waited(job, status, output, errors, timeout, seconds):
+    """Returns the Outcome of a child that ended with wait status."""
+    if os.WIFSIGNALED(status):
+        if os.WTERMSIG(status) == signal.SIGALRM:
+            return Outcome(job, 'timeout', output,
+                           'timed out after {} s'.format(timeout), seconds)
+        return Outcome(job, 'fail', output, 'killed by signal {}'.format(
+            os.WTERMSIG(status)), seconds)
+    if os.WEXITSTATUS(status) != 0:
+        return Outcome(job, 'fail', output, exited(
+            os.WEXITSTATUS(status), errors), seconds)
+    return Outcome(job, 'ok', output, None, seconds)
+
+
+class Vector:
+    def __init__(self, source):
+        from . import vector
+        self.vector = vector
+        self.program = vector.compile_program(source)
+
+    def run(self, jobs, timeout):
+        start = time.perf_counter()
+        inputs = [self.vector.numbers(job.data) for job in jobs]
+        previous = signal.signal(signal.SIGALRM, _expired)
+        try:
+            if timeout:
+                signal.setitimer(signal.ITIMER_REAL, timeout)
+            result = self.vector.run(self.program, inputs)
+        except TimeoutError:
+            seconds = time.perf_counter() - start
+            return [Outcome(x, 'timeout', b'', 'timed out after {} s'.format(
+                timeout), seconds) for x in jobs]
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous)
+        seconds = time.perf_counter() - start
+        outcomes = []
+        for lane, job in enumerate(jobs):
+            output = ''.join('{}\n'.format(x)
+                             for x in result.output(lane)).encode()
+            error = result.errors.get(lane)
+            outcomes.append(Outcome(job, 'fail' if error else 'ok', output,
+                                    error, seconds))
+        return outcomes
+
+
+def _expired(signum, frame):
+    raise TimeoutError()
+
+
+def run(jobs, engine, target, processes=None, timeout=None, chunk=1,
+        window=None):
+    """Runs jobs, an iterable of Jobs, yielding their Outcomes in order.
+
+    target is the path of the executable or shared object, or for vector
+    the PL/0 source.  At most window tasks of chunk jobs are in flight,
+    by default WINDOW per process.
+    """
+    if engine not in ENGINES:
+        raise ValueError('Unknown engine {}'.format(engine))
+    processes = processes or os.cpu_count()
+    window = window or WINDOW * processes
+    pending = collections.deque()
+    with multiprocessing.Pool(processes, _start,
+                              (engine, target, timeout)) as pool:
+        for task in chunks(jobs, chunk):
+            pending.append((task, time.perf_counter(),
+                            pool.apply_async(_run, (task, ))))
+            while (len(pending) >= window or
+                   (pending and pending[0][2].ready())):
+                yield from received(*pending.popleft())
+        while pending:
+            yield from received(*pending.popleft())
+
+
+def received(task, sent, result):
+    results = result.get()
+    latency = time.perf_counter() - sent
+    for job, fields in zip(task, results):
+        outcome = Outcome(job, *fields)
+        outcome.latency = latency
+        yield outcome
@@ -0,0 +1,359 @@
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Removes array bounds checks that loops make redundant.
+
+IRGenerator puts an ir.Check before every array access.  In
+
+    WHILE i < n DO BEGIN ... a[i + k] ... ; i := i + 1 END
+
+where i only goes up by constants and n doesn't change, each iteration
+starts with i between its value on entry and n - 1.  Each index i + k
+is then within a range that depends only on those two values and the
+increments before it.  Loops that count down with > or >= work the same
+way.
+
+When the entry value and n are known, checks whose range is inside the
+array are removed.  Otherwise an innermost loop is versioned: a test
+before it works out once whether all of its checks will pass, and runs a
+copy of the loop without them if so or the original if not.  Checks of
+constant indexes are removed anywhere.
+"""
+
+from . import ir
+from . import pgo
+from . import profile
+from . import util
+
+# The same comparison with its operands swapped.
+FLIPPED = {'<': '>', '<=': '>=', '>': '<', '>=': '<='}
+
+
+class Induction(util.ReprMixin):
+    """A loop that runs while variable operation bound, where variable
+    moves towards bound by steps of the sign of direction."""
+    __slots__ = 'variable', 'operation', 'bound', 'direction'
+
+    def __init__(self, variable, operation, bound, direction):
+        self.variable = variable
+        self.operation = operation
+        self.bound = bound
+        self.direction = direction
+
+
+def hoist(program):
+    """Removes or hoists the bounds checks in program in place."""
+    constants = {x.name: x.val for x in program.blocks[-1].consts}
+    for block in program.blocks:
+        Hoister(block, constants).run()
+    return program
+
+
+def find_loop(operations, at, exits):
+    """Returns the (test, back edge, end) indexes of the loop at at, or
+    None if it isn't the shape IRGenerator emits for WHILE."""
+    top = operations[at]
+    test = back = None
+    for idx in range(at + 1, len(operations)):
+        operation = operations[idx]
+        if (test is None and isinstance(operation, ir.Branch) and
+                exits.get(operation.target.val) == top.val):
+            test = idx
+        if isinstance(operation, ir.Goto) and operation.val is top:
+            back = idx
+            break
+    if test is None or back is None or back + 1 >= len(operations):
+        return None
+    if operations[test].target is not operations[back + 1]:
+        return None
+    return test, back, back + 1
+
+
+class Hoister:
+    def __init__(self, block, constants):
+        self.block = block
+        self.scalars = set(x.val for x in block.vars_
+                           if isinstance(x, ir.Variable))
+        if block.name is None:
+            # Globals, which any call may change.
+            self.scalars = set()
+        # Global constants are Variables, unless a local hides them.
+        self.constants = {k: v for k, v in constants.items()
+                          if k not in self.scalars}
+
+    def run(self):
+        self.block.operations = [
+            x for x in self.block.operations
+            if not (isinstance(x, ir.Check) and
+                    isinstance(x.index, ir.Number) and
+                    0 <= x.index.val < x.size)]
+        heads, exits = profile.loops(self.block.operations)
+        self.heads = heads
+        self.exits = exits
+        self.ends = {v: k for k, v in exits.items()}
+        at = 0
+        while at < len(self.block.operations):
+            operation = self.block.operations[at]
+            if isinstance(operation, ir.Label) and operation.val in heads:
+                at = self.loop(at)
+            else:
+                at += 1
+
+    def value(self, operand):
+        """Returns the value of operand if it is known, or None."""
+        if isinstance(operand, ir.Number):
+            return operand.val
+        if isinstance(operand, ir.Variable):
+            return self.constants.get(operand.val)
+        return None
+
+    def local(self, variable):
+        return variable.val in self.scalars
+
+    def invariant(self, operand, region):
+        """Returns True if region can't change operand."""
+        if self.value(operand) is not None:
+            return True
+        if not isinstance(operand, ir.Variable):
+            return False
+        return self.steps(operand, region) == [] and self.unaliased(
+            operand, region)
+
+    def unaliased(self, variable, region):
+        """Returns True if no call in region can change variable."""
+        for operation in region:
+            if not isinstance(operation, ir.Call) or operation.arg is not None:
+                continue
+            if not self.local(variable):
+                return False
+            if any(isinstance(x, ir.Variable) and x.val == variable.val
+                   for x in operation.captures):
+                return False
+        return True
+
+    def steps(self, variable, region):
+        """Returns the (index, step) of each definition of variable in
+        region, or None if one isn't variable := variable +/- constant.
+        """
+        found = []
+        made = {}
+        for idx, operation in enumerate(region):
+            if (isinstance(operation, ir.Operation) and
+                    not isinstance(operation, ir.TwoAddress)):
+                made[id(operation.result)] = operation
+            if not any(isinstance(x, ir.Variable) and x.val == variable.val
+                       for x in ir.defs(operation)):
+                continue
+            if not isinstance(operation, ir.Assign):
+                return None
+            step = made.get(id(operation.left))
+            if (step is None or step.operation not in '+-' or
+                    not isinstance(step.left, ir.Variable) or
+                    step.left.val != variable.val or
+                    not isinstance(step.right, ir.Number) or
+                    step.right.val == 0):
+                return None
+            sign = 1 if step.operation == '+' else -1
+            found.append((idx, sign * step.right.val))
+        return found
+
+    def induction(self, test, region):
+        """Returns the Induction of a loop left by the Jump test, or None."""
+        if not isinstance(test, ir.Jump):
+            return None
+        # The loop runs while the negation of test holds.
+        holds = ir.NEGATED[test.operation]
+        if holds not in FLIPPED:
+            return None
+        for variable, operation, bound in (
+                (test.left, holds, test.right),
+                (test.right, FLIPPED[holds], test.left)):
+            if not isinstance(variable, ir.Variable):
+                continue
+            steps = self.steps(variable, region)
+            if not steps or not self.unaliased(variable, region):
+                continue
+            direction = 1 if operation in ('<', '<=') else -1
+            if (all(x[1] * direction > 0 for x in steps) and
+                    self.invariant(bound, region)):
+                return Induction(variable, operation, bound, direction)
+        return None
+
+    def entry(self, at, variable):
+        """Returns the value variable has when the loop at at starts, if
+        the straight line code before it sets it to a known value."""
+        for operation in reversed(self.block.operations[:at]):
+            if isinstance(operation,
+                          (ir.Label, ir.Branch, ir.Goto, ir.Enter)):
+                return None
+            if isinstance(operation, ir.Call) and operation.arg is None:
+                return None
+            if any(isinstance(x, ir.Variable) and x.val == variable.val
+                   for x in ir.defs(operation)):
+                if isinstance(operation, ir.Assign):
+                    return self.value(operation.left)
+                return None
+        return None
+
+    def nesting(self, body):
+        """Returns whether each operation in body is inside an IF and
+        whether it is inside a loop."""
+        pending = {}
+        result = []
+        for operation in body:
+            if isinstance(operation, ir.Label):
+                pending.pop(operation.val, None)
+                if operation.val in self.heads:
+                    pending[self.ends[operation.val]] = 'loop'
+            result.append((bool(pending), 'loop' in pending.values()))
+            if (isinstance(operation, ir.Branch) and
+                    operation.target.val not in self.exits):
+                pending.setdefault(operation.target.val, 'if')
+        return result
+
+    def loop(self, at):
+        """Removes or hoists the checks in the loop at at and returns
+        where to carry on from."""
+        operations = self.block.operations
+        found = find_loop(operations, at, self.exits)
+        if found is None:
+            return at + 1
+        test, back, end = found
+        body = operations[test + 1:back]
+        induction = self.induction(operations[test],
+                                   operations[at:back + 1])
+        if induction is None:
+            return at + 1
+
+        nesting = self.nesting(body)
+        steps = self.steps(induction.variable, body)
+        if any(nesting[idx][1] for idx, _ in steps):
+            return at + 1
+        made = {}
+        removed = []
+        needs = []
+        start = self.entry(at, induction.variable)
+        limit = self.value(induction.bound)
+        for idx, operation in enumerate(body):
+            if isinstance(operation, ir.Operation):
+                made[id(operation.result)] = idx, operation
+            if not isinstance(operation, ir.Check) or nesting[idx][1]:
+                continue
+            offset = self.offset(operation.index, induction.variable, made,
+                                 idx)
+            if offset is None:
+                continue
+            where, k = offset
+            before = [(idx_, abs(step)) for idx_, step in steps
+                      if idx_ < where]
+            every = sum(x[1] for x in before)
+            must = sum(x[1] for x in before if not nesting[x[0]][0])
+            need = self.need(induction, operation.size, k, every, must)
+            known = (self.holds(start, need[0]), self.holds(limit, need[1]))
+            if known == (True, True):
+                removed.append(operation)
+            elif False not in known:
+                needs.append((operation, need))
+
+        innermost = not any(isinstance(x, ir.Label) and x.val in self.heads
+                            for x in body)
+        if removed:
+            operations = [x for x in operations if x not in removed]
+            self.block.operations = operations
+            back -= len(removed)
+            end -= len(removed)
+        if not needs or not innermost:
+            return end + 1
+        return self.version(at, end, induction, needs, start, limit)
+
+    def offset(self, index, variable, made, at):
+        """Returns where index was computed as variable + k and k, or
+        None."""
+        if isinstance(index, ir.Variable) and index.val == variable.val:
+            return at, 0
+        where, operation = made.get(id(index), (None, None))
+        if (operation is None or operation.operation not in '+-' or
+                isinstance(operation, ir.Condition) or
+                not isinstance(operation.left, ir.Variable) or
+                operation.left.val != variable.val or
+                not isinstance(operation.right, ir.Number)):
+            return None
+        sign = 1 if operation.operation == '+' else -1
+        return where, sign * operation.right.val
+
+    def need(self, induction, size, k, every, must):
+        """Returns what the entry value and the bound must satisfy for
+        variable + k to be a valid index.
+
+        every is the sum of the steps that may have been taken before
+        the index is computed and must those that have been.  Each need
+        is an (operation, value) pair.
+        """
+        margin = 1 if induction.operation in ('<', '>') else 0
+        if induction.direction > 0:
+            return ('>=', -(must + k)), ('<=', size - 1 + margin - every - k)
+        return ('<=', size - 1 + must - k), ('>=', every - k - margin)
+
+    def holds(self, value, need):
+        """Returns whether value meets need, or None if value is None."""
+        if value is None:
+            return None
+        operation, bound = need
+        return value >= bound if operation == '>=' else value <= bound
+
+    def version(self, at, end, induction, needs, start, limit):
+        """Replaces the loop between at and end with a test, a copy without
+        the checks in needs and the original.  Returns the index after."""
+        operations = self.block.operations
+        top = operations[at]
+        original = operations[at:end + 1]
+        checks = [x[0] for x in needs]
+        copier = pgo.Copier(self.block, '_v')
+        fast = copier.copy([x for x in original if x not in checks])
+
+        guard = []
+        tests = []
+        for which, operand, known in ((0, induction.variable, start),
+                                      (1, induction.bound, limit)):
+            if known is not None:
+                continue
+            operation = needs[0][1][which][0]
+            values = [x[1][which][1] for x in needs]
+            value = max(values) if operation == '>=' else min(values)
+            result = self.fresh()
+            guard.append(ir.Condition(result, operand, operation,
+                                      ir.Number(value)))
+            tests.append(result)
+        if len(tests) == 2:
+            result = self.fresh()
+            guard.append(ir.Operation(result, tests[0], '&', tests[1]))
+            tests = [result]
+        checked = ir.Label(top.val + '_checked', top.line)
+        done = ir.Label(top.val + '_done', top.line)
+        unsafe = self.fresh()
+        replacement = guard + [ir.If(tests[0], checked)] + fast + [
+            checked,
+            ir.Condition(unsafe, tests[0], '=', ir.Number(0)),
+            ir.If(unsafe, done)
+        ] + original + [done]
+        self.block.operations = (operations[:at] + replacement +
+                                 operations[end + 1:])
+        return at + len(replacement)
+
+    def fresh(self):
+        idx = max([x.idx for x in self.block.vars_
+                   if isinstance(x, ir.Intermediate)], default=0) + 1
+        operand = ir.Intermediate(idx)
+        self.block.vars_.append(operand)
+        return operand
@@ -0,0 +1,148 @@
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""A content-addressed on-disk cache of compiler output.
+
+Entries are keyed by the PL/0 source, the backend, the compile flags
+and a fingerprint of the compiler itself, so editing any file in pl0/
+invalidates everything it produced.  Entries are written to a
+temporary file and renamed into place so concurrent builds never see
+a partial entry.  The cache is kept under a size limit by removing the
+least recently used entries, where a hit refreshes the entry's mtime.
+"""
+
+import functools
+import glob
+import hashlib
+import os
+import tempfile
+
+from . import util
+
+# Default size limit in bytes.
+LIMIT = 64 << 20
+
+
+def root():
+    """Returns the top of the cache, shared with pl0.runner."""
+    default = os.path.join(os.path.expanduser('~'), '.cache', 'pl0')
+    return os.environ.get('PL0_CACHE_DIR', default)
+
+
+@functools.lru_cache()
+def fingerprint():
+    """Hashes the compiler's own source."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    digest = hashlib.sha256()
+    for name in sorted(glob.glob(os.path.join(here, '*.py'))):
+        with open(name, 'rb') as f:
+            digest.update(os.path.basename(name).encode() + b'\0')
+            digest.update(hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()
+
+
+class Stats(util.ReprMixin):
+    __slots__ = 'hits', 'misses', 'entries', 'size', 'limit'
+
+    def __init__(self, hits, misses, entries, size, limit):
+        self.hits = hits
+        self.misses = misses
+        self.entries = entries
+        self.size = size
+        self.limit = limit
+
+    def __str__(self):
+        return ('cache: {} hits, {} misses, {} entries, {} KiB of {} KiB'
+                .format(self.hits, self.misses, self.entries,
+                        self.size >> 10, self.limit >> 10))
+
+
+class Cache:
+    """Compiler output stored as one file per key in directory."""
+
+    def __init__(self, directory=None, limit=LIMIT):
+        self.directory = directory or os.path.join(root(), 'gen')
+        self.limit = limit
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, source, backend, flags=()):
+        digest = hashlib.sha256()
+        for part in (fingerprint(), backend, ' '.join(flags), source):
+            digest.update(hashlib.sha256(part.encode()).digest())
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        """Returns the entry for key or None."""
+        path = self.path(key)
+        try:
+            with open(path, 'r') as f:
+                value = f.read()
+            os.utime(path)
+        except OSError:
+            # Missing, or evicted by a concurrent build.
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(value)
+            os.replace(tmp, self.path(key))
+        finally:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+
+    def entries(self):
+        """Returns (mtime, size, path) for each entry."""
+        found = []
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return found
+        for name in names:
+            if name.endswith('.tmp'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            found.append((stat.st_mtime_ns, stat.st_size, path))
+        return found
+
+    def evict(self):
+        """Removes the oldest entries until the cache fits in limit."""
+        entries = sorted(self.entries())
+        size = sum(x[1] for x in entries)
+        for _, length, path in entries:
+            if size <= self.limit:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            size -= length
+
+    def stats(self):
+        entries = self.entries()
+        return Stats(self.hits, self.misses, len(entries),
+                     sum(x[1] for x in entries), self.limit)
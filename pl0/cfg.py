@@ -0,0 +1,248 @@
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Cleans up the labels and gotos of an ir.Program.
+
+IRGenerator emits a WHILE as
+
+    top: head; Jump(cond, end); body; Goto(top); end:
+
+which takes two branches per iteration.  simplify() rotates it into
+
+    head; Jump(cond, end); top: body; head'; Jump(not cond, top); end:
+
+where head' is a copy of head, so that each iteration takes only the
+branch back.  It then threads branches to labels that only go on to
+another label, drops branches to the next operation, turns a Jump over
+a Goto into one Jump, removes unreachable operations and removes
+labels that nothing jumps to so that straight line code is one block.
+
+The result no longer has the shape that pl0.structure, pl0.profile and
+the loop passes in pl0.bounds and pl0.pgo look for, so this runs last.
+"""
+
+from . import bounds
+from . import ir
+from . import pgo
+from . import profile
+
+# Loops whose head, the operations computing the condition, is longer
+# than this aren't rotated.
+ROTATE_LIMIT = 16
+
+
+def simplify(program):
+    """Simplifies the control flow of program in place."""
+    for block in program.blocks:
+        rotate(block)
+        tidy(block)
+    return program
+
+
+def rotate(block):
+    """Rotates each WHILE loop of block into a test and a do-while loop."""
+    tried = set()
+    while True:
+        heads, exits = profile.loops(block.operations)
+        found = [at for at, x in enumerate(block.operations)
+                 if isinstance(x, ir.Label) and x.val in heads and
+                 x.val not in tried]
+        if not found:
+            return
+        tried.add(block.operations[found[0]].val)
+        rotated = rotation(block, found[0], exits)
+        if rotated is not None:
+            block.operations = rotated
+
+
+def rotation(block, at, exits):
+    """Returns the operations of block with the loop at at rotated, or
+    None if it can't be."""
+    operations = block.operations
+    found = bounds.find_loop(operations, at, exits)
+    if found is None:
+        return None
+    test, back, end = found
+    top = operations[at]
+    head = operations[at + 1:test]
+    jump = operations[test]
+    loop_body = operations[test + 1:back]
+    if (not isinstance(jump, ir.Jump) or len(head) > ROTATE_LIMIT or
+            any(isinstance(x, (ir.Label, ir.Branch, ir.Goto, ir.Call,
+                               ir.Read)) for x in head)):
+        return None
+    # The back edge must be the only way to the top, and the head's
+    # intermediates only used by the test, as the copy gets new ones.
+    if any(targets(x) is top for x in loop_body):
+        return None
+    made = set(x.idx for operation in head for x in ir.defs(operation)
+               if isinstance(x, ir.Intermediate))
+    if any(isinstance(x, ir.Intermediate) and x.idx in made
+           for operation in loop_body for x in ir.uses(operation)):
+        return None
+
+    copier = pgo.Copier(block, '_r')
+    # Intermediates set before the loop, such as promoted globals, are
+    # read by the copy as they are.
+    copier.intermediates = {
+        x.idx: x for operation in head + [jump] for x in ir.uses(operation)
+        if isinstance(x, ir.Intermediate) and x.idx not in made}
+    again = copier.copy(head + [jump])
+    repeat = again[-1]
+    repeat.operation = ir.NEGATED[jump.operation]
+    repeat.target = top
+    if jump.expect is not None:
+        repeat.expect = not jump.expect
+    return (operations[:at] + head + [jump, top] + loop_body + again +
+            operations[end:])
+
+
+def targets(operation):
+    """Returns the Label that operation may jump to, or None."""
+    if isinstance(operation, ir.Goto):
+        return operation.val
+    if isinstance(operation, ir.Branch):
+        return operation.target
+    return None
+
+
+def retarget(operation, label):
+    if isinstance(operation, ir.Goto):
+        operation.val = label
+    else:
+        operation.target = label
+
+
+def tidy(block):
+    """Threads jumps and removes unreachable operations and unused
+    labels until nothing changes."""
+    changed = True
+    while changed:
+        changed = thread(block)
+        changed = fold(block) or changed
+        changed = prune(block) or changed
+
+
+def thread(block):
+    """Points each jump at the first label of the run of labels it
+    would end up at, following Gotos.  Returns True if one changed."""
+    operations = block.operations
+    first = {}
+    # The operation after each run of labels, keyed by its first.
+    leads = {}
+    run = None
+    for operation in operations:
+        if not isinstance(operation, ir.Label):
+            if run is not None:
+                leads[run.val] = operation
+            run = None
+            continue
+        if run is None:
+            run = operation
+        first[operation.val] = run
+
+    changed = False
+    for operation in operations:
+        label = targets(operation)
+        if label is None:
+            continue
+        seen = set()
+        label = first[label.val]
+        while label.val not in seen:
+            seen.add(label.val)
+            following = leads.get(label.val)
+            if not isinstance(following, ir.Goto):
+                break
+            label = first[following.val.val]
+        if label is not targets(operation):
+            retarget(operation, label)
+            changed = True
+    return changed
+
+
+def fold(block):
+    """Removes jumps to the next operation and turns
+
+        Jump(cond, skip); Goto(there); skip:
+
+    into Jump(not cond, there).  Returns True if anything changed."""
+    operations = block.operations
+    result = []
+    changed = False
+    at = 0
+    while at < len(operations):
+        operation = operations[at]
+        label = targets(operation)
+        if label is not None and label in following_labels(operations, at):
+            changed = True
+            at += 1
+            continue
+        if (isinstance(operation, ir.Jump) and at + 1 < len(operations) and
+                isinstance(operations[at + 1], ir.Goto) and
+                operation.target in following_labels(operations, at + 1)):
+            operation.operation = ir.NEGATED[operation.operation]
+            operation.target = operations[at + 1].val
+            if operation.expect is not None:
+                operation.expect = not operation.expect
+            result.append(operation)
+            changed = True
+            at += 2
+            continue
+        result.append(operation)
+        at += 1
+    block.operations = result
+    return changed
+
+
+def following_labels(operations, at):
+    """Returns the run of Labels right after operations[at]."""
+    found = []
+    for operation in operations[at + 1:]:
+        if not isinstance(operation, ir.Label):
+            break
+        found.append(operation)
+    return found
+
+
+def prune(block):
+    """Removes operations that can't be reached and labels that nothing
+    jumps to.  Enter and Exit are always kept.  Returns True if anything
+    was removed."""
+    operations = block.operations
+    reached = set()
+    while True:
+        kept = live(operations, reached)
+        found = set(targets(x).val for x in kept if targets(x) is not None)
+        if found <= reached:
+            break
+        reached |= found
+    kept = [x for x in kept
+            if not isinstance(x, ir.Label) or x.val in reached]
+    block.operations = kept
+    return len(kept) != len(operations)
+
+
+def live(operations, reached):
+    """Returns the operations that can run if the labels in reached can
+    be jumped to."""
+    kept = []
+    falls = True
+    for operation in operations:
+        if isinstance(operation, ir.Label) and operation.val in reached:
+            falls = True
+        if falls or isinstance(operation, (ir.Enter, ir.Exit)):
+            kept.append(operation)
+        if isinstance(operation, ir.Goto):
+            falls = False
+    return kept
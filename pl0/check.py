@@ -0,0 +1,199 @@
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Runs the PL/0 test programs and compares their output.
+
+Each tests/*.pl0 lists its expected output in `# Expect:` comments and
+may have a matching .in file that is fed to stdin.  A test is compiled
+with the driver, built into an executable with the runtime and run,
+and each of those stages is timed.  Generated code and executables are
+cached, so an unchanged test only pays for the run.
+"""
+
+import concurrent.futures
+import glob
+import json
+import os
+import subprocess
+import time
+import xml.etree.ElementTree as ElementTree
+
+from . import driver
+from . import runner
+from . import util
+
+FLAGS = ('-g', '-Og')
+TIMEOUT = 10
+
+STAGES = ('compile', 'build', 'run')
+
+
+class Test(util.ReprMixin):
+    __slots__ = 'name', 'path', 'source', 'expect', 'stdin'
+
+    def __init__(self, name, path, source, expect, stdin):
+        self.name = name
+        self.path = path
+        self.source = source
+        self.expect = expect
+        self.stdin = stdin
+
+
+class Result(util.ReprMixin):
+    """The outcome of a Test.
+
+    status is one of pass, fail, error or timeout.  times holds the
+    seconds spent in each of STAGES that was reached.
+    """
+    __slots__ = 'test', 'status', 'times', 'output', 'message'
+
+    def __init__(self, test):
+        self.test = test
+        self.status = 'error'
+        self.times = {}
+        self.output = None
+        self.message = None
+
+
+def expectations(source):
+    """Returns the words listed in source's `# Expect:` comments."""
+    expect = []
+    for line in source.splitlines():
+        _, found, rest = line.partition('# Expect:')
+        if found:
+            expect.extend(rest.split())
+    return expect
+
+
+def load(path):
+    with open(path, 'r') as f:
+        source = f.read()
+    stdin = b''
+    base = os.path.splitext(path)[0]
+    if os.path.exists(base + '.in'):
+        with open(base + '.in', 'rb') as f:
+            stdin = f.read()
+    return Test(os.path.basename(base), path, source, expectations(source),
+                stdin)
+
+
+def discover(directory='tests'):
+    return [load(x) for x in sorted(glob.glob(os.path.join(directory,
+                                                           '*.pl0')))]
+
+
+def run(test, backend='c', cache=None, timeout=TIMEOUT, flags=()):
+    """Compiles, builds and runs test, returning a Result."""
+    result = Result(test)
+    stage = None
+    start = time.perf_counter()
+
+    def lap(name):
+        nonlocal stage, start
+        now = time.perf_counter()
+        if stage is not None:
+            result.times[stage] = now - start
+        stage = name
+        start = now
+
+    try:
+        lap('compile')
+        source = driver.compile_cached(test.source, backend, cache, flags)
+        lap('build')
+        binary = runner.build(source, FLAGS,
+                              extension=driver.EXTENSIONS[backend],
+                              suffix='.elf')
+        lap('run')
+        done = subprocess.run([binary],
+                              input=test.stdin,
+                              stdout=subprocess.PIPE,
+                              stderr=subprocess.PIPE,
+                              timeout=timeout)
+        lap(None)
+    except subprocess.TimeoutExpired:
+        lap(None)
+        result.status = 'timeout'
+        result.message = 'Timed out after {} s'.format(timeout)
+        return result
+    except Exception as ex:
+        lap(None)
+        result.message = '{} failed: {}'.format(
+            list(result.times)[-1], str(ex) or ex.__class__.__name__)
+        return result
+
+    result.output = done.stdout.decode(errors='replace')
+    if done.returncode != 0:
+        result.status = 'fail'
+        result.message = 'Exited with {}'.format(done.returncode)
+    elif result.output.split() != test.expect:
+        result.status = 'fail'
+        result.message = 'Expected {} but got {}'.format(
+            ' '.join(test.expect), ' '.join(result.output.split()))
+    else:
+        result.status = 'pass'
+    return result
+
+
+def check(tests, backend='c', jobs=1, cache=None, timeout=TIMEOUT,
+          flags=()):
+    """Runs tests in a pool of jobs threads, yielding Results in order.
+
+    The work is in the C compiler and the test itself, so threads are
+    enough to keep every core busy.
+    """
+    with concurrent.futures.ThreadPoolExecutor(jobs) as executor:
+        yield from executor.map(
+            lambda x: run(x, backend, cache, timeout, flags), tests)
+
+
+def to_json(results):
+    return json.dumps(
+        [{'name': x.test.name,
+          'path': x.test.path,
+          'status': x.status,
+          'times': x.times,
+          'message': x.message} for x in results],
+        indent=2)
+
+
+def to_junit(results, name='pl0'):
+    suite = ElementTree.Element('testsuite', name=name)
+    counts = {'fail': 0, 'error': 0}
+    total = 0
+    for result in results:
+        elapsed = sum(result.times.values())
+        total += elapsed
+        case = ElementTree.SubElement(suite, 'testcase',
+                                      classname=name,
+                                      name=result.test.name,
+                                      file=result.test.path,
+                                      time='{:.6f}'.format(elapsed))
+        properties = ElementTree.SubElement(case, 'properties')
+        for stage, seconds in result.times.items():
+            ElementTree.SubElement(properties, 'property',
+                                   name=stage,
+                                   value='{:.6f}'.format(seconds))
+        if result.status == 'fail':
+            counts['fail'] += 1
+            ElementTree.SubElement(case, 'failure', message=result.message)
+        elif result.status != 'pass':
+            counts['error'] += 1
+            ElementTree.SubElement(case, 'error', message=result.message)
+        if result.output:
+            ElementTree.SubElement(case, 'system-out').text = result.output
+    suite.set('tests', str(len(results)))
+    suite.set('failures', str(counts['fail']))
+    suite.set('errors', str(counts['error']))
+    suite.set('time', '{:.6f}'.format(total))
+    return ElementTree.tostring(suite, encoding='unicode')
@@ -0,0 +1,154 @@
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""A thin client for pl0d that stands in for pl0.driver.
+
+Only the standard library is imported so that startup stays cheap.
+If no server is listening the source is compiled in-process instead.
+"""
+
+import json
+import os
+import socket
+import sys
+
+
+def socket_path():
+    default = os.path.join(
+        os.environ.get('XDG_RUNTIME_DIR', '/tmp'),
+        'pl0d-{}.sock'.format(os.getuid()))
+    return os.environ.get('PL0D_SOCKET', default)
+
+
+def request(sources, backend='c', path=None, flags=()):
+    """Compiles sources on the server, returning a response per source.
+
+    flags are as for pl0.driver.compile_source.  Raises OSError if the
+    server can't be reached.
+    """
+    conn = socket.socket(socket.AF_UNIX)
+    try:
+        conn.connect(path or socket_path())
+        payload = b''.join(
+            json.dumps({
+                'source': x,
+                'backend': backend,
+                'flags': list(flags)
+            }).encode() + b'\n' for x in sources)
+        conn.sendall(payload)
+        conn.shutdown(socket.SHUT_WR)
+        lines = conn.makefile('rb').read().splitlines()
+    finally:
+        conn.close()
+    if len(lines) != len(sources):
+        raise ConnectionError('pl0d closed the connection early')
+    return [json.loads(x) for x in lines]
+
+
+def compile_locally(sources, backend, flags=()):
+    from . import cache
+    from . import driver
+
+    responses = []
+    for src in sources:
+        try:
+            responses.append({'output': driver.compile_cached(
+                src, backend, cache.Cache(), flags)})
+        except Exception as ex:
+            responses.append({'error': str(ex) or ex.__class__.__name__})
+    return responses
+
+
+USAGE = ('usage: pl0.client [-o OUT] [-b BACKEND] [-j JOBS] '
+         '[--instrument {counts,cycles}] [--optimize] '
+         '[--profile-use PROFILE] [--socket PATH] [src ...]')
+
+
+def parse_args(argv):
+    """Parses the driver's compile options and --socket PATH, returning
+    (output, backend, socket, sources, flags).
+
+    Done by hand as importing argparse costs more than the request.
+    -j is accepted for compatibility but the server's pool sets how
+    many compiles run at once.
+    """
+    options = {'-o': None, '-b': 'c', '--socket': None, '-j': None,
+               '--instrument': None, '--profile-use': None}
+    switches = {'--optimize': False}
+    aliases = {'--backend': '-b', '--jobs': '-j'}
+    src = []
+    argv = list(argv)
+    while argv:
+        arg = argv.pop(0)
+        if arg.startswith('--') and '=' in arg:
+            arg, value = arg.split('=', 1)
+            argv.insert(0, value)
+        arg = aliases.get(arg, arg)
+        if arg in options and argv:
+            options[arg] = argv.pop(0)
+        elif arg in switches:
+            switches[arg] = True
+        elif arg.startswith('-') and arg != '-':
+            raise SystemExit(USAGE)
+        else:
+            src.append(arg)
+    if options['--instrument'] not in (None, 'counts', 'cycles'):
+        raise SystemExit(USAGE)
+    # As pl0.driver.Controller.flags.
+    flags = []
+    if options['--instrument']:
+        flags.append('instrument=' + options['--instrument'])
+    if options['--profile-use']:
+        flags.append('profile=' + os.path.abspath(options['--profile-use']))
+    elif switches['--optimize']:
+        flags.append('optimize')
+    return (options['-o'], options['-b'], options['--socket'], src,
+            tuple(flags))
+
+
+def main():
+    output, backend, path, names, flags = parse_args(sys.argv[1:])
+
+    if names:
+        sources = []
+        for name in names:
+            with open(name, 'r') as f:
+                sources.append(f.read())
+    else:
+        names = ['<stdin>']
+        sources = [sys.stdin.read()]
+
+    try:
+        responses = request(sources, backend, path, flags)
+    except OSError:
+        responses = compile_locally(sources, backend, flags)
+
+    out, status = [], 0
+    for name, response in zip(names, responses):
+        if 'error' in response:
+            print('{}: {}'.format(name, response['error']), file=sys.stderr)
+            status = 1
+        else:
+            out.append(response['output'])
+
+    if output:
+        with open(output, 'w') as f:
+            f.write(''.join(out))
+    else:
+        sys.stdout.write(''.join(out))
+    sys.exit(status)
+
+
+if __name__ == '__main__':
+    main()
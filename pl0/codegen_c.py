@@ -66,7 +66,18 @@ class CGenerator:
         self.emit_operation(cond)
 
     def emit_if(self, ifcmd):
-        self.cmd('if (!{}) goto {};'.format(ifcmd.left, ifcmd.target.val))
+        self.cmd('if (!{}) goto {};'.format(ifcmd.left.rvalue(),
+                                            ifcmd.target.val))
+
+    def emit_jump(self, jump):
+        if jump.right is None:
+            test = '{}({} & 1)'.format('' if jump.operation == 'odd' else '!',
+                                       jump.left.rvalue())
+        else:
+            test = '{} {} {}'.format(jump.left.rvalue(),
+                                     '==' if jump.operation == '=' else
+                                     jump.operation, jump.right.rvalue())
+        self.cmd('if ({}) goto {};'.format(test, jump.target.val))
 
     def emit_goto(self, goto):
         self.cmd('goto {};'.format(goto.val.val))
@@ -78,10 +89,13 @@ class CGenerator:
 
     def emit_call(self, call):
         if call.arg is not None:
-            self.cmd('{}({});'.format(call.name, call.arg))
+            self.cmd('{}({});'.format(call.name, call.arg.rvalue()))
         else:
             self.cmd('{}();'.format(call.name))
 
+    def emit_read(self, read):
+        self.cmd('{} = pl0_read();'.format(read.val.lvalue()))
+
     def cmd(self, msg: str):
         print(msg)
 
@@ -12,19 +12,168 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 #
-"""A code generator that emits C code."""
+"""A code generator that emits C code.
 
+Each expression is emitted as one C expression rather than a statement
+per intermediate, see trees().
+"""
+
+import collections
 import sys
 
 from . import lex
 from . import parser
 from . import ir
+from . import profile
+from . import structure
 from . import util
 
+# PL/0 comparisons that are spelt differently in C.
+OPERATORS = {'=': '=='}
+
+
+def parameters(block):
+    """Returns the C parameters of a procedure, a pointer per capture."""
+    return ', '.join('int_t* ' + x.pointer() for x in block.captures)
+
+
+def arguments(call, block):
+    """Returns the C arguments passing a call's captures from block.
+
+    Arrays are passed as a pointer to their first element.
+    """
+    arrays = set(x.val for x in block.vars_ if isinstance(x, ir.Array))
+    return ', '.join(
+        x.pointer() if isinstance(x, ir.Captured) else
+        x.val if x.val in arrays else '&' + x.val for x in call.captures)
+
+
+def element(array, index):
+    """Returns the C lvalue of array[index], where index is C."""
+    base = array.pointer() if isinstance(array, ir.Captured) else array.val
+    return '{}[{}]'.format(base, index)
+
+
+def comparison(left, operation, right):
+    """Returns the C test that left operation right holds, where
+    operation is as in ir.Jump and left and right are C."""
+    if operation == 'odd':
+        return '({} & 1)'.format(left)
+    if operation == 'even':
+        return '!({} & 1)'.format(left)
+    return '{} {} {}'.format(left, OPERATORS.get(operation, operation),
+                             right)
+
+
+def jumps(branch, value):
+    """Returns the C test that an ir.Branch jumps, where value returns
+    the C for an operand."""
+    if isinstance(branch, ir.If):
+        return '!{}'.format(value(branch.left))
+    return comparison(value(branch.left), branch.operation,
+                      value(branch.right))
+
+
+def holds(branch, value):
+    """Returns the C test that an ir.Branch falls through."""
+    if isinstance(branch, ir.If):
+        return value(branch.left)
+    return comparison(value(branch.left), ir.NEGATED[branch.operation],
+                      value(branch.right))
+
+
+def trees(operations):
+    """Returns the operations to emit as part of the expression that
+    uses their result, keyed by the idx of the intermediate they set.
+
+    IRGenerator gives each operation of an expression an intermediate
+    that the next one uses, so with these emitted in place a statement
+    is one line of C and the intermediates aren't declared.  An
+    operation qualifies if it is the only one to set its intermediate
+    and the only use is later in the same straight line code, with
+    nothing in between that changes what it reads.  Checks may come in
+    between unless the operation may trap dividing, as which way the
+    program stops mustn't change.
+    """
+    defined = collections.Counter(
+        x.idx for operation in operations for x in ir.defs(operation)
+        if isinstance(x, ir.Intermediate))
+    used = collections.Counter(
+        x.idx for operation in operations for x in ir.uses(operation)
+        if isinstance(x, ir.Intermediate))
+    found = {}
+    # The operation, the operands it reads, with those of the operations
+    # emitted in it, and whether any of them may trap, by intermediate.
+    pending = {}
+    for operation in operations:
+        reads = set(key(x) for x in ir.uses(operation)) - {None}
+        traps = divides(operation)
+        for operand in ir.uses(operation):
+            if (isinstance(operand, ir.Intermediate) and
+                    operand.idx in pending):
+                found[operand.idx], more, deep = pending.pop(operand.idx)
+                reads |= more
+                traps = traps or deep
+        results = ir.defs(operation)
+        if isinstance(operation, ir.Check):
+            pending = {k: v for k, v in pending.items() if not v[2]}
+        elif (not isinstance(operation, (ir.Operation, ir.Load)) or
+              not all(isinstance(x, ir.Intermediate) for x in results)):
+            pending = {}
+        written = set(key(x) for x in results)
+        pending = {k: v for k, v in pending.items() if not v[1] & written}
+        if (isinstance(operation, (ir.Operation, ir.Load)) and
+                isinstance(operation.result, ir.Intermediate) and
+                defined[operation.result.idx] == 1 and
+                used[operation.result.idx] == 1):
+            pending[operation.result.idx] = operation, reads, traps
+    return found
+
+
+def key(operand):
+    """Returns what names operand, or None for a Number."""
+    if isinstance(operand, ir.Intermediate):
+        return operand.idx
+    if isinstance(operand, ir.Captured):
+        return operand.key()
+    if isinstance(operand, ir.Variable):
+        return operand.val
+    return None
+
+
+def divides(operation):
+    """Returns whether operation may divide by zero or overflow doing
+    so."""
+    return (isinstance(operation, ir.Operation) and
+            operation.operation == '/' and
+            not (isinstance(operation.right, ir.Number) and
+                 operation.right.val not in (0, -1)))
+
+
+def declare(var):
+    """Returns the C declaration of a local or global, or None."""
+    if isinstance(var, ir.Array):
+        return 'int_t {}[{}];'.format(var.val, var.size)
+    if isinstance(var, ir.Intermediate):
+        return 'int_t t{};'.format(var.idx)
+    return 'int_t {};'.format(var.val)
+
 
 class RISCVGenerator:
-    def __init__(self, sink=sys.stdout):
+    """Emits C with labels and gotos.
+
+    instrument is a profile.Instrument or None.  When set the program
+    counts calls, loop iterations and branches and optionally times
+    procedures and loops; see pl0.profile.
+    """
+
+    def __init__(self, sink=sys.stdout, instrument=None):
         self.sink = sink
+        self.instrument = instrument
+        self.sites = {}
+        self.heads = set()
+        self.exits = {}
+        self.trees = {}
 
     def dispatch(self, node):
         if isinstance(node, (list, tuple)):
@@ -39,26 +188,56 @@ class RISCVGenerator:
 
     def emit_program(self, program):
         self.cmd('#include "pl0.h"')
+        if self.instrument:
+            self.emit_sites(profile.plan(program))
         main = program.blocks[-1]
         self.dispatch(main.vars_)
         self.dispatch(main.consts)
+        for block in program.blocks:
+            if block != main:
+                self.cmd('void {}({});'.format(block.name, parameters(block)))
         for block in program.blocks:
             if block != main:
                 self.dispatch(block)
-        self.block = main
+        self.enter_block(main)
         self.dispatch(main.operations)
 
+    def emit_sites(self, sites):
+        """Emits the counters and registers them with the runtime."""
+        self.sites = {x.key(): idx for idx, x in enumerate(sites)}
+        count = len(sites)
+        self.cmd('static unsigned long long pl0_counts[{}];'.format(2 * count))
+        self.cmd('static unsigned long long pl0_times[{}];'.format(2 * count))
+        self.cmd('static const pl0_site pl0_sites[] = {')
+        for site in sites:
+            self.cmd('{{"{}", "{}", {}}},'.format(site.kind, site.name,
+                                                  site.line))
+        self.cmd('};')
+        self.cmd('static pl0_profile pl0_data = {{"{}", {}, {}, pl0_sites, '
+                 'pl0_counts, pl0_times}};'.format(self.instrument.source,
+                                                  int(self.instrument.cycles),
+                                                  count))
+        self.cmd('__attribute__((constructor)) static void pl0_register() {')
+        self.cmd('pl0_profile_register(&pl0_data);')
+        self.cmd('}')
+
+    def enter_block(self, block):
+        self.block = block
+        self.trees = trees(block.operations)
+        if self.instrument:
+            self.heads, self.exits = profile.loops(block.operations)
+
     def emit_variables(self, variables):
         for var in variables:
-            if isinstance(var, ir.Variable):
-                self.cmd('int_t {};'.format(var.val))
+            if not isinstance(var, ir.Intermediate):
+                self.cmd(declare(var))
 
     def emit_constants(self, consts):
         for var in consts:
             self.cmd('const int_t {} = {};'.format(var.name, var.val))
 
     def emit_block(self, block):
-        self.block = block
+        self.enter_block(block)
         self.dispatch(block.operations)
 
     def emit_reserve(self, reserve):
@@ -66,22 +245,89 @@ class RISCVGenerator:
 
     def emit_enter(self, enter):
         name = self.block.name or 'run'
-        self.cmd('void {}() {{'.format(name))
+        self.cmd('void {}({}) {{'.format(name, parameters(self.block)))
         for var in self.block.vars_:
-            if isinstance(var, ir.Intermediate):
-                self.cmd('int_t t{};'.format(var.idx))
-            elif self.block.name is not None:
-                self.cmd('int_t {};'.format(var.val))
+            if isinstance(var, ir.Intermediate) and var.idx in self.trees:
+                continue
+            if (isinstance(var, ir.Intermediate) or
+                    self.block.name is not None):
+                self.cmd(declare(var))
+        if self.instrument:
+            self.emit_entered()
+
+    def emit_entered(self):
+        """Counts the call and starts the clocks of the block and its loops."""
+        site = self.site('procedure', self.block.name or 'main')
+        if self.instrument.cycles:
+            for idx in [site] + [self.site('loop', x) for x in sorted(
+                    self.heads)]:
+                self.cmd('unsigned long long pl0_s{0}, pl0_o{0};'.format(idx))
+            self.start(site)
+        self.count(site, 0)
+
+    def site(self, kind, name):
+        return self.sites[kind, name]
+
+    def count(self, site, which):
+        self.cmd('pl0_counts[{}]++;'.format(2 * site + which))
+
+    def start(self, site):
+        self.cmd('pl0_enter(&pl0_s{0}, &pl0_o{0});'.format(site))
+
+    def stop(self, site):
+        if self.instrument.cycles:
+            self.cmd('pl0_leave(pl0_times + {0}, pl0_s{1}, pl0_o{1});'.format(
+                2 * site, site))
+
+    def value(self, operand, whole=False):
+        """Returns the C for operand, computing it in place if it is the
+        result of one of trees.  whole is True where it needs no
+        parentheses."""
+        if operand is None:
+            return None
+        operation = None
+        if isinstance(operand, ir.Intermediate):
+            operation = self.trees.get(operand.idx)
+        if operation is None:
+            return operand.rvalue()
+        if isinstance(operation, ir.Load):
+            return element(operation.array, self.value(operation.index,
+                                                       True))
+        if isinstance(operation, ir.Assign) or operation.right is None:
+            return self.value(operation.left, whole)
+        text = '{} {} {}'.format(
+            self.value(operation.left),
+            OPERATORS.get(operation.operation, operation.operation),
+            self.value(operation.right))
+        return text if whole else '({})'.format(text)
+
+    def inline(self, operation):
+        """Returns whether operation is emitted where its result is used."""
+        return any(isinstance(x, ir.Intermediate) and
+                   self.trees.get(x.idx) is operation
+                   for x in ir.defs(operation))
 
     def emit_assign(self, assign):
-        self.cmd('{} = {};'.format(assign.result.lvalue(), assign.left.rvalue(
-        )))
+        if self.inline(assign):
+            return
+        self.cmd('{} = {};'.format(assign.result.lvalue(),
+                                   self.value(assign.left, True)))
 
     def emit_exit(self, exit_):
+        if self.instrument:
+            self.stop(self.site('procedure', self.block.name or 'main'))
         self.cmd('}')
 
     def emit_label(self, label):
+        if self.instrument and label.val in self.heads:
+            # Only reached by falling in, as the back edge jumps past.
+            site = self.site('loop', label.val)
+            if self.instrument.cycles:
+                self.start(site)
+            self.count(site, 0)
         self.cmd('{}: ;'.format(label.val))
+        if self.instrument and label.val in self.exits:
+            self.stop(self.site('loop', self.exits[label.val]))
 
     def emit_const(self, const):
         self.cmd('const int_t {} = {};'.format(const.name, const.val))
@@ -90,21 +336,61 @@ class RISCVGenerator:
         self.emit_operation(cond)
 
     def emit_if(self, ifcmd):
-        self.cmd('if (!{}) goto {};'.format(ifcmd.left, ifcmd.target.val))
+        self.branch(ifcmd)
+
+    def emit_jump(self, jump):
+        self.branch(jump)
+
+    def branch(self, branch):
+        counted = self.instrument and branch.target.val not in self.exits
+        if counted:
+            site = self.site('branch', branch.target.val)
+            self.count(site, 0)
+        test = jumps(branch, self.value)
+        if branch.expect is not None:
+            test = '__builtin_expect({}, {})'.format(test,
+                                                    int(not branch.expect))
+        self.cmd('if ({}) goto {};'.format(test, branch.target.val))
+        if counted:
+            self.count(site, 1)
 
     def emit_goto(self, goto):
+        if self.instrument and goto.val.val in self.heads:
+            self.count(self.site('loop', goto.val.val), 1)
         self.cmd('goto {};'.format(goto.val.val))
 
     def emit_operation(self, operation):
-        self.cmd('{} = {} {} {};'.format(operation.result.lvalue(
-        ), operation.left.rvalue(), operation.operation,
-                                         operation.right.rvalue()))
+        if self.inline(operation):
+            return
+        self.cmd('{} = {} {} {};'.format(
+            operation.result.lvalue(), self.value(operation.left),
+            OPERATORS.get(operation.operation, operation.operation),
+            self.value(operation.right)))
 
     def emit_call(self, call):
         if call.arg is not None:
-            self.cmd('{}({});'.format(call.name, call.arg))
+            self.cmd('{}({});'.format(call.name, self.value(call.arg, True)))
         else:
-            self.cmd('{}();'.format(call.name))
+            self.cmd('{}({});'.format(call.name,
+                                      arguments(call, self.block)))
+
+    def emit_read(self, read):
+        self.cmd('{} = pl0_read();'.format(read.val.lvalue()))
+
+    def emit_load(self, load):
+        if self.inline(load):
+            return
+        self.cmd('{} = {};'.format(load.result.lvalue(), element(
+            load.array, self.value(load.index, True))))
+
+    def emit_store(self, store):
+        self.cmd('{} = {};'.format(
+            element(store.array, self.value(store.index, True)),
+            self.value(store.value, True)))
+
+    def emit_check(self, check):
+        self.cmd('pl0_check({}, {}, {});'.format(
+            self.value(check.index, True), check.size, check.line or 0))
 
     def cmd(self, msg: str):
         print(msg, file=self.sink)
@@ -113,6 +399,91 @@ class RISCVGenerator:
         print('// {}{}'.format('  ' * indent, msg), file=sys.sink)
 
 
+class StructuredGenerator(RISCVGenerator):
+    """Emits WHILE and IF as C blocks in a single translation unit.
+
+    Procedures and globals are static so that the C compiler is free
+    to inline, unroll and keep globals in registers.  Blocks whose
+    control flow can't be rebuilt fall back to labels and gotos.
+    """
+
+    def __init__(self, sink=sys.stdout):
+        super().__init__(sink)
+        self.depth = 0
+
+    def emit_program(self, program):
+        self.cmd('#include "pl0.h"')
+        main = program.blocks[-1]
+        self.dispatch(main.vars_)
+        self.dispatch(main.consts)
+        for block in program.blocks:
+            if block != main:
+                self.cmd('static void {}({});'.format(block.name,
+                                                      parameters(block)))
+        for block in program.blocks:
+            if block != main:
+                self.dispatch(block)
+        self.dispatch(main)
+
+    def emit_variables(self, variables):
+        for var in variables:
+            if not isinstance(var, ir.Intermediate):
+                self.cmd('static ' + declare(var))
+
+    def emit_constants(self, consts):
+        for var in consts:
+            self.cmd('static const int_t {} = {};'.format(var.name, var.val))
+
+    def emit_block(self, block):
+        self.enter_block(block)
+        try:
+            tree = structure.structure(block.operations)
+        except structure.Unstructured:
+            tree = block.operations
+        self.dispatch(tree)
+
+    def emit_enter(self, enter):
+        if self.block.name is not None:
+            self.cmd('static void {}({}) {{'.format(
+                self.block.name, parameters(self.block)))
+        else:
+            self.cmd('void run() {')
+        self.depth += 1
+        for var in self.block.vars_:
+            if isinstance(var, ir.Intermediate) and var.idx in self.trees:
+                continue
+            if (isinstance(var, ir.Intermediate) or
+                    self.block.name is not None):
+                self.cmd(declare(var))
+
+    def emit_exit(self, exit_):
+        self.depth -= 1
+        self.cmd('}')
+
+    def emit_loop(self, loop):
+        if all(self.inline(x) for x in loop.head):
+            self.cmd('while ({}) {{'.format(holds(loop.cond, self.value)))
+            self.depth += 1
+        else:
+            self.cmd('for (;;) {')
+            self.depth += 1
+            self.dispatch(loop.head)
+            self.cmd('if ({}) break;'.format(jumps(loop.cond, self.value)))
+        self.dispatch(loop.body)
+        self.depth -= 1
+        self.cmd('}')
+
+    def emit_conditional(self, conditional):
+        self.cmd('if ({}) {{'.format(holds(conditional.cond, self.value)))
+        self.depth += 1
+        self.dispatch(conditional.body)
+        self.depth -= 1
+        self.cmd('}')
+
+    def cmd(self, msg: str):
+        print('{}{}'.format('    ' * self.depth, msg), file=self.sink)
+
+
 def codegen(program):
     irgen = ir.IRGenerator()
     irf = irgen.dispatch(program)
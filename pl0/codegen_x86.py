@@ -0,0 +1,313 @@
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""A code generator that emits x86-64 assembly (System V, GNU as)."""
+
+import sys
+
+from . import lex
+from . import parser
+from . import ir
+from . import regalloc
+from . import util
+
+# Registers handed out to intermediates.  %eax, %ecx and %edx are kept
+# back as scratch for division, comparisons and memory to memory moves.
+SCRATCH = 'rsi', 'rdi', 'r8', 'r9', 'r10', 'r11'
+PRESERVED = 'rbx', 'r12', 'r13', 'r14', 'r15'
+
+REG32 = {
+    'rax': 'eax',
+    'rbx': 'ebx',
+    'rcx': 'ecx',
+    'rdx': 'edx',
+    'rsi': 'esi',
+    'rdi': 'edi',
+    'r8': 'r8d',
+    'r9': 'r9d',
+    'r10': 'r10d',
+    'r11': 'r11d',
+    'r12': 'r12d',
+    'r13': 'r13d',
+    'r14': 'r14d',
+    'r15': 'r15d',
+}
+
+ARITHMETIC = {'+': 'addl', '-': 'subl', '*': 'imull', '&': 'andl'}
+
+SETCC = {
+    '=': 'sete',
+    '!=': 'setne',
+    '<': 'setl',
+    '<=': 'setle',
+    '>': 'setg',
+    '>=': 'setge',
+}
+
+# The jump taken when an ir.Jump's operation holds, after a cmpl or,
+# for odd and even, a testl of the low bit.
+JCC = {
+    '=': 'je',
+    '!=': 'jne',
+    '<': 'jl',
+    '<=': 'jle',
+    '>': 'jg',
+    '>=': 'jge',
+    'odd': 'jne',
+    'even': 'je',
+}
+
+
+def mangle(name, args='v'):
+    """Returns the Itanium C++ ABI name of a runtime function."""
+    return '_Z{}{}{}'.format(len(name), name, args)
+
+
+class X86Generator:
+    def __init__(self, sink=sys.stdout):
+        self.sink = sink
+        self.block = None
+        self.main = None
+        self.locations = {}
+        self.captures = {}
+        self.saved = []
+
+    def dispatch(self, node):
+        if isinstance(node, (list, tuple)):
+            for item in node:
+                self.dispatch(item)
+        else:
+            target = 'emit_{}'.format(util.typename(node))
+            return getattr(self, target)(node)
+
+    def emit_note(self, note):
+        self.note(note.text, note.indent)
+
+    def emit_program(self, program):
+        if ir.arrays(program):
+            raise ValueError('The x86 backend doesn\'t support arrays')
+        self.main = program.blocks[-1]
+        self.cmd('.text')
+        for block in program.blocks:
+            self.dispatch(block)
+        self.dispatch(self.main.vars_)
+        self.cmd('.section .note.GNU-stack,"",@progbits')
+
+    def emit_variables(self, variables):
+        names = [x.val for x in variables if isinstance(x, ir.Variable)]
+        if not names:
+            return
+        self.cmd('.bss')
+        self.cmd('.align 4')
+        for name in names:
+            self.label(name)
+            self.cmd('.zero 4')
+
+    def emit_block(self, block):
+        self.block = block
+        intervals = regalloc.allocate(block.operations, SCRATCH, PRESERVED)
+        self.saved = sorted(
+            set(x.location for x in intervals.values()
+                if x.location in PRESERVED),
+            key=PRESERVED.index)
+
+        self.locations = {}
+        # Pointers to captured locals are passed on the stack.
+        self.captures = {x.key(): 16 + 8 * idx
+                         for idx, x in enumerate(block.captures)}
+        offset = 8 * len(self.saved)
+        if block is not self.main:
+            for var in block.vars_:
+                if isinstance(var, ir.Variable):
+                    offset += 4
+                    self.locations[var.val] = '-{}(%rbp)'.format(offset)
+        for idx, interval in intervals.items():
+            if interval.location is None:
+                offset += 4
+                self.locations[idx] = '-{}(%rbp)'.format(offset)
+            else:
+                self.locations[idx] = '%' + REG32[interval.location]
+        self.frame = -offset % 16 + offset - 8 * len(self.saved)
+
+        self.dispatch(block.operations)
+
+    def operand(self, operand):
+        """Returns the assembler form of an operand."""
+        if isinstance(operand, ir.Number):
+            return '${}'.format(operand.val)
+        if isinstance(operand, ir.Intermediate):
+            return self.locations[operand.idx]
+        if isinstance(operand, ir.Captured):
+            self.cmd('movq {}(%rbp), %rcx'.format(self.captures[operand.key(
+            )]))
+            return '(%rcx)'
+        if operand.val in self.locations:
+            return self.locations[operand.val]
+        for block in (self.block, self.main):
+            for const in block.consts:
+                if const.name == operand.val:
+                    return '${}'.format(const.val)
+        for var in self.main.vars_:
+            if isinstance(var, ir.Variable) and var.val == operand.val:
+                return '{}(%rip)'.format(var.val)
+        raise KeyError('Undefined variable {}'.format(operand.val))
+
+    def load(self, operand, register):
+        """Moves an operand into a register, returning the register."""
+        src = self.operand(operand)
+        if src != register:
+            self.cmd('movl {}, {}'.format(src, register))
+        return register
+
+    def store(self, register, operand):
+        dest = self.operand(operand)
+        if dest != register:
+            self.cmd('movl {}, {}'.format(register, dest))
+
+    def emit_enter(self, enter):
+        name = self.block.name or 'run'
+        if self.block is self.main:
+            name = mangle(name)
+            self.cmd('.globl {}'.format(name))
+        self.cmd('.type {}, @function'.format(name))
+        self.label(name)
+        self.cmd('pushq %rbp')
+        self.cmd('movq %rsp, %rbp')
+        for register in self.saved:
+            self.cmd('pushq %{}'.format(register))
+        if self.frame:
+            self.cmd('subq ${}, %rsp'.format(self.frame))
+
+    def emit_exit(self, exit_):
+        if self.saved:
+            self.cmd('leaq -{}(%rbp), %rsp'.format(8 * len(self.saved)))
+        else:
+            self.cmd('movq %rbp, %rsp')
+        for register in reversed(self.saved):
+            self.cmd('popq %{}'.format(register))
+        self.cmd('popq %rbp')
+        self.cmd('ret')
+
+    def emit_assign(self, assign):
+        src = self.operand(assign.left)
+        if not src.startswith('%') and not src.startswith('$'):
+            # Memory to memory goes through a register.
+            self.cmd('movl {}, %eax'.format(src))
+            src = '%eax'
+        self.store(src, assign.result)
+
+    def emit_label(self, label):
+        self.label('.L{}'.format(label.val))
+
+    def emit_const(self, const):
+        pass
+
+    def emit_condition(self, cond):
+        self.load(cond.left, '%eax')
+        self.cmd('cmpl {}, %eax'.format(self.operand(cond.right)))
+        self.cmd('{} %al'.format(SETCC[cond.operation]))
+        self.cmd('movzbl %al, %eax')
+        self.store('%eax', cond.result)
+
+    def emit_if(self, ifcmd):
+        target = '.L{}'.format(ifcmd.target.val)
+        if isinstance(ifcmd.left, ir.Number):
+            if not ifcmd.left.val:
+                self.cmd('jmp {}'.format(target))
+            return
+        self.cmd('cmpl $0, {}'.format(self.operand(ifcmd.left)))
+        self.cmd('je {}'.format(target))
+
+    def emit_jump(self, jump):
+        left = None
+        if isinstance(jump.left, ir.Intermediate):
+            left = self.operand(jump.left)
+        if left is None or not left.startswith('%'):
+            left = self.load(jump.left, '%eax')
+        if jump.right is None:
+            self.cmd('testl $1, {}'.format(left))
+        else:
+            self.cmd('cmpl {}, {}'.format(self.operand(jump.right), left))
+        self.cmd('{} .L{}'.format(JCC[jump.operation], jump.target.val))
+
+    def emit_goto(self, goto):
+        self.cmd('jmp .L{}'.format(goto.val.val))
+
+    def emit_operation(self, operation):
+        dest = self.operand(operation.result)
+        if operation.operation == '/':
+            self.load(operation.left, '%eax')
+            self.cmd('cltd')
+            divisor = self.operand(operation.right)
+            if divisor.startswith('$'):
+                divisor = self.load(operation.right, '%ecx')
+            self.cmd('idivl {}'.format(divisor))
+            self.store('%eax', operation.result)
+            return
+
+        register = dest if dest.startswith('%') else '%eax'
+        self.load(operation.left, register)
+        self.cmd('{} {}, {}'.format(ARITHMETIC[operation.operation],
+                                    self.operand(operation.right), register))
+        self.store(register, operation.result)
+
+    def emit_call(self, call):
+        if call.arg is not None:
+            self.load(call.arg, '%edi')
+            self.cmd('call {}'.format(mangle(call.name, 'i')))
+        else:
+            self.pass_captures(call)
+            self.cmd('call {}'.format(call.name))
+            if call.captures:
+                self.cmd('addq ${}, %rsp'.format(
+                    8 * (len(call.captures) + len(call.captures) % 2)))
+
+    def pass_captures(self, call):
+        """Pushes the pointers for call, keeping the stack aligned."""
+        if len(call.captures) % 2:
+            self.cmd('subq $8, %rsp')
+        for operand in reversed(call.captures):
+            if isinstance(operand, ir.Captured):
+                self.cmd('pushq {}(%rbp)'.format(self.captures[operand.key(
+                )]))
+            else:
+                self.cmd('leaq {}, %rax'.format(self.operand(operand)))
+                self.cmd('pushq %rax')
+
+    def emit_read(self, read):
+        self.cmd('call {}'.format(mangle('pl0_read')))
+        self.store('%eax', read.val)
+
+    def label(self, name):
+        print('{}:'.format(name), file=self.sink)
+
+    def cmd(self, msg: str):
+        print('\t{}'.format(msg), file=self.sink)
+
+    def note(self, msg: str, indent=0):
+        print('# {}{}'.format('  ' * indent, msg), file=self.sink)
+
+
+def codegen(program):
+    irf = ir.IRGenerator().dispatch(program)
+    X86Generator().dispatch(irf)
+
+
+def main():
+    program = parser.parse(lex.lex(sys.stdin.read()))
+    codegen(program)
+
+
+if __name__ == '__main__':
+    main()
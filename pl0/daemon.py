@@ -0,0 +1,144 @@
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""pl0d: a compile server that keeps the compiler warm.
+
+Requests arrive on a Unix socket as one JSON object per line:
+
+    {"source": "...", "backend": "c", "flags": ["optimize"]}
+
+and are answered in order with either {"output": "..."} or
+{"error": "..."}.  flags are as for pl0.driver.compile_source and may
+be left out.  Compiles run in a pool of worker processes that have the
+compiler already imported, and share the driver's output cache.
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import os
+import signal
+import socket
+
+from . import cache
+from . import client
+from . import driver
+
+# The output cache of this worker, made on its first request.
+CACHE = None
+
+
+def handle(request):
+    """Runs one request in a worker."""
+    global CACHE
+    if CACHE is None:
+        CACHE = cache.Cache()
+    try:
+        output = driver.compile_cached(request['source'],
+                                       request.get('backend', 'c'), CACHE,
+                                       tuple(request.get('flags', ())))
+        return {'output': output}
+    except Exception as ex:
+        return {'error': str(ex) or ex.__class__.__name__}
+
+
+class Server:
+    def __init__(self, path, jobs):
+        self.path = path
+        self.jobs = jobs
+        self.pool = concurrent.futures.ProcessPoolExecutor(jobs)
+
+    def warm(self):
+        """Starts the workers.
+
+        Done before serving as forking once the event loop and its
+        threads are running can deadlock the children.
+        """
+        warm = [self.pool.submit(handle, {'source': '.'})
+                for _ in range(self.jobs)]
+        concurrent.futures.wait(warm)
+
+    async def serve(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                except ValueError as ex:
+                    response = {'error': 'Bad request: {}'.format(ex)}
+                else:
+                    response = await loop.run_in_executor(
+                        self.pool, handle, request)
+                writer.write(json.dumps(response).encode() + b'\n')
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def listen(self):
+        server = await asyncio.start_unix_server(self.serve,
+                                                 path=self.path,
+                                                 limit=1 << 26)
+        os.chmod(self.path, 0o600)
+        return server
+
+    async def run(self):
+        server = await self.listen()
+        stop = asyncio.get_running_loop().create_future()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            asyncio.get_running_loop().add_signal_handler(
+                signum, stop.set_result, None)
+        async with server:
+            await stop
+
+
+def remove_stale(path):
+    """Removes a socket left behind by a server that has gone away."""
+    if not os.path.exists(path):
+        return
+    probe = socket.socket(socket.AF_UNIX)
+    try:
+        probe.connect(path)
+    except OSError:
+        os.unlink(path)
+    else:
+        raise SystemExit('pl0d is already listening on {}'.format(path))
+    finally:
+        probe.close()
+
+
+def main():
+    args = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    args.add_argument('--socket', default=client.socket_path())
+    args.add_argument('-j', '--jobs', type=int, default=0,
+                      help='worker processes, 0 for one per CPU')
+    pargs = args.parse_args()
+
+    remove_stale(pargs.socket)
+    server = Server(pargs.socket, pargs.jobs or os.cpu_count())
+    server.warm()
+    try:
+        asyncio.run(server.run())
+    finally:
+        server.pool.shutdown()
+        cache.Cache().evict()
+        if os.path.exists(pargs.socket):
+            os.unlink(pargs.socket)
+
+
+if __name__ == '__main__':
+    main()
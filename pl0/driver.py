@@ -12,18 +12,221 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 #
+import concurrent.futures
+import hashlib
 import io
+import itertools
+import os
 import sys
+import time
 
+from . import batch
+from . import bounds
+from . import cache
+from . import cfg
+from . import check
 from . import lex
 from . import parser
+from . import pgo
+from . import profile
+from . import promote
+from . import propagate
 from . import ir
 from . import codegen_riscv
+from . import codegen_x86
+from . import runner
+from . import serialize
+from . import strip
 from . import util
 
 from cement.core.foundation import CementApp
 from cement.core.controller import CementBaseController, expose
 
+BACKENDS = {
+    'c': codegen_riscv.RISCVGenerator,
+    'structured': codegen_riscv.StructuredGenerator,
+    'x86': codegen_x86.X86Generator,
+}
+
+EXTENSIONS = {
+    'c': '.cc',
+    'structured': '.cc',
+    'x86': '.s',
+}
+
+
+def generator(src, program, backend, flags, sink):
+    """Makes the code generator for backend with the given flags.
+
+    flags is a tuple of 'name=value' strings.  They are part of the
+    cache key, so all options that change the output go through here.
+    """
+    options, _ = prepare(src, program, backend, flags)
+    return BACKENDS[backend](sink, **options)
+
+
+def prepare(src, program, backend, flags):
+    """Applies flags and the passes backend wants to program in place.
+
+    Returns the options for the backend's generator and the
+    strip.Report of what was left out.  src is None if the program was
+    loaded from saved IR.
+    """
+    names = [x.partition('=')[0] for x in flags]
+    if 'instrument' in names and len(names) > 1:
+        raise ValueError('Instrumented builds can\'t be optimised')
+    if src is None and ('instrument' in names or 'profile' in names):
+        raise ValueError('Profiles need the PL/0 source, not saved IR')
+    options = {}
+    for flag in flags:
+        name, _, value = flag.partition('=')
+        if name == 'instrument':
+            if backend != 'c':
+                raise ValueError('Only the c backend can be instrumented')
+            options['instrument'] = profile.Instrument(
+                value == 'cycles', profile.fingerprint(src))
+        elif name == 'optimize':
+            pgo.optimize(program)
+        elif name == 'profile':
+            pgo.optimize(program, pgo.load(value, src, program))
+        else:
+            raise ValueError('Unknown flag {}'.format(flag))
+    # Instrumented builds count every procedure, loop and branch as
+    # written.
+    stripped = strip.measure(program)
+    if 'instrument' not in names:
+        propagate.propagate(program)
+        strip.strip(program, stripped)
+    # The structured backend needs the loops as IRGenerator made them.
+    # The C compiler can keep its static globals in registers itself.
+    if backend != 'structured' and 'instrument' not in names:
+        promote.promote(program)
+        cfg.simplify(program)
+    return options, stripped
+
+
+def cache_flags(flags):
+    """Returns flags with the files they name replaced by their hash."""
+    keyed = []
+    for flag in flags:
+        name, _, value = flag.partition('=')
+        if name == 'profile' and os.path.exists(value):
+            with open(value, 'rb') as f:
+                value = hashlib.sha256(f.read()).hexdigest()
+        keyed.append('{}={}'.format(name, value) if value else name)
+    return tuple(keyed)
+
+
+def lower(src):
+    """Returns the ir.Program for PL/0 source, ready for a backend."""
+    tokens = lex.lex(src)
+    ast = parser.parse(tokens)
+    return bounds.hoist(ir.IRGenerator().dispatch(ast))
+
+
+def compile_source(src, backend='c', flags=()):
+    """Compiles PL/0 source with the given backend, returning the text."""
+    return compile_program(lower(src), backend, flags, src)
+
+
+def compile_program(program, backend='c', flags=(), src=None):
+    """Compiles an ir.Program made by lower(), returning the text.
+
+    src is the source it was lowered from, which profiles need.
+    """
+    sink = io.StringIO()
+    generator(src, program, backend, flags, sink).dispatch(program)
+    return sink.getvalue()
+
+
+def compile_cached(src, backend='c', cache=None, flags=()):
+    """Like compile_source but returns the cached output if there is one."""
+    if cache is None:
+        return compile_source(src, backend, flags)
+    key = cache.key(src, backend, cache_flags(flags))
+    output = cache.get(key)
+    if output is None:
+        output = compile_source(src, backend, flags)
+        cache.put(key, output)
+    return output
+
+
+def read(path):
+    """Returns the contents of the PL/0 source or saved IR at path, as
+    text or bytes respectively."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if serialize.recognise(data):
+        return data
+    return io.TextIOWrapper(io.BytesIO(data)).read()
+
+
+def compile_file(path, backend='c', flags=()):
+    """Compiles a file, returning (path, output, error)."""
+    try:
+        contents = read(path)
+        if isinstance(contents, bytes):
+            output = compile_program(serialize.loads(contents), backend,
+                                     flags)
+        else:
+            output = compile_source(contents, backend, flags)
+        return path, output, None
+    except Exception as ex:
+        return path, None, str(ex) or ex.__class__.__name__
+
+
+def compile_files(paths, backend='c', jobs=1, cache=None, flags=()):
+    """Compiles files in order, yielding (path, output, error).
+
+    With more than one job the files are compiled in a process pool
+    and each result is yielded as soon as it and those before it are
+    done.  Cache hits are looked up here and never reach the pool.
+    """
+    if cache is None:
+        yield from _compile_files(paths, backend, jobs, flags)
+        return
+
+    keyed = cache_flags(flags)
+    keys = []
+    outputs = []
+    for path in paths:
+        try:
+            contents = read(path)
+            if isinstance(contents, bytes):
+                contents = 'ir ' + hashlib.sha256(contents).hexdigest()
+            key = cache.key(contents, backend, keyed)
+        except OSError:
+            # Let compile_file report it.
+            key = None
+        keys.append(key)
+        outputs.append(key and cache.get(key))
+
+    misses = [x for x, y in zip(paths, outputs) if y is None]
+    results = _compile_files(misses, backend, jobs, flags)
+    for path, key, output in zip(paths, keys, outputs):
+        if output is not None:
+            yield path, output, None
+            continue
+        path, output, error = next(results)
+        if error is None and key is not None:
+            cache.put(key, output)
+        yield path, output, error
+
+
+def _compile_files(paths, backend, jobs, flags):
+    if jobs == 1 or len(paths) < 2:
+        yield from map(compile_file, paths, itertools.repeat(backend),
+                       itertools.repeat(flags))
+        return
+
+    chunksize = max(1, len(paths) // (jobs * 8))
+    with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+        yield from executor.map(compile_file,
+                                paths,
+                                itertools.repeat(backend),
+                                itertools.repeat(flags),
+                                chunksize=chunksize)
+
 
 class Controller(CementBaseController):
     class Meta:
@@ -32,39 +235,323 @@ class Controller(CementBaseController):
         arguments = [
             (['-o'], dict(action='store',
                           help='output filename')),
+            (['-b', '--backend'], dict(action='store',
+                                       default='c',
+                                       choices=sorted(BACKENDS),
+                                       help='code generator to use')),
+            (['-j', '--jobs'], dict(action='store',
+                                    type=int,
+                                    help='compile in N processes, 0 for '
+                                    'one per CPU.  check defaults to 0 '
+                                    'and everything else to 1')),
+            (['--no-cache'], dict(action='store_true',
+                                  help='always compile, bypassing the '
+                                  'output cache')),
+            (['--cache-stats'], dict(action='store_true',
+                                     help='print cache statistics to '
+                                     'stderr')),
+            (['--instrument'], dict(action='store',
+                                    choices=('counts', 'cycles'),
+                                    help='c: count calls, loop iterations '
+                                    'and branches, and with cycles time '
+                                    'procedures and loops too')),
+            (['--optimize'], dict(action='store_true',
+                                  help='inline, unroll and lay out using '
+                                  'estimated counts')),
+            (['--profile-use'], dict(action='store',
+                                     metavar='PROFILE',
+                                     help='optimise using the counts in a '
+                                     'profile written by an --instrument '
+                                     'build')),
+            (['--timeout'], dict(action='store',
+                                 type=float,
+                                 help='check and batch: seconds each test '
+                                 'or job may run')),
+            (['--engine'], dict(action='store',
+                                choices=batch.ENGINES,
+                                help='batch: how to run each job, by '
+                                'default serve')),
+            (['--chunk'], dict(action='store',
+                               type=int,
+                               help='batch: jobs per task, by default 1 '
+                               'or 4096 with --engine vector')),
+            (['--stats'], dict(action='store_true',
+                               help='batch: print throughput and latency '
+                               'to stderr')),
+            (['--binary'], dict(action='store_true',
+                                help='lower: write binary IR')),
+            (['--junit'], dict(action='store',
+                               help='check: write a JUnit XML report')),
+            (['--json'], dict(action='store',
+                              help='check: write a JSON report')),
             (['src'], dict(action='store', nargs='*')),
         ]
 
     @expose(hide=True)
     def default(self):
-        out = ''
+        try:
+            self.compile()
+        finally:
+            self.report()
 
-        if not self.app.pargs.src:
+    def compile(self):
+        pargs = self.app.pargs
+        if not pargs.src:
             out = self.gen(sys.stdin.read())
+            if pargs.o:
+                with open(pargs.o, 'w') as f:
+                    f.write(out)
+            else:
+                sys.stdout.write(out)
+            return
+
+        results = compile_files(pargs.src, pargs.backend, self.jobs(1),
+                                self.cache(), self.flags())
+        if pargs.o and (os.path.isdir(pargs.o) or pargs.o.endswith(os.sep)):
+            self.write_each(results, pargs.o)
+        elif pargs.o:
+            with open(pargs.o, 'w') as f:
+                self.write_all(results, f)
         else:
-            for src in self.app.pargs.src:
-                with open(src, 'r') as f:
-                    out += self.gen(f.read())
+            self.write_all(results, sys.stdout)
+
+    def write_all(self, results, sink):
+        for path, out, error in results:
+            if self.check_result(path, error):
+                sink.write(out)
+                sink.flush()
+
+    def write_each(self, results, directory):
+        """Writes each result to its own file in directory."""
+        extension = EXTENSIONS[self.app.pargs.backend]
+        os.makedirs(directory, exist_ok=True)
+        names = [os.path.splitext(os.path.basename(x))[0]
+                 for x in self.app.pargs.src]
+        if len(set(names)) != len(names):
+            print('Sources must have unique names with -o DIR',
+                  file=sys.stderr)
+            self.app.exit_code = 1
+            return
+
+        for path, out, error in results:
+            if self.check_result(path, error):
+                name = os.path.splitext(os.path.basename(path))[0]
+                with open(os.path.join(directory, name + extension),
+                          'w') as f:
+                    f.write(out)
 
-        if self.app.pargs.o:
-            with open(self.app.pargs.o, 'w') as f:
-                f.write(out)
+    def check_result(self, path, error):
+        """Reports a failed compile, returning True on success."""
+        if error is None:
+            return True
+        print('{}: {}'.format(path, error), file=sys.stderr)
+        self.app.exit_code = 1
+        return False
+
+    def jobs(self, default):
+        jobs = self.app.pargs.jobs
+        if jobs is None:
+            jobs = default
+        return jobs or os.cpu_count()
+
+    def flags(self):
+        """Returns the code generator flags set on the command line."""
+        pargs = self.app.pargs
+        flags = []
+        if pargs.instrument:
+            flags.append('instrument=' + pargs.instrument)
+        if pargs.profile_use:
+            flags.append('profile=' + os.path.abspath(pargs.profile_use))
+        elif pargs.optimize:
+            flags.append('optimize')
+        return tuple(flags)
+
+    def cache(self):
+        """Returns the output cache, or None with --no-cache."""
+        if self.app.pargs.no_cache:
+            return None
+        if not hasattr(self, '_cache'):
+            self._cache = cache.Cache()
+        return self._cache
+
+    def report(self):
+        cache = self.cache()
+        if cache is None:
+            return
+        cache.evict()
+        if self.app.pargs.cache_stats:
+            print('{} in {}'.format(cache.stats(), cache.directory),
+                  file=sys.stderr)
+
+    @expose(help='compile to a shared object and run it in-process')
+    def run(self):
+        try:
+            for src in self.sources():
+                path = runner.build(compile_cached(src, 'c', self.cache(),
+                                                   self.flags()))
+                runner.run(path)
+        finally:
+            self.report()
+
+    @expose(help='run the test programs, by default tests/*.pl0')
+    def check(self):
+        pargs = self.app.pargs
+        if pargs.src:
+            tests = [check.load(x) for x in pargs.src]
         else:
-            sys.stdout.write(out)
+            tests = check.discover()
+
+        start = time.perf_counter()
+        results = []
+        try:
+            for result in check.check(tests, pargs.backend, self.jobs(0),
+                                       self.cache(),
+                                       pargs.timeout or check.TIMEOUT,
+                                       self.flags()):
+                times = ', '.join('{} {:.1f} ms'.format(x, y * 1e3)
+                                  for x, y in result.times.items())
+                print('{:7} {} ({})'.format(result.status.upper(),
+                                            result.test.name, times))
+                if result.message:
+                    print('        {}'.format(result.message))
+                results.append(result)
+        finally:
+            self.report()
+
+        passed = sum(x.status == 'pass' for x in results)
+        print('{} of {} passed in {:.2f} s'.format(
+            passed, len(results), time.perf_counter() - start))
+        if pargs.junit:
+            with open(pargs.junit, 'w') as f:
+                f.write(check.to_junit(results))
+        if pargs.json:
+            with open(pargs.json, 'w') as f:
+                f.write(check.to_json(results))
+        if passed != len(results):
+            self.app.exit_code = 1
+
+    @expose(help='run the first source once per following input file, '
+            'or per line of stdin, on one process per CPU')
+    def batch(self):
+        pargs = self.app.pargs
+        if not pargs.src:
+            print('batch needs a source', file=sys.stderr)
+            self.app.exit_code = 1
+            return
+        engine = pargs.engine or 'serve'
+        with open(pargs.src[0], 'r') as f:
+            src = f.read()
+        try:
+            target = self.target(src, engine)
+        finally:
+            self.report()
+
+        inputs = pargs.src[1:]
+        jobs = batch.files(inputs) if inputs else batch.lines(
+            sys.stdin.buffer)
+        if pargs.o:
+            os.makedirs(pargs.o, exist_ok=True)
+        processes = self.jobs(0)
+        stats = batch.Stats(processes)
+        for outcome in batch.run(jobs, engine, target, processes,
+                                 pargs.timeout, pargs.chunk or
+                                 (4096 if engine == 'vector' else 1)):
+            stats.add(outcome)
+            self.write_outcome(outcome, bool(inputs))
+        if pargs.stats:
+            print(stats.report(), file=sys.stderr)
+
+    def target(self, src, engine):
+        """Builds src for engine, returning what batch.run() takes."""
+        backend = self.app.pargs.backend
+        if engine == 'vector':
+            return src
+        if engine == 'so' and backend == 'x86':
+            raise ValueError('Only the c backends can be loaded as a '
+                             'shared object')
+        output = compile_cached(src, backend, self.cache(), self.flags())
+        if engine == 'so':
+            return runner.build(output)
+        return runner.build(output, ('-O2', ),
+                            extension=EXTENSIONS[backend],
+                            suffix='.elf')
+
+    def write_outcome(self, outcome, whole):
+        """Writes the output of a batch job.  whole writes it as is, or
+        to a file in -o DIR, and otherwise as one line."""
+        if outcome.error is not None:
+            print('{}: {}'.format(outcome.job.name, outcome.error),
+                  file=sys.stderr)
+            self.app.exit_code = 1
+        directory = self.app.pargs.o
+        if whole and directory:
+            name = os.path.splitext(os.path.basename(outcome.job.name))[0]
+            with open(os.path.join(directory, name + '.out'), 'wb') as f:
+                f.write(outcome.output)
+        elif whole:
+            sys.stdout.buffer.write(outcome.output)
+        else:
+            sys.stdout.buffer.write(b' '.join(outcome.output.split()) +
+                                    b'\n')
+
+    @expose(help='lower a source to IR that the compiler, given it in '
+            'place of the source, takes up from')
+    def lower(self):
+        pargs = self.app.pargs
+        src = next(self.sources())
+        program = lower(src)
+        if pargs.binary:
+            data = serialize.dumpb(program)
+        else:
+            data = serialize.dumps(program).encode()
+        if pargs.o:
+            with open(pargs.o, 'wb') as f:
+                f.write(data)
+        else:
+            sys.stdout.buffer.write(data)
+
+    @expose(help='report the procedures and unreachable code that '
+            'compiling each source leaves out')
+    def strip(self):
+        pargs = self.app.pargs
+        for path in pargs.src or ['-']:
+            try:
+                contents = sys.stdin.read() if path == '-' else read(path)
+                if isinstance(contents, bytes):
+                    program, src = serialize.loads(contents), None
+                else:
+                    program, src = lower(contents), contents
+                _, stripped = prepare(src, program, pargs.backend,
+                                      self.flags())
+                print('{}: {}'.format(path, stripped))
+            except Exception as ex:
+                self.check_result(path, str(ex) or ex.__class__.__name__)
+
+    @expose(help='report on a profile written by an --instrument build, '
+            'by default pl0.profile')
+    def profile(self):
+        pargs = self.app.pargs
+        profile.report(profile.load(pargs.src[0] if pargs.src else
+                                    'pl0.profile'))
+
+    def sources(self):
+        if not self.app.pargs.src:
+            yield sys.stdin.read()
+        else:
+            for src in self.app.pargs.src:
+                with open(src, 'r') as f:
+                    yield f.read()
 
     def gen(self, src):
-        tokens = lex.lex(src)
-        ast = parser.parse(tokens)
-        irf = ir.IRGenerator().dispatch(ast)
-        sink = io.StringIO()
-        gen = codegen_riscv.RISCVGenerator(sink).dispatch(irf)
-        return sink.getvalue()
+        return compile_cached(src, self.app.pargs.backend, self.cache(),
+                              self.flags())
 
 
 class Driver(CementApp):
     class Meta:
         label = 'pl0c'
         base_controller = Controller
+        exit_on_close = True
 
 
 def main():
@@ -20,6 +20,7 @@ import typecheck as tc
 
 from . import lex
 from . import parser
+from . import symbols
 from . import util
 
 
@@ -52,15 +53,61 @@ class Intermediate(Operand):
 
 
 class Variable(Operand):
-    __slots__ = 'val',
+    """A global, a local or a global constant called val.
 
-    def __init__(self, val):
+    depth and slot are those of its symbols.Symbol, or None for
+    constants and variables made by optimisations.
+    """
+    __slots__ = 'val', 'depth', 'slot'
+
+    def __init__(self, val, depth=None, slot=None):
         self.val = val
+        self.depth = depth
+        self.slot = slot
 
     def rvalue(self):
         return self.val
 
 
+class Captured(Operand):
+    """A local of the enclosing procedure owner.
+
+    The procedure using it is passed a pointer to it, so each access is
+    one load however deeply the procedures are nested.  depth and slot
+    are those of its symbols.Symbol in owner.
+    """
+    __slots__ = 'val', 'owner', 'depth', 'slot'
+
+    def __init__(self, val, owner, depth=None, slot=None):
+        self.val = val
+        self.owner = owner
+        self.depth = depth
+        self.slot = slot
+
+    def key(self):
+        return self.owner, self.val
+
+    def pointer(self):
+        return '{}_{}'.format(self.owner, self.val)
+
+    def rvalue(self):
+        return '(*{})'.format(self.pointer())
+
+
+class Array(util.ReprMixin):
+    """The declaration of an array of size int_t called val.
+
+    Loads and Stores name it with a Variable or Captured.  slot is that
+    of its symbols.Symbol.
+    """
+    __slots__ = 'val', 'size', 'slot'
+
+    def __init__(self, val, size, slot=None):
+        self.val = val
+        self.size = size
+        self.slot = slot
+
+
 class Note(util.ReprMixin):
     __slots__ = 'text', 'indent'
 
@@ -97,7 +144,11 @@ class Condition(Operation):
 
 
 class Branch(Emittable):
-    pass
+    """A conditional jump to the Label target.
+
+    expect is True if it is known to usually fall through, False if it
+    usually jumps, or None.
+    """
 
 
 class Assign(TwoAddress):
@@ -120,17 +171,64 @@ class Reserve(SingleValueEmittable):
 
 
 class Call(Emittable):
-    __slots__ = 'name', 'arg'
+    """Calls a procedure, or write with arg.
+
+    captures has an operand for each of the callee's Block.captures:
+    a Variable if it is a local of the caller or a Captured if the
+    caller was passed it too.
+    """
+    __slots__ = 'name', 'arg', 'captures'
 
-    def __init__(self, name, arg=None):
+    def __init__(self, name, arg=None, captures=()):
         self.name = name
         self.arg = arg
+        self.captures = list(captures)
 
 
-class Label(SingleValueEmittable):
+class Read(SingleValueEmittable):
     pass
 
 
+class Load(Emittable):
+    """Sets result to array[index]."""
+    __slots__ = 'result', 'array', 'index'
+
+    def __init__(self, result, array, index):
+        self.result = result
+        self.array = array
+        self.index = index
+
+
+class Store(Emittable):
+    """Sets array[index] to value."""
+    __slots__ = 'array', 'index', 'value'
+
+    def __init__(self, array, index, value):
+        self.array = array
+        self.index = index
+        self.value = value
+
+
+class Check(Emittable):
+    """Stops the program unless 0 <= index < size.  line is that of the
+    access."""
+    __slots__ = 'index', 'size', 'line'
+
+    def __init__(self, index, size, line=None):
+        self.index = index
+        self.size = size
+        self.line = line
+
+
+class Label(Emittable):
+    """A branch target.  line is that of the WHILE or IF it belongs to."""
+    __slots__ = 'val', 'line'
+
+    def __init__(self, val, line=None):
+        self.val = val
+        self.line = line
+
+
 class Enter(Emittable):
     __slots__ = ()
 
@@ -147,18 +245,90 @@ class Const(Emittable):
         self.val = val
 
 
-class If(Emittable):
-    __slots__ = 'left', 'target'
+class If(Branch):
+    """Jumps to target unless left is true."""
+    __slots__ = 'left', 'target', 'expect'
 
-    def __init__(self, left, target):
+    def __init__(self, left, target, expect=None):
+        self.left = left
+        self.target = target
+        self.expect = expect
+
+
+# The comparison that holds exactly when each one doesn't.  odd and
+# even test the low bit of their left operand alone.
+NEGATED = {
+    '=': '!=',
+    '!=': '=',
+    '<': '>=',
+    '>=': '<',
+    '>': '<=',
+    '<=': '>',
+    'odd': 'even',
+    'even': 'odd',
+}
+
+
+class Jump(Branch):
+    """Jumps to target if left operation right holds, or for odd and
+    even, which have no right, if left is odd or even.
+
+    IF and WHILE emit their condition negated as a Jump past the body,
+    so the comparison goes straight to a compare and branch with no
+    boolean stored in between.
+    """
+    __slots__ = 'left', 'operation', 'right', 'target', 'expect'
+
+    def __init__(self, left, operation, right, target, expect=None):
         self.left = left
+        self.operation = operation
+        self.right = right
         self.target = target
+        self.expect = expect
 
 
 class Goto(SingleValueEmittable):
     pass
 
 
+def uses(operation):
+    """Returns the operands read by an operation."""
+    if isinstance(operation, Operation):
+        return [x for x in (operation.left, operation.right) if x is not None]
+    if isinstance(operation, If):
+        return [operation.left]
+    if isinstance(operation, Jump):
+        return [x for x in (operation.left, operation.right) if x is not None]
+    if isinstance(operation, Call):
+        # Passing a variable by pointer counts as using it.
+        args = [operation.arg] if operation.arg is not None else []
+        return args + operation.captures
+    if isinstance(operation, Load):
+        return [operation.array, operation.index]
+    if isinstance(operation, Store):
+        return [operation.array, operation.index, operation.value]
+    if isinstance(operation, Check):
+        return [operation.index]
+    return []
+
+
+def defs(operation):
+    """Returns the operands written by an operation."""
+    if isinstance(operation, Operation):
+        return [operation.result]
+    if isinstance(operation, Read):
+        return [operation.val]
+    if isinstance(operation, Load):
+        return [operation.result]
+    return []
+
+
+def arrays(program):
+    """Returns the names of the arrays declared anywhere in program."""
+    return [x.val for block in program.blocks for x in block.vars_
+            if isinstance(x, Array)]
+
+
 class Variables(util.Node):
     pass
 
@@ -168,12 +338,22 @@ class Constants(util.Node):
 
 
 class Block(util.Node):
-    def __init__(self, name):
+    """A procedure, or the main program if name is None.
+
+    captures are the Captured locals of enclosing procedures that the
+    block, or a procedure that it calls, uses.  depth is that of its
+    symbols.Scope.
+    """
+
+    def __init__(self, name, line=None, depth=0):
         super().__init__()
         self.name = name
+        self.line = line
+        self.depth = depth
         self.vars_ = Variables()
         self.consts = Constants()
         self.operations = []
+        self.captures = []
 
 
 class Program(util.Node):
@@ -188,8 +368,13 @@ class IRGenerator:
         self.idx = 0
         self.program = None
         self.blocks = []
+        # The names declared in each of blocks.
+        self.symbols = symbols.SymbolTable()
+        # The unique names given to procedures.
+        self.taken = set()
         self.indent = 0
         self.proc = None
+        self.unique = None
 
     def next_id(self):
         self.idx += 1
@@ -208,11 +393,16 @@ class IRGenerator:
         return self.program
 
     def emit_block(self, block):
-        b = Block(self.proc.name if self.proc else None)
+        self.symbols.enter()
+        if self.proc:
+            b = Block(self.unique, self.proc.line, self.symbols.depth)
+        else:
+            b = Block(None)
         self.blocks.append(b)
         self.enter_block(block)
         result = self.dispatch_children(block)
         self.exit_block(block)
+        self.symbols.leave()
         self.blocks.pop()
         self.program.blocks.append(b)
         return result
@@ -224,12 +414,54 @@ class IRGenerator:
         return self.dispatch_children(node)
 
     def emit_procedure(self, proc):
+        # Procedures become top level functions, so nested ones that
+        # reuse a name are renamed after their parent.
+        unique = proc.name
+        if unique in self.taken:
+            unique = '{}_{}'.format(self.blocks[-1].name or 'main', unique)
+        while unique in self.taken:
+            unique += '_'
+        self.taken.add(unique)
+        self.symbols.declare(lex.Ident(proc.name, proc.line),
+                             symbols.PROCEDURE, unique)
         self.proc = proc
+        self.unique = unique
         return self.dispatch_children(proc)
 
+    def resolve(self, ident, *kinds):
+        """Returns the operand for ident, which must name one of kinds,
+        by default a variable or constant.
+
+        Globals and locals are Variables, locals of an enclosing
+        procedure are Captured and constants declared in a procedure
+        are Numbers.  A name that can't be resolved is recorded in
+        symbols.errors and gives a Number.
+        """
+        symbol = self.symbols.resolve(ident, *(kinds or (symbols.VAR,
+                                                         symbols.CONST)))
+        if symbol is None:
+            return Number(0)
+        if symbol.kind == symbols.CONST:
+            return Number(symbol.value) if symbol.depth else Variable(
+                symbol.name, symbol.depth)
+        if symbol.depth in (0, self.symbols.depth):
+            return Variable(symbol.name, symbol.depth, symbol.slot)
+        captured = Captured(symbol.name, self.blocks[symbol.depth].name,
+                            symbol.depth, symbol.slot)
+        if captured.key() not in [x.key() for x in self.blocks[-1].captures]:
+            self.blocks[-1].captures.append(captured)
+        return captured
+
     def emit_expression(self, expression):
         terms = [self.dispatch(x) for x in expression.terms.children.values()]
         operations = list(expression.operations.children.values())
+        if expression.unary is not None and expression.unary.val == '-':
+            if isinstance(terms[0], Number):
+                terms[0] = Number(-terms[0].val)
+            else:
+                result = self.next_intermediate()
+                self.cmd(Operation(result, Number(0), '-', terms[0]))
+                terms[0] = result
 
         for operation in operations:
             left, right = terms[0], terms[1]
@@ -251,17 +483,19 @@ class IRGenerator:
         assert len(factors) == 1
         return factors[0]
 
-    def emit_condition(self, cond):
+    def branch(self, cond, target):
+        """Emits a Jump to target unless the parser.Condition or
+        parser.Odd cond holds."""
+        if isinstance(cond, parser.Odd):
+            self.cmd(Jump(self.dispatch(cond.expression), 'even', None,
+                          target))
+            return
         left = self.dispatch(cond.left)
         right = self.dispatch(cond.right)
-
         name = cond.code.val
         if name == '#':
             name = '!='
-
-        result = self.next_intermediate()
-        self.cmd(Condition(result, left, name, right))
-        return result
+        self.cmd(Jump(left, NEGATED[name], right, target))
 
     def dispatch_children(self, node):
         for child in node.children.values():
@@ -269,8 +503,8 @@ class IRGenerator:
                 self.dispatch(child)
 
     @tc.typecheck
-    def dispatch(self, node) -> Union[Operation, Variable, Intermediate,
-                                      Number, Program, None]:
+    def dispatch(self, node) -> Union[Operation, Variable, Captured,
+                                      Intermediate, Number, Program, None]:
         if node is None:
             return None
         target = 'emit_{}'.format(node.typename())
@@ -297,7 +531,43 @@ class IRGenerator:
         pass
 
     def end_program(self, program):
-        pass
+        self.symbols.check()
+        self.lift()
+
+    def lift(self):
+        """Passes captured locals to the procedures that need them.
+
+        A procedure needs the locals it uses directly and those needed
+        by the procedures it calls, less its own.  Every call then
+        passes the callee's captures.
+        """
+        blocks = {x.name: x for x in self.program.blocks}
+        changed = True
+        while changed:
+            changed = False
+            for block in self.program.blocks:
+                have = set(x.key() for x in block.captures)
+                for operation in block.operations:
+                    if (not isinstance(operation, Call) or
+                            operation.name not in blocks):
+                        continue
+                    for captured in blocks[operation.name].captures:
+                        if (captured.owner != block.name and
+                                captured.key() not in have):
+                            block.captures.append(Captured(
+                                captured.val, captured.owner, captured.depth,
+                                captured.slot))
+                            have.add(captured.key())
+                            changed = True
+        for block in self.program.blocks:
+            for operation in block.operations:
+                if isinstance(operation, Call) and operation.name in blocks:
+                    operation.captures = [
+                        Variable(x.val, x.depth, x.slot)
+                        if x.owner == block.name else
+                        Captured(x.val, x.owner, x.depth, x.slot)
+                        for x in blocks[operation.name].captures
+                    ]
 
     def emit_body(self, statement):
         self.cmd(Enter('run'))
@@ -305,11 +575,29 @@ class IRGenerator:
         self.cmd(Exit())
 
     def emit_vars(self, variables):
-        for var in variables:
-            self.blocks[-1].vars_.append(Variable(var.val))
+        for var, size in variables.children.values():
+            if size is True:
+                symbol = self.symbols.declare(var, symbols.VAR)
+                self.blocks[-1].vars_.append(Variable(
+                    var.val, symbol.depth, symbol.slot))
+                continue
+            if isinstance(size, lex.Ident):
+                symbol = self.symbols.lookup(size.val)
+                if symbol is None or symbol.kind != symbols.CONST:
+                    raise ValueError('line {}: the size of {} must be a '
+                                     'number or constant'.format(
+                                         size.line, var.val))
+                size = lex.Number(symbol.value, size.line)
+            if size.val <= 0:
+                raise ValueError('line {}: {} must have at least one '
+                                 'element'.format(size.line, var.val))
+            symbol = self.symbols.declare(var, symbols.ARRAY, size.val)
+            self.blocks[-1].vars_.append(Array(var.val, size.val,
+                                               symbol.slot))
 
     def emit_consts(self, consts):
-        for name, val in consts.items():
+        for name, val in consts.children.values():
+            self.symbols.declare(name, symbols.CONST, val.val)
             self.blocks[-1].consts.append(Const(name.val, val.val))
 
     def enter_block(self, block):
@@ -319,50 +607,72 @@ class IRGenerator:
         self.cmd(Exit())
 
     def emit_call(self, node):
-        self.cmd(Call(node.ident.val))
+        symbol = self.symbols.resolve(node.ident, symbols.PROCEDURE)
+        self.cmd(Call(node.ident.val if symbol is None else symbol.value))
+
+    def element(self, ident, expression):
+        """Emits the index of the array ident and its check, and returns
+        the array and index operands."""
+        array = self.resolve(ident, symbols.ARRAY)
+        index = self.dispatch(expression)
+        symbol = self.symbols.lookup(ident.val)
+        size = symbol.value if isinstance(array, (Variable, Captured)) else 1
+        self.cmd(Check(index, size, ident.line))
+        return array, index
 
     def emit_assign(self, assign):
-        operand = self.dispatch(assign.expr)
-        self.cmd(Assign(Variable(assign.ident.val), operand, '='))
+        if assign.index is None:
+            operand = self.dispatch(assign.expr)
+            self.cmd(Assign(self.resolve(assign.ident, symbols.VAR), operand,
+                            '='))
+            return
+        array, index = self.element(assign.ident, assign.index)
+        self.cmd(Store(array, index, self.dispatch(assign.expr)))
+
+    def emit_index(self, node):
+        array, index = self.element(node.ident, node.expression)
+        result = self.next_intermediate()
+        self.cmd(Load(result, array, index))
+        return result
 
     def emit_number(self, token):
         return Number(token.val)
 
     def emit_ident(self, token):
-        return Variable(token.val)
+        return self.resolve(token)
+
+    def emit_read(self, node):
+        if node.index is None:
+            self.cmd(Read(self.resolve(node.ident, symbols.VAR)))
+            return
+        array, index = self.element(node.ident, node.index)
+        value = self.next_intermediate()
+        self.cmd(Read(value))
+        self.cmd(Store(array, index, value))
 
     def emit_write(self, node):
         operand = self.dispatch(node.expression)
-        self.cmd(Call('write', operand.rvalue()))
+        self.cmd(Call('write', operand))
 
     def emit_while(self, node):
         idx = self.next_id()
 
-        top = Label('while{}'.format(idx))
-        end = Label('while{}end'.format(idx))
+        top = Label('while{}'.format(idx), node.line)
+        end = Label('while{}end'.format(idx), node.line)
 
         self.cmd(top)
-        operand = self.dispatch(node.condition)
-        self.cmd(If(operand.rvalue(), end))
+        self.branch(node.condition, end)
         self.dispatch(node.statement)
         self.cmd(Goto(top))
         self.cmd(end)
 
     def emit_if(self, node):
         idx = self.next_id()
-        cond = self.dispatch(node.condition)
-
-        target = Label('if{}'.format(idx))
-        self.cmd(If(cond.rvalue(), target))
+        target = Label('if{}'.format(idx), node.line)
+        self.branch(node.condition, target)
         self.dispatch(node.statement)
         self.cmd(target)
 
-    def emit_odd(self, node):
-        left = self.dispatch(node.expression)
-        result = self.next_intermediate()
-        self.cmd(Operation(result, left, '&', Number(1)))
-        return result
-
 
 def ir(program):
     program.dump('top')
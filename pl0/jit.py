@@ -0,0 +1,647 @@
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""An in-memory x86-64 JIT.
+
+The program is lowered straight to machine code, copied into an
+executable mmap and called through ctypes as run(globals, io).  %r15
+holds the globals buffer and %r14 the IO area for the whole run.
+Reads past the end of the input return 0.
+"""
+
+import ctypes
+import mmap
+import struct
+import sys
+import time
+
+from . import lex
+from . import parser
+from . import ir
+from . import regalloc
+from . import util
+
+RAX, RCX, RDX, RBX, RSP, RBP, RSI, RDI = range(8)
+R8, R9, R10, R11, R12, R13, R14, R15 = range(8, 16)
+
+REGISTERS = {
+    'rsi': RSI,
+    'rdi': RDI,
+    'r8': R8,
+    'r9': R9,
+    'r10': R10,
+    'r11': R11,
+    'rbx': RBX,
+    'r12': R12,
+    'r13': R13,
+}
+
+# As in codegen_x86, less %r14 and %r15 which hold the run's state.
+SCRATCH = 'rsi', 'rdi', 'r8', 'r9', 'r10', 'r11'
+PRESERVED = 'rbx', 'r12', 'r13'
+
+# Condition codes for jcc and setcc.
+CC = {
+    '=': 0x4,
+    '!=': 0x5,
+    '<': 0xC,
+    '>=': 0xD,
+    '<=': 0xE,
+    '>': 0xF,
+}
+
+# (reg, r/m) opcode and the /digit of the imm32 form.
+ALU = {
+    '+': (b'\x03', 0),
+    '-': (b'\x2b', 5),
+    '&': (b'\x23', 4),
+    'cmp': (b'\x3b', 7),
+}
+
+BUFFER = 4096
+
+CALLBACK = ctypes.CFUNCTYPE(None)
+ENTRY = ctypes.CFUNCTYPE(None, ctypes.c_void_p, ctypes.c_void_p)
+
+
+class IO(ctypes.Structure):
+    _fields_ = [
+        ('flush', ctypes.c_void_p),
+        ('count', ctypes.c_int32),
+        ('capacity', ctypes.c_int32),
+        ('error', ctypes.c_int32),
+        ('stack', ctypes.c_void_p),
+        ('values', ctypes.c_int32 * BUFFER),
+        ('fill', ctypes.c_void_p),
+        ('available', ctypes.c_int32),
+        ('position', ctypes.c_int32),
+        ('inputs', ctypes.c_int32 * BUFFER),
+    ]
+
+
+class Reg(util.ReprMixin):
+    __slots__ = 'num',
+
+    def __init__(self, num):
+        self.num = num
+
+
+class Mem(util.ReprMixin):
+    __slots__ = 'base', 'disp', 'index', 'scale'
+
+    def __init__(self, base, disp, index=None, scale=0):
+        self.base = base
+        self.disp = disp
+        self.index = index
+        self.scale = scale
+
+
+class Imm(util.ReprMixin):
+    __slots__ = 'val',
+
+    def __init__(self, val):
+        self.val = (val + 2**31) % 2**32 - 2**31
+
+
+class Assembler:
+    """Encodes the handful of x86-64 instructions the JIT needs."""
+
+    def __init__(self):
+        self.code = bytearray()
+        self.labels = {}
+        self.fixups = []
+        self.anonymous = 0
+
+    def new_label(self):
+        self.anonymous += 1
+        return ('anon', self.anonymous)
+
+    def label(self, name):
+        assert name not in self.labels, 'Duplicate label {}'.format(name)
+        self.labels[name] = len(self.code)
+
+    def emit(self, *chunks):
+        for chunk in chunks:
+            self.code += chunk
+
+    def rm(self, opcode, reg, rm, wide=False):
+        """Emits opcode with a ModRM for register field reg and r/m rm."""
+        rex = 0x40 | (8 if wide else 0) | ((reg >> 3) << 2)
+        if isinstance(rm, Reg):
+            rex |= rm.num >> 3
+            modrm = bytes([0xC0 | (reg & 7) << 3 | (rm.num & 7)])
+        elif rm.index is not None:
+            rex |= (rm.index >> 3) << 1 | rm.base >> 3
+            modrm = bytes([
+                0x84 | (reg & 7) << 3,
+                rm.scale << 6 | (rm.index & 7) << 3 | (rm.base & 7),
+            ]) + struct.pack('<i', rm.disp)
+        else:
+            rex |= rm.base >> 3
+            modrm = bytes([0x80 | (reg & 7) << 3 | (rm.base & 7)])
+            if rm.base & 7 == RSP:
+                modrm += b'\x24'
+            modrm += struct.pack('<i', rm.disp)
+        if rex != 0x40:
+            self.emit(bytes([rex]))
+        self.emit(opcode, modrm)
+
+    def mov(self, dest, src):
+        if isinstance(dest, Reg) and isinstance(src, Imm):
+            if dest.num >= 8:
+                self.emit(b'\x41')
+            self.emit(bytes([0xB8 | dest.num & 7]), struct.pack('<i', src.val))
+        elif isinstance(src, Imm):
+            self.rm(b'\xc7', 0, dest)
+            self.emit(struct.pack('<i', src.val))
+        elif isinstance(dest, Reg):
+            if not (isinstance(src, Reg) and src.num == dest.num):
+                self.rm(b'\x8b', dest.num, src)
+        else:
+            self.rm(b'\x89', src.num, dest)
+
+    def mov64(self, dest, src):
+        if isinstance(dest, Reg):
+            self.rm(b'\x8b', dest.num, src, wide=True)
+        else:
+            self.rm(b'\x89', src.num, dest, wide=True)
+
+    def alu(self, operation, dest, src):
+        """dest (a register) op= src."""
+        if operation == '*':
+            if isinstance(src, Imm):
+                self.rm(b'\x69', dest.num, dest)
+                self.emit(struct.pack('<i', src.val))
+            else:
+                self.rm(b'\x0f\xaf', dest.num, src)
+            return
+        opcode, digit = ALU[operation]
+        if isinstance(src, Imm):
+            self.rm(b'\x81', digit, dest)
+            self.emit(struct.pack('<i', src.val))
+        else:
+            self.rm(opcode, dest.num, src)
+
+    def cmp_imm8(self, dest, val):
+        self.rm(b'\x83', 7, dest)
+        self.emit(struct.pack('<b', val))
+
+    def add_imm8(self, dest, val, wide=False):
+        self.rm(b'\x83', 0, dest, wide=wide)
+        self.emit(struct.pack('<b', val))
+
+    def sub_imm8(self, dest, val, wide=False):
+        self.rm(b'\x83', 5, dest, wide=wide)
+        self.emit(struct.pack('<b', val))
+
+    def setcc(self, operation):
+        """Sets %eax to the flags tested as operation."""
+        self.emit(bytes([0x0F, 0x90 | CC[operation], 0xC0]))
+        self.emit(b'\x0f\xb6\xc0')
+
+    def cdq(self):
+        self.emit(b'\x99')
+
+    def idiv(self, src):
+        self.rm(b'\xf7', 7, src)
+
+    def neg(self, dest):
+        self.rm(b'\xf7', 3, dest)
+
+    def push(self, num):
+        if num >= 8:
+            self.emit(b'\x41')
+        self.emit(bytes([0x50 | num & 7]))
+
+    def pop(self, num):
+        if num >= 8:
+            self.emit(b'\x41')
+        self.emit(bytes([0x58 | num & 7]))
+
+    def lea64(self, dest, src):
+        self.rm(b'\x8d', dest.num, src, wide=True)
+
+    def call_reg(self, num):
+        self.rm(b'\xff', 2, Reg(num))
+
+    def ret(self):
+        self.emit(b'\xc3')
+
+    def fixup(self, opcode, target):
+        self.emit(opcode)
+        self.fixups.append((len(self.code), target))
+        self.emit(b'\0\0\0\0')
+
+    def jmp(self, target):
+        self.fixup(b'\xe9', target)
+
+    def jcc(self, operation, target):
+        self.fixup(bytes([0x0F, 0x80 | CC[operation]]), target)
+
+    def call(self, target):
+        self.fixup(b'\xe8', target)
+
+    def link(self):
+        for at, target in self.fixups:
+            if target not in self.labels:
+                raise KeyError('Undefined label {}'.format(target))
+            offset = self.labels[target] - (at + 4)
+            self.code[at:at + 4] = struct.pack('<i', offset)
+        return bytes(self.code)
+
+
+class JITGenerator:
+    def __init__(self):
+        self.asm = Assembler()
+        self.block = None
+        self.main = None
+        self.globals = {}
+        self.locations = {}
+        self.captures = {}
+        self.saved = []
+
+    def dispatch(self, node):
+        if isinstance(node, (list, tuple)):
+            for item in node:
+                self.dispatch(item)
+        else:
+            target = 'emit_{}'.format(util.typename(node))
+            return getattr(self, target)(node)
+
+    def emit_note(self, note):
+        pass
+
+    def emit_program(self, program):
+        if ir.arrays(program):
+            raise ValueError('The JIT doesn\'t support arrays')
+        self.main = program.blocks[-1]
+        for var in self.main.vars_:
+            if isinstance(var, ir.Variable):
+                self.globals[var.val] = 4 * len(self.globals)
+
+        self.emit_entry()
+        self.emit_write()
+        self.emit_input()
+        for block in program.blocks:
+            self.dispatch(block)
+        return self.asm.link()
+
+    def emit_entry(self):
+        """Emits run(globals, io) and the trap that unwinds back to it."""
+        asm = self.asm
+        asm.push(RBP)
+        asm.mov64(Reg(RBP), Reg(RSP))
+        for num in (R15, R14, R13, R12, RBX):
+            asm.push(num)
+        asm.sub_imm8(Reg(RSP), 8, wide=True)
+        asm.mov64(Reg(R15), Reg(RDI))
+        asm.mov64(Reg(R14), Reg(RSI))
+        asm.mov64(Mem(R14, IO.stack.offset), Reg(RSP))
+        asm.call(('proc', None))
+        asm.label('done')
+        asm.add_imm8(Reg(RSP), 8, wide=True)
+        for num in (RBX, R12, R13, R14, R15, RBP):
+            asm.pop(num)
+        asm.ret()
+
+        asm.label('trap')
+        asm.mov(Mem(R14, IO.error.offset), Imm(1))
+        asm.mov64(Reg(RSP), Mem(R14, IO.stack.offset))
+        asm.jmp('done')
+
+    def emit_write(self):
+        """Emits the helper that appends %edi to the output buffer."""
+        asm = self.asm
+        store = asm.new_label()
+        asm.label('write')
+        asm.mov(Reg(RAX), Mem(R14, IO.count.offset))
+        asm.alu('cmp', Reg(RAX), Mem(R14, IO.capacity.offset))
+        asm.jcc('<', store)
+        asm.push(RDI)
+        asm.mov64(Reg(RAX), Mem(R14, IO.flush.offset))
+        asm.call_reg(RAX)
+        asm.pop(RDI)
+        asm.mov(Reg(RAX), Mem(R14, IO.count.offset))
+        asm.label(store)
+        asm.mov(Mem(R14, IO.values.offset, RAX, 2), Reg(RDI))
+        asm.add_imm8(Mem(R14, IO.count.offset), 1)
+        asm.ret()
+
+    def emit_input(self):
+        """Emits the helper that returns the next input in %eax."""
+        asm = self.asm
+        load = asm.new_label()
+        asm.label('read')
+        asm.mov(Reg(RAX), Mem(R14, IO.position.offset))
+        asm.alu('cmp', Reg(RAX), Mem(R14, IO.available.offset))
+        asm.jcc('<', load)
+        asm.sub_imm8(Reg(RSP), 8, wide=True)
+        asm.mov64(Reg(RAX), Mem(R14, IO.fill.offset))
+        asm.call_reg(RAX)
+        asm.add_imm8(Reg(RSP), 8, wide=True)
+        asm.mov(Reg(RAX), Mem(R14, IO.position.offset))
+        asm.alu('cmp', Reg(RAX), Mem(R14, IO.available.offset))
+        asm.jcc('<', load)
+        asm.mov(Reg(RAX), Imm(0))
+        asm.ret()
+        asm.label(load)
+        asm.mov(Reg(RCX), Reg(RAX))
+        asm.add_imm8(Mem(R14, IO.position.offset), 1)
+        asm.mov(Reg(RAX), Mem(R14, IO.inputs.offset, RCX, 2))
+        asm.ret()
+
+    def emit_variables(self, variables):
+        pass
+
+    def emit_block(self, block):
+        self.block = block
+        intervals = regalloc.allocate(block.operations, SCRATCH, PRESERVED)
+        self.saved = sorted(
+            set(x.location for x in intervals.values()
+                if x.location in PRESERVED),
+            key=PRESERVED.index)
+
+        self.locations = {}
+        # Pointers to captured locals are passed on the stack.
+        self.captures = {x.key(): 16 + 8 * idx
+                         for idx, x in enumerate(block.captures)}
+        offset = 8 * len(self.saved)
+        if block is not self.main:
+            for var in block.vars_:
+                if isinstance(var, ir.Variable):
+                    offset += 4
+                    self.locations[var.val] = Mem(RBP, -offset)
+        for idx, interval in intervals.items():
+            if interval.location is None:
+                offset += 4
+                self.locations[idx] = Mem(RBP, -offset)
+            else:
+                self.locations[idx] = Reg(REGISTERS[interval.location])
+        self.frame = -offset % 16 + offset - 8 * len(self.saved)
+
+        self.dispatch(block.operations)
+
+    def operand(self, operand):
+        if isinstance(operand, ir.Number):
+            return Imm(operand.val)
+        if isinstance(operand, ir.Intermediate):
+            return self.locations[operand.idx]
+        if isinstance(operand, ir.Captured):
+            self.asm.mov64(Reg(RCX), Mem(RBP, self.captures[operand.key()]))
+            return Mem(RCX, 0)
+        if operand.val in self.locations:
+            return self.locations[operand.val]
+        for block in (self.block, self.main):
+            for const in block.consts:
+                if const.name == operand.val:
+                    return Imm(const.val)
+        if operand.val in self.globals:
+            return Mem(R15, self.globals[operand.val])
+        raise KeyError('Undefined variable {}'.format(operand.val))
+
+    def load(self, operand, register):
+        self.asm.mov(register, self.operand(operand))
+        return register
+
+    def store(self, register, operand):
+        dest = self.operand(operand)
+        if not (isinstance(dest, Reg) and dest.num == register.num):
+            self.asm.mov(dest, register)
+
+    def emit_enter(self, enter):
+        asm = self.asm
+        asm.label(('proc', self.block.name))
+        asm.push(RBP)
+        asm.mov64(Reg(RBP), Reg(RSP))
+        for name in self.saved:
+            asm.push(REGISTERS[name])
+        if self.frame:
+            asm.rm(b'\x81', 5, Reg(RSP), wide=True)
+            asm.emit(struct.pack('<i', self.frame))
+
+    def emit_exit(self, exit_):
+        asm = self.asm
+        asm.lea64(Reg(RSP), Mem(RBP, -8 * len(self.saved)))
+        for name in reversed(self.saved):
+            asm.pop(REGISTERS[name])
+        asm.pop(RBP)
+        asm.ret()
+
+    def emit_assign(self, assign):
+        src = self.operand(assign.left)
+        if isinstance(src, Mem):
+            src = self.load(assign.left, Reg(RAX))
+        self.asm.mov(self.operand(assign.result), src)
+
+    def emit_label(self, label):
+        self.asm.label(('label', label.val))
+
+    def emit_const(self, const):
+        pass
+
+    def emit_condition(self, cond):
+        self.load(cond.left, Reg(RAX))
+        self.asm.alu('cmp', Reg(RAX), self.operand(cond.right))
+        self.asm.setcc(cond.operation)
+        self.store(Reg(RAX), cond.result)
+
+    def emit_if(self, ifcmd):
+        target = ('label', ifcmd.target.val)
+        left = self.operand(ifcmd.left)
+        if isinstance(left, Imm):
+            if not left.val:
+                self.asm.jmp(target)
+            return
+        self.asm.cmp_imm8(left, 0)
+        self.asm.jcc('=', target)
+
+    def emit_jump(self, jump):
+        target = ('label', jump.target.val)
+        if jump.right is None:
+            self.load(jump.left, Reg(RAX))
+            self.asm.alu('&', Reg(RAX), Imm(1))
+            self.asm.jcc('!=' if jump.operation == 'odd' else '=', target)
+            return
+        left = None
+        if isinstance(jump.left, ir.Intermediate):
+            left = self.operand(jump.left)
+        if not isinstance(left, Reg):
+            left = self.load(jump.left, Reg(RAX))
+        self.asm.alu('cmp', left, self.operand(jump.right))
+        self.asm.jcc(jump.operation, target)
+
+    def emit_goto(self, goto):
+        self.asm.jmp(('label', goto.val.val))
+
+    def emit_operation(self, operation):
+        asm = self.asm
+        if operation.operation == '/':
+            divide, done = asm.new_label(), asm.new_label()
+            self.load(operation.left, Reg(RAX))
+            self.load(operation.right, Reg(RCX))
+            asm.cmp_imm8(Reg(RCX), 0)
+            asm.jcc('=', 'trap')
+            asm.cmp_imm8(Reg(RCX), -1)
+            asm.jcc('!=', divide)
+            asm.neg(Reg(RAX))
+            asm.jmp(done)
+            asm.label(divide)
+            asm.cdq()
+            asm.idiv(Reg(RCX))
+            asm.label(done)
+            self.store(Reg(RAX), operation.result)
+            return
+
+        dest = self.operand(operation.result)
+        register = dest if isinstance(dest, Reg) else Reg(RAX)
+        self.load(operation.left, register)
+        asm.alu(operation.operation, register, self.operand(operation.right))
+        self.store(register, operation.result)
+
+    def emit_call(self, call):
+        if call.arg is not None:
+            self.load(call.arg, Reg(RDI))
+            self.asm.call(call.name)
+        else:
+            self.pass_captures(call)
+            self.asm.call(('proc', call.name))
+            size = 8 * (len(call.captures) + len(call.captures) % 2)
+            while size:
+                step = min(size, 120)
+                self.asm.add_imm8(Reg(RSP), step, wide=True)
+                size -= step
+
+    def pass_captures(self, call):
+        """Pushes the pointers for call, keeping the stack aligned."""
+        asm = self.asm
+        if len(call.captures) % 2:
+            asm.sub_imm8(Reg(RSP), 8, wide=True)
+        for operand in reversed(call.captures):
+            if isinstance(operand, ir.Captured):
+                asm.mov64(Reg(RAX), Mem(RBP, self.captures[operand.key()]))
+            else:
+                asm.lea64(Reg(RAX), self.operand(operand))
+            asm.push(RAX)
+
+    def emit_read(self, read):
+        self.asm.call('read')
+        self.store(Reg(RAX), read.val)
+
+
+class Stats(util.ReprMixin):
+    __slots__ = 'code_size', 'compile_time', 'load_time'
+
+    def __init__(self, code_size, compile_time, load_time):
+        self.code_size = code_size
+        self.compile_time = compile_time
+        self.load_time = load_time
+
+
+class Compiled:
+    """A program loaded into executable memory."""
+
+    def __init__(self, code, names, stats):
+        self.names = names
+        self.stats = stats
+        self.globals_ = (ctypes.c_int32 * max(len(names), 1))()
+        self.io = IO()
+        self.io.capacity = BUFFER
+        self.sink = None
+        self.source = iter(())
+        self.flush_ = CALLBACK(self.flush)
+        self.io.flush = ctypes.cast(self.flush_, ctypes.c_void_p)
+        self.fill_ = CALLBACK(self.fill)
+        self.io.fill = ctypes.cast(self.fill_, ctypes.c_void_p)
+
+        start = time.perf_counter()
+        size = max(len(code), 1)
+        self.memory = mmap.mmap(-1, size,
+                                prot=mmap.PROT_READ | mmap.PROT_WRITE)
+        self.memory.write(code)
+        address = ctypes.addressof(ctypes.c_char.from_buffer(self.memory))
+        libc = ctypes.CDLL(None, use_errno=True)
+        libc.mprotect.argtypes = (ctypes.c_void_p, ctypes.c_size_t,
+                                  ctypes.c_int)
+        if libc.mprotect(address, size, mmap.PROT_READ | mmap.PROT_EXEC):
+            raise OSError(ctypes.get_errno(), 'mprotect failed')
+        self.entry = ENTRY(address)
+        self.stats.load_time = time.perf_counter() - start
+
+    def flush(self):
+        count = self.io.count
+        self.io.count = 0
+        self.sink(self.io.values[:count])
+
+    def fill(self):
+        count = 0
+        for value in self.source:
+            self.io.inputs[count] = value
+            count += 1
+            if count == BUFFER:
+                break
+        self.io.available = count
+        self.io.position = 0
+
+    def run(self, sink=None, inputs=()):
+        """Runs the program, returning what it wrote.
+
+        inputs is an iterable of the values that ? reads.  If sink is
+        given it is called with each batch of written values instead.
+        """
+        out = []
+        self.sink = sink or out.extend
+        self.source = iter(inputs)
+        self.io.count = 0
+        self.io.error = 0
+        self.io.available = 0
+        self.io.position = 0
+        self.entry(ctypes.addressof(self.globals_), ctypes.addressof(self.io))
+        self.flush()
+        if self.io.error:
+            raise ZeroDivisionError('PL/0 program divided by zero')
+        return out
+
+    @property
+    def globals(self):
+        return {x: self.globals_[y // 4] for x, y in self.names.items()}
+
+
+def jit(program):
+    """Compiles an ir.Program into a Compiled."""
+    start = time.perf_counter()
+    gen = JITGenerator()
+    code = gen.dispatch(program)
+    stats = Stats(len(code), time.perf_counter() - start, None)
+    return Compiled(code, gen.globals, stats)
+
+
+def main():
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], 'r') as f:
+            src = f.read()
+        inputs = (int(x) for x in sys.stdin.read().split())
+    else:
+        src, inputs = sys.stdin.read(), ()
+
+    program = parser.parse(lex.lex(src))
+    compiled = jit(ir.IRGenerator().dispatch(program))
+    for value in compiled.run(inputs=inputs):
+        print(value)
+    print('// {} bytes, compiled in {:.1f} us, loaded in {:.1f} us'.format(
+        compiled.stats.code_size, compiled.stats.compile_time * 1e6,
+        compiled.stats.load_time * 1e6), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
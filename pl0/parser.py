@@ -13,7 +13,6 @@
 # limitations under the License.
 #
 import collections
-import inspect
 import sys
 
 from . import lex
@@ -24,19 +23,6 @@ class TokenStream:
         self.tokens = tokens
         self.at = -1
 
-    def log(self, token):
-        calls = inspect.stack()
-        context = calls[0][1]
-        names = []
-        for call in calls:
-            if call[1] == context:
-                name = call[3]
-                if name.startswith('parse_'):
-                    name = name[6:]
-                names.append(name)
-            else:
-                break
-
     def advance(self):
         self.at += 1
 
@@ -46,7 +32,7 @@ class TokenStream:
     def prev(self):
         return self.tokens[self.at - 1]
 
-    def accept(self, *vals, nolog=False):
+    def accept(self, *vals):
         token = self.tokens[self.at]
         for val in vals:
             if isinstance(val, str):
@@ -56,8 +42,6 @@ class TokenStream:
 
             if match:
                 self.advance()
-                if not nolog:
-                    self.log(token)
                 return token
         return None
 
@@ -65,12 +49,11 @@ class TokenStream:
         tokens = []
 
         for val in vals:
-            token = self.accept(val, nolog=True)
+            token = self.accept(val)
             if not token:
                 assert False, 'Parse error: expected {}, got {}'.format(
                     repr(val), self.tokens[self.at])
             tokens.append(token)
-            self.log(token)
         if len(tokens) == 1:
             return tokens[0]
         else:
@@ -101,12 +84,13 @@ class Node:
         return self.__class__.__name__.lower()
 
 
-class Consts(Node, dict):
-    pass
+class Consts(Node):
+    """Has a (name, value) pair of tokens for each constant."""
 
 
-class Vars(Node, dict):
-    pass
+class Vars(Node):
+    """Has a (name, size) pair for each variable.  size is True for
+    scalars and the Number or Ident token for arrays."""
 
 
 class List(Node):
@@ -131,9 +115,12 @@ class Statement(Node):
 
 
 class Assign(Statement):
-    def __init__(self, ident, expr):
+    """Assigns expr to ident, or to ident[index] if index is set."""
+
+    def __init__(self, ident, expr, index=None):
         super().__init__()
         self.set('ident', ident)
+        self.set('index', index)
         self.set('expr', expr)
 
 
@@ -143,6 +130,22 @@ class Call(Statement):
         self.set('ident', ident)
 
 
+class Read(Statement):
+    def __init__(self, ident, index=None):
+        super().__init__()
+        self.set('ident', ident)
+        self.set('index', index)
+
+
+class Index(Node):
+    """The element of the array ident at expression."""
+
+    def __init__(self, ident, expression):
+        super().__init__()
+        self.set('ident', ident)
+        self.set('expression', expression)
+
+
 class Write(Statement):
     def __init__(self, expression):
         super().__init__()
@@ -150,17 +153,19 @@ class Write(Statement):
 
 
 class While(Statement):
-    def __init__(self, condition, statement):
+    def __init__(self, condition, statement, line=None):
         super().__init__()
         self.set('condition', condition)
         self.set('statement', statement)
+        self.line = line
 
 
 class If(Statement):
-    def __init__(self, condition, statement):
+    def __init__(self, condition, statement, line=None):
         super().__init__()
         self.set('condition', condition)
         self.set('statement', statement)
+        self.line = line
 
 
 class Odd(Node):
@@ -196,28 +201,47 @@ class Term(Node):
 def parse_consts(stream):
     consts = Consts()
     name, _, value = stream.expect(lex.Ident, '=', lex.Number)
-    consts[name] = value
+    consts.append((name, value))
 
     while stream.accept(','):
         name, _, value = stream.expect(lex.Ident, '=', lex.Number)
-        consts[name] = value
+        consts.append((name, value))
 
     stream.expect(';')
     return consts
 
 
+def parse_var(stream, variables):
+    """Parses a name or an array name[size], where size is a number or
+    a constant, onto variables."""
+    name = stream.expect(lex.Ident)
+    if stream.accept('['):
+        size = stream.accept(lex.Number) or stream.expect(lex.Ident)
+        stream.expect(']')
+        variables.append((name, size))
+    else:
+        variables.append((name, True))
+
+
 def parse_vars(stream):
     variables = Vars()
-    name = stream.expect(lex.Ident)
-    variables[name] = True
+    parse_var(stream, variables)
 
     while stream.accept(','):
-        name = stream.expect(lex.Ident)
-        variables[name] = True
+        parse_var(stream, variables)
     stream.expect(';')
     return variables
 
 
+def parse_index(stream):
+    """Parses the [expression] after an array name, or returns None."""
+    if not stream.accept('['):
+        return None
+    expression = parse_expression(stream)
+    stream.expect(']')
+    return expression
+
+
 class Compound(Statement):
     def __init__(self, statements):
         super().__init__()
@@ -228,6 +252,10 @@ class Compound(Statement):
 def parse_factor(stream):
     term = stream.accept(lex.Ident, lex.Number)
     if term:
+        if isinstance(term, lex.Ident):
+            index = parse_index(stream)
+            if index is not None:
+                return Index(term, index)
         return term
     stream.expect('(')
     expression = parse_expression(stream)
@@ -278,23 +306,30 @@ def parse_condition(stream):
 
 
 def parse_statement(stream):
-    if stream.accept(lex.Ident):
+    ident = stream.accept(lex.Ident)
+    if ident:
+        index = parse_index(stream)
         stream.expect(':=')
-        return Assign(stream.peek(-2), parse_expression(stream))
+        return Assign(ident, parse_expression(stream), index)
     if stream.accept('call'):
         return Call(stream.expect(lex.Ident))
+    if stream.accept('?'):
+        ident = stream.expect(lex.Ident)
+        return Read(ident, parse_index(stream))
     if stream.accept('!'):
         return Write(parse_expression(stream))
     if stream.accept('begin'):
         return parse_compound(stream)
-    if stream.accept('if'):
+    start = stream.accept('if')
+    if start:
         cond, _, statement = parse_condition(stream), stream.expect(
             'then'), parse_statement(stream)
-        return If(cond, statement)
-    if stream.accept('while'):
+        return If(cond, statement, start.line)
+    start = stream.accept('while')
+    if start:
         cond, _, statement = parse_condition(stream), stream.expect(
             'do'), parse_statement(stream)
-        return While(cond, statement)
+        return While(cond, statement, start.line)
     return None
 
 
@@ -305,6 +340,7 @@ def parse_procedure(stream):
     stream.expect(';')
     procedure.set('name', name.val)
     procedure.set('block', block)
+    procedure.line = name.line
     return procedure
 
 
@@ -323,8 +359,9 @@ def parse_block(stream):
 
     procedures = Procedures()
     while stream.accept('procedure'):
-        procedure = parse_procedure(stream)
-        procedures.set(procedure.name, procedure)
+        # Appended rather than set by name, so that a duplicate reaches
+        # the symbol table.
+        procedures.append(parse_procedure(stream))
     block.set('procedures', procedures)
     block.set('statement', parse_statement(stream))
 
@@ -0,0 +1,448 @@
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Profile-guided optimisation of an ir.Program.
+
+The counts come from a profile written by an --instrument build, see
+pl0.profile, or without one are estimated by assuming that each loop
+runs ESTIMATED_TRIPS times and each IF is taken half the time.  As
+WHILE and IF nest, every operation runs as often as the innermost loop
+or IF body around it, so the counts of the procedure, loop and branch
+sites give the count of each operation.
+
+With those counts optimize():
+
+    inlines small procedures at hot call sites,
+    unrolls small, hot innermost loops UNROLL times, but only with a
+    profile as a guessed trip count is no reason to unroll,
+    moves rarely taken IF bodies to the end of the procedure so that
+    the hot path falls through, and
+    sets Branch.expect on branches that mostly go one way.
+
+An operation is hot when it runs at least HOT times as often as the
+hottest one.
+"""
+
+import copy
+import sys
+
+from . import ir
+from . import profile
+
+HOT = 0.001
+ESTIMATED_TRIPS = 10
+# Branches taken less often than this, or more often than 1 - BIASED,
+# are marked as expected to go the other way.
+BIASED = 0.1
+# IF bodies run less often than this are moved out of line.
+COLD = 0.05
+INLINE_LIMIT = 40
+UNROLL = 4
+UNROLL_LIMIT = 24
+
+
+class Counts:
+    """How often each operation runs and how each Branch goes.
+
+    runs maps operations to their count and taken maps each Branch to
+    the fraction of times that it fell through, into the body of its IF
+    or WHILE.  measured is False
+    if the counts are estimates.
+    """
+
+    def __init__(self, measured):
+        self.runs = {}
+        self.taken = {}
+        self.hottest = 0
+        self.measured = measured
+
+    def hot(self, operation):
+        return (self.hottest > 0 and
+                self.runs.get(operation, 0) >= HOT * self.hottest)
+
+
+def load(path, source, program):
+    """Loads the profile at path, returning None if it doesn't match.
+
+    A profile matches if it was written by a build of the same source
+    with the same sites, so profiles from an older compiler are also
+    rejected.
+    """
+    loaded = profile.load(path)
+    if loaded.source != profile.fingerprint(source):
+        print('{}: profile is for a different source, ignoring it'.format(
+            path), file=sys.stderr)
+        return None
+    expected = set(x.key() for x in profile.plan(program))
+    if expected != set(x.key() for x in loaded.sites):
+        print('{}: profile sites don\'t match the program, ignoring '
+              'it'.format(path), file=sys.stderr)
+        return None
+    return loaded
+
+
+def measure(program, loaded=None):
+    """Returns the Counts of program, estimated unless loaded is given."""
+    counts = Counts(loaded is not None)
+    sites = {x.key(): x.counts for x in loaded.sites} if loaded else {}
+    entries = {}
+    # Callers come after their callees, so this sees calls before the
+    # procedures they call.
+    for block in reversed(program.blocks):
+        name = block.name or 'main'
+        if loaded:
+            entered = sites['procedure', name][0]
+        else:
+            entered = entries.get(name, 1 if block.name is None else 0)
+        walk(block, entered, sites, counts)
+        for operation in block.operations:
+            if isinstance(operation, ir.Call) and operation.name != name:
+                entries[operation.name] = (entries.get(operation.name, 0) +
+                                           counts.runs[operation])
+    counts.hottest = max(counts.runs.values(), default=0)
+    return counts
+
+
+def walk(block, entered, sites, counts):
+    """Counts the operations of block given how often it was entered.
+
+    Uses the loop and branch counts in sites and adds estimates for any
+    that are missing.
+    """
+    heads, exits = profile.loops(block.operations)
+    stack = [entered]
+    branches = set()
+    for operation in block.operations:
+        if isinstance(operation, ir.Label) and operation.val in heads:
+            first = stack[-1]
+            found = sites.setdefault(('loop', operation.val),
+                                     [first, first * ESTIMATED_TRIPS])
+            stack.append(found[0] + found[1])
+            counts.runs[operation] = stack[-1]
+        elif isinstance(operation, ir.Label) and operation.val in exits:
+            stack.pop()
+            counts.runs[operation] = stack[-1]
+        elif isinstance(operation, ir.Label) and operation.val in branches:
+            stack.pop()
+            counts.runs[operation] = stack[-1]
+        elif (isinstance(operation, ir.Branch) and
+              operation.target.val in exits):
+            found = sites['loop', exits[operation.target.val]]
+            counts.runs[operation] = stack[-1]
+            counts.taken[operation] = fraction(found[1], stack[-1])
+            stack[-1] = found[1]
+        elif isinstance(operation, ir.Branch):
+            executed = stack[-1]
+            found = sites.setdefault(('branch', operation.target.val),
+                                     [executed, executed / 2])
+            branches.add(operation.target.val)
+            counts.runs[operation] = executed
+            counts.taken[operation] = fraction(found[1], found[0])
+            stack.append(found[1])
+        else:
+            counts.runs[operation] = stack[-1]
+
+
+def fraction(part, total):
+    return part / total if total else 0.5
+
+
+def optimize(program, loaded=None):
+    """Optimises program in place using the counts in loaded, if any."""
+    counts = measure(program, loaded)
+    Inliner(program, counts).run()
+    for block in program.blocks:
+        if counts.measured:
+            unroll(block, counts)
+        outline(block, counts)
+        for operation in block.operations:
+            if isinstance(operation, ir.Branch):
+                expect(operation, counts)
+    return program
+
+
+def expect(branch, counts):
+    taken = counts.taken.get(branch)
+    if taken is None or counts.runs.get(branch, 0) == 0:
+        return
+    if taken >= 1 - BIASED:
+        branch.expect = True
+    elif taken <= BIASED:
+        branch.expect = False
+
+
+class Copier:
+    """Copies operations with fresh intermediates and labels.
+
+    operands maps the names of variables to replace to their new
+    operand.  Labels defined in the copied operations get suffix added.
+    """
+
+    def __init__(self, block, suffix, operands=None):
+        self.block = block
+        self.suffix = suffix
+        self.operands = operands or {}
+        self.intermediates = {}
+        self.labels = {}
+        self.next = max([x.idx for x in block.vars_
+                         if isinstance(x, ir.Intermediate)], default=0)
+
+    def copy(self, operations, counts=None, scale=1.0):
+        for operation in operations:
+            if isinstance(operation, ir.Label):
+                self.labels[operation] = ir.Label(
+                    operation.val + self.suffix, operation.line)
+        copies = []
+        for operation in operations:
+            if isinstance(operation, ir.Label):
+                duplicate = self.labels[operation]
+            else:
+                duplicate = copy.copy(operation)
+                for name in slots(operation):
+                    setattr(duplicate, name,
+                            self.rename(getattr(operation, name)))
+            if counts is not None and operation in counts.runs:
+                counts.runs[duplicate] = counts.runs[operation] * scale
+            if counts is not None and operation in counts.taken:
+                counts.taken[duplicate] = counts.taken[operation]
+            copies.append(duplicate)
+        return copies
+
+    def rename(self, value):
+        if isinstance(value, list):
+            return [self.rename(x) for x in value]
+        if isinstance(value, ir.Intermediate):
+            if value.idx not in self.intermediates:
+                self.next += 1
+                fresh = ir.Intermediate(self.next)
+                self.block.vars_.append(fresh)
+                self.intermediates[value.idx] = fresh
+            return self.intermediates[value.idx]
+        if isinstance(value, ir.Variable):
+            return self.operands.get(value.val, value)
+        if isinstance(value, ir.Label):
+            return self.labels.get(value, value)
+        return value
+
+
+def slots(obj):
+    for cls in type(obj).__mro__:
+        yield from getattr(cls, '__slots__', ())
+
+
+def body(block):
+    """Returns the operations of block between Enter and Exit."""
+    return [x for x in block.operations
+            if not isinstance(x, (ir.Enter, ir.Exit))]
+
+
+def names(operations):
+    """Returns the names of the variables and procedures used."""
+    found = set()
+    for operation in operations:
+        for value in ir.uses(operation) + ir.defs(operation):
+            if isinstance(value, ir.Variable):
+                found.add(value.val)
+        if isinstance(operation, ir.Call):
+            found.add(operation.name)
+    return found
+
+
+def locals_(block):
+    if block.name is None:
+        return set()
+    return set(x.val for x in block.vars_
+               if isinstance(x, (ir.Variable, ir.Array)))
+
+
+class Inliner:
+    def __init__(self, program, counts):
+        self.program = program
+        self.counts = counts
+        self.blocks = {x.name: x for x in program.blocks if x.name}
+        self.copies = 0
+
+    def run(self):
+        # Callees come first, so calls inside them are inlined before
+        # they are themselves inlined.
+        for block in self.program.blocks:
+            operations = []
+            for operation in block.operations:
+                callee = self.inlinable(block, operation)
+                if callee is None:
+                    operations.append(operation)
+                else:
+                    operations.extend(self.inline(block, callee, operation))
+            block.operations = operations
+
+    def inlinable(self, block, call):
+        """Returns the block to inline for call, or None."""
+        if not isinstance(call, ir.Call) or call.arg is not None:
+            return None
+        callee = self.blocks.get(call.name)
+        if (callee is None or callee is block or callee.captures or
+                any(isinstance(x, ir.Array) for x in callee.vars_) or
+                not self.counts.hot(call)):
+            return None
+        operations = body(callee)
+        if len(operations) > INLINE_LIMIT:
+            return None
+        # Names the callee doesn't declare must mean the same thing in
+        # the caller.
+        declared = locals_(callee) | set(x.name for x in callee.consts)
+        if (names(operations) - declared) & locals_(block):
+            return None
+        return callee
+
+    def inline(self, block, callee, call):
+        self.copies += 1
+        suffix = '_{}'.format(self.copies)
+        operands = {x.name: ir.Number(x.val) for x in callee.consts}
+        for name in sorted(locals_(callee)):
+            operands[name] = ir.Variable(name + suffix)
+            block.vars_.append(operands[name])
+        entered = self.counts.runs.get(callee.operations[0], 0)
+        scale = self.counts.runs[call] / entered if entered else 0
+        copier = Copier(block, suffix, operands)
+        return copier.copy(body(callee), self.counts, scale)
+
+
+def unroll(block, counts):
+    """Unrolls the hot innermost loops of block UNROLL times.
+
+    A loop is
+
+        top: head; Jump(cond, end); body; Goto(top); end:
+
+    and each extra copy repeats head, the test and body with fresh
+    intermediates and labels.
+    """
+    heads, exits = profile.loops(block.operations)
+    operations = block.operations
+    result = []
+    at = 0
+    copies = 0
+    while at < len(operations):
+        found = innermost(operations, at, heads, exits)
+        if found is None:
+            result.append(operations[at])
+            at += 1
+            continue
+        test, back, end = found
+        head = operations[at + 1:test]
+        loop_body = operations[test + 1:back]
+        entries, iterations = loop_counts(operations, at, test, counts)
+        if (not counts.hot(operations[test]) or
+                iterations < UNROLL * entries or
+                len(head) + len(loop_body) > UNROLL_LIMIT):
+            result.append(operations[at])
+            at += 1
+            continue
+
+        result.extend(operations[at:back])
+        for idx in range(1, UNROLL):
+            copies += 1
+            copier = Copier(block, '_u{}'.format(copies))
+            result.extend(copier.copy(operations[at + 1:back], counts))
+        result.extend(operations[back:end + 1])
+        at = end + 1
+    block.operations = result
+
+
+def innermost(operations, at, heads, exits):
+    """Returns the (test, back edge, end) indexes of the loop at at.
+
+    Returns None unless operations[at] starts a loop without loops
+    inside.
+    """
+    top = operations[at]
+    if not isinstance(top, ir.Label) or top.val not in heads:
+        return None
+    test = back = None
+    for idx in range(at + 1, len(operations)):
+        operation = operations[idx]
+        if isinstance(operation, ir.Label) and operation.val in heads:
+            return None
+        if (test is None and isinstance(operation, ir.Branch) and
+                exits.get(operation.target.val) == top.val):
+            test = idx
+        if isinstance(operation, ir.Goto) and operation.val is top:
+            back = idx
+            break
+    if test is None or back is None or back + 1 >= len(operations):
+        return None
+    end = operations[back + 1]
+    if not isinstance(end, ir.Label) or operations[test].target is not end:
+        return None
+    return test, back, back + 1
+
+
+def loop_counts(operations, at, test, counts):
+    """Returns the (entries, iterations) of the loop at at."""
+    runs = counts.runs.get(operations[at], 0)
+    iterations = runs * counts.taken.get(operations[test], 0)
+    return runs - iterations, iterations
+
+
+def outline(block, counts):
+    """Moves cold IF bodies to the end of block.
+
+    The Jump past the body is negated so that it jumps to the body, and
+    the body jumps back after.  Only IFs tested by a Jump, and bodies
+    without loops or other IFs, are moved.
+    """
+    heads, exits = profile.loops(block.operations)
+    operations = block.operations
+    main = []
+    cold = []
+    at = 0
+    while at < len(operations):
+        operation = operations[at]
+        end = cold_body(operations, at, heads, exits, counts)
+        if end is None:
+            main.append(operation)
+            at += 1
+            continue
+        back = operation.target
+        start = ir.Label(back.val + 'cold', back.line)
+        main.append(ir.Jump(operation.left, ir.NEGATED[operation.operation],
+                            operation.right, start, True))
+        main.append(back)
+        cold.append(start)
+        cold.extend(operations[at + 1:end])
+        cold.append(ir.Goto(back))
+        at = end + 1
+
+    if not cold:
+        return
+    exit_ = main.pop()
+    assert isinstance(exit_, ir.Exit)
+    done = ir.Label('{}done'.format(block.name or 'main'))
+    block.operations = main + [ir.Goto(done)] + cold + [done, exit_]
+
+
+def cold_body(operations, at, heads, exits, counts):
+    """Returns the index of the label ending a cold IF body at at or None."""
+    branch = operations[at]
+    if (not isinstance(branch, ir.Jump) or branch.target.val in exits or
+            counts.runs.get(branch, 0) == 0 or
+            counts.taken.get(branch, 1) >= COLD):
+        return None
+    for idx in range(at + 1, len(operations)):
+        operation = operations[idx]
+        if operation is branch.target:
+            return idx
+        if isinstance(operation, (ir.Branch, ir.Label, ir.Goto)):
+            return None
+    return None
@@ -0,0 +1,197 @@
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Profiles written by instrumented programs, and reports on them.
+
+An instrumented program counts events at three kinds of site:
+
+    procedure  calls
+    loop       entries and iterations (back edges taken)
+    branch     IFs executed and IFs whose body ran
+
+Procedures and loops may also record their inclusive and self time
+in clock ticks, where self time leaves out the loops and calls inside.
+Sites are named after the procedure or the loop's or IF's label and
+carry the source line of the PROCEDURE, WHILE or IF.
+
+The runtime writes the profile to $PL0_PROFILE, or pl0.profile, at
+exit.  It is text, one site per line:
+
+    pl0-profile 1
+    source <sha256 of the PL/0 source>
+    cycles 0|1
+    <kind> <name> <line> <count> <count> <inclusive> <self>
+"""
+
+import argparse
+import hashlib
+import sys
+
+from . import ir
+from . import util
+
+VERSION = 1
+
+
+class Instrument(util.ReprMixin):
+    """What to instrument.  source is the fingerprint of the source."""
+    __slots__ = 'cycles', 'source'
+
+    def __init__(self, cycles, source):
+        self.cycles = cycles
+        self.source = source
+
+
+class Site(util.ReprMixin):
+    __slots__ = 'kind', 'name', 'line', 'counts', 'inclusive', 'self_'
+
+    def __init__(self, kind, name, line, counts=(0, 0), inclusive=0,
+                 self_=0):
+        self.kind = kind
+        self.name = name
+        self.line = line
+        self.counts = list(counts)
+        self.inclusive = inclusive
+        self.self_ = self_
+
+    def key(self):
+        return self.kind, self.name
+
+
+class Profile(util.ReprMixin):
+    __slots__ = 'source', 'cycles', 'sites'
+
+    def __init__(self, source, cycles, sites):
+        self.source = source
+        self.cycles = cycles
+        self.sites = sites
+
+    def find(self, kind, name):
+        """Returns the site of the given kind and name or None."""
+        for site in self.sites:
+            if site.key() == (kind, name):
+                return site
+        return None
+
+
+def fingerprint(source):
+    return hashlib.sha256(source.encode()).hexdigest()
+
+
+def loops(operations):
+    """Returns the loop heads and a map from each loop's exit to its head.
+
+    A head is a label that is the target of a goto.  An exit is the
+    label just after the back edge, which is where IRGenerator puts
+    the end of a WHILE.
+    """
+    heads = set(x.val.val for x in operations if isinstance(x, ir.Goto))
+    exits = {}
+    for before, operation in zip(operations, operations[1:]):
+        if (isinstance(before, ir.Goto) and isinstance(operation, ir.Label)
+                and before.val.val in heads):
+            exits[operation.val] = before.val.val
+    return heads, exits
+
+
+def plan(program):
+    """Returns the Sites to instrument in an ir.Program, in order."""
+    sites = []
+    for block in program.blocks:
+        sites.append(Site('procedure', block.name or 'main', block.line or 0))
+        heads, exits = loops(block.operations)
+        for operation in block.operations:
+            if isinstance(operation, ir.Label) and operation.val in heads:
+                sites.append(Site('loop', operation.val, operation.line or 0))
+            elif (isinstance(operation, ir.Branch) and
+                  operation.target.val not in exits):
+                sites.append(Site('branch', operation.target.val,
+                                  operation.target.line or 0))
+    return sites
+
+
+def load(path):
+    with open(path, 'r') as f:
+        lines = f.read().splitlines()
+    if not lines or lines[0] != 'pl0-profile {}'.format(VERSION):
+        raise ValueError('{}: not a version {} profile'.format(path,
+                                                              VERSION))
+    source = lines[1].split()[1]
+    cycles = lines[2].split()[1] == '1'
+    sites = []
+    for line in lines[3:]:
+        kind, name, at, first, second, inclusive, self_ = line.split()
+        sites.append(Site(kind, name, int(at), (int(first), int(second)),
+                          int(inclusive), int(self_)))
+    return Profile(source, cycles, sites)
+
+
+def percent(part, total):
+    return 100.0 * part / total if total else 0.0
+
+
+def report(profile, sink=sys.stdout, top=20):
+    """Writes the hottest procedures, loops and branches to sink.
+
+    With cycles, procedures and loops are ranked by self time and
+    otherwise by calls and iterations.
+    """
+    procedures = [x for x in profile.sites if x.kind == 'procedure']
+    loops_ = [x for x in profile.sites if x.kind == 'loop']
+    branches = [x for x in profile.sites if x.kind == 'branch']
+    total = sum(x.self_ for x in procedures + loops_)
+
+    def rank(sites, count):
+        if profile.cycles:
+            return sorted(sites, key=lambda x: (-x.self_, x.line))[:top]
+        return sorted(sites, key=lambda x: (-x.counts[count], x.line))[:top]
+
+    print('Procedures', file=sink)
+    print('  {:>7} {:>7} {:>12}  {}'.format('self%', 'incl%', 'calls',
+                                            'name'), file=sink)
+    for site in rank(procedures, 0):
+        print('  {:7.2f} {:7.2f} {:12}  {} (line {})'.format(
+            percent(site.self_, total), percent(site.inclusive, total),
+            site.counts[0], site.name, site.line), file=sink)
+
+    print('Loops', file=sink)
+    print('  {:>7} {:>7} {:>12} {:>12} {:>9}  {}'.format(
+        'self%', 'incl%', 'entries', 'iterations', 'trip', 'name'),
+          file=sink)
+    for site in rank(loops_, 1):
+        entries, iterations = site.counts
+        print('  {:7.2f} {:7.2f} {:12} {:12} {:9.1f}  {} (line {})'.format(
+            percent(site.self_, total), percent(site.inclusive, total),
+            entries, iterations, iterations / entries if entries else 0,
+            site.name, site.line), file=sink)
+
+    print('Branches', file=sink)
+    print('  {:>12} {:>7}  {}'.format('executed', 'true%', 'name'),
+          file=sink)
+    for site in sorted(branches, key=lambda x: (-x.counts[0], x.line))[:top]:
+        print('  {:12} {:7.2f}  {} (line {})'.format(
+            site.counts[0], percent(site.counts[1], site.counts[0]),
+            site.name, site.line), file=sink)
+
+
+def main():
+    args = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    args.add_argument('profile', nargs='?', default='pl0.profile')
+    args.add_argument('--top', type=int, default=20)
+    pargs = args.parse_args()
+    report(load(pargs.profile), top=pargs.top)
+
+
+if __name__ == '__main__':
+    main()
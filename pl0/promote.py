@@ -0,0 +1,165 @@
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Keeps globals in locals while a loop runs.
+
+Globals are external in the C the default backend emits, and in memory
+in the x86 backend, so every use in a loop is a load or a store.  For
+each WHILE loop, outermost first, a global that the loop uses and that
+no procedure called in it uses or is passed is copied into a fresh
+ir.Intermediate before the loop and, if the loop sets it, back after.
+Intermediates are locals in C and go in registers on x86.
+
+A loop is left alone if anything outside it jumps in or anything in it
+jumps out other than to its end, as after pgo moves a cold IF body out
+of line.  Checks and divisions that fail stop the program, so the
+globals they leave stale are never seen.
+"""
+
+from . import bounds
+from . import cfg
+from . import ir
+from . import pgo
+from . import profile
+
+
+def promote(program):
+    """Promotes the globals used in loops in place."""
+    main = program.blocks[-1]
+    globals_ = set(x.val for x in main.vars_ if isinstance(x, ir.Variable))
+    touched = touches(program, globals_)
+    for block in program.blocks:
+        own = set()
+        if block is not main:
+            own = set(x.val for x in block.vars_
+                      if isinstance(x, (ir.Variable, ir.Array)))
+        Promoter(block, globals_ - own, touched).run()
+    return program
+
+
+def touches(program, globals_, names=pgo.names):
+    """Returns the globals each procedure, or one it calls, uses.
+
+    names returns the names a list of operations uses, so passing one
+    that only returns those they set gives the globals each may change.
+    """
+    blocks = {x.name: x for x in program.blocks if x.name}
+    touched = {}
+    calls = {}
+    for name, block in blocks.items():
+        own = set(x.val for x in block.vars_
+                  if isinstance(x, (ir.Variable, ir.Array)))
+        touched[name] = (names(block.operations) & globals_) - own
+        calls[name] = set(x.name for x in block.operations
+                          if isinstance(x, ir.Call) and x.name in blocks)
+    changed = True
+    while changed:
+        changed = False
+        for name in blocks:
+            for callee in calls[name]:
+                if not touched[callee] <= touched[name]:
+                    touched[name] |= touched[callee]
+                    changed = True
+    return touched
+
+
+class Promoter:
+    def __init__(self, block, globals_, touched):
+        self.block = block
+        self.globals = globals_
+        self.touched = touched
+
+    def run(self):
+        heads, exits = profile.loops(self.block.operations)
+        at = 0
+        while at < len(self.block.operations):
+            operation = self.block.operations[at]
+            if isinstance(operation, ir.Label) and operation.val in heads:
+                at = self.loop(at, exits)
+            at += 1
+
+    def loop(self, at, exits):
+        """Promotes the globals of the loop at at, returning the index of
+        its top label afterwards."""
+        operations = self.block.operations
+        found = bounds.find_loop(operations, at, exits)
+        if found is None or not self.closed(at, found[2]):
+            return at
+        end = found[2]
+        region = operations[at:end + 1]
+        used = set()
+        set_ = set()
+        escapes = set()
+        for operation in region:
+            for operand in ir.uses(operation):
+                if self.global_(operand):
+                    used.add(operand.val)
+            for operand in ir.defs(operation):
+                if self.global_(operand):
+                    used.add(operand.val)
+                    set_.add(operand.val)
+            if isinstance(operation, ir.Call) and operation.arg is None:
+                escapes |= self.touched.get(operation.name, self.globals)
+                # Inlining can make a local passed by pointer a global.
+                escapes |= set(x.val for x in operation.captures)
+        promoted = sorted(used - escapes)
+        if not promoted:
+            return at
+
+        copies = {}
+        for name in promoted:
+            copies[name] = self.fresh()
+        for operation in region:
+            replace(operation, copies)
+        before = [ir.Assign(copies[x], ir.Variable(x), '=') for x in promoted]
+        after = [ir.Assign(ir.Variable(x), copies[x], '=')
+                 for x in promoted if x in set_]
+        self.block.operations = (operations[:at] + before + region + after +
+                                 operations[end + 1:])
+        return at + len(before)
+
+    def global_(self, operand):
+        return isinstance(operand, ir.Variable) and operand.val in self.globals
+
+    def closed(self, at, end):
+        """Returns whether the loop from at to end is only entered at the
+        top and only left at its end."""
+        operations = self.block.operations
+        inside = set(x.val for x in operations[at:end]
+                     if isinstance(x, ir.Label))
+        for idx, operation in enumerate(operations):
+            label = cfg.targets(operation)
+            if label is None:
+                continue
+            if at <= idx <= end:
+                if label.val not in inside and label is not operations[end]:
+                    return False
+            elif label.val in inside or label is operations[end]:
+                return False
+        return True
+
+    def fresh(self):
+        idx = max([x.idx for x in self.block.vars_
+                   if isinstance(x, ir.Intermediate)], default=0) + 1
+        operand = ir.Intermediate(idx)
+        self.block.vars_.append(operand)
+        return operand
+
+
+def replace(operation, copies):
+    """Replaces the globals named in copies throughout operation."""
+    for name in pgo.slots(operation):
+        value = getattr(operation, name, None)
+        if isinstance(value, ir.Variable) and value.val in copies:
+            setattr(operation, name, copies[value.val])
@@ -0,0 +1,490 @@
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Propagates constants and value ranges through an ir.Program.
+
+This is sparse conditional constant propagation, after Wegman and
+Zadeck, with a range in place of each constant.  Rather than on SSA
+form it works on the states at the labels of each block: a state maps
+each variable and intermediate to the lowest and highest value it can
+have there, and a branch only passes a state on along the ways it can
+go, narrowed by its condition.  A label reached again and again has
+its ranges widened to the limits of int_t, so loops settle quickly.
+
+Globals start at 0 and global constants have their value.  A call
+loses the globals the procedure, or one it calls, may set and the
+locals it is passed.  Each procedure starts with what holds at every
+call to it that can run, so one always called with a global set to a
+constant is specialised to that constant.
+
+With the result propagate():
+
+    replaces variables and intermediates known to be constant with
+    Numbers and folds the operations computing them,
+    turns branches that always jump into Gotos and removes those that
+    never do, so IF bodies and WHILE loops that can't run go,
+    removes Checks that always pass, and
+    removes operations that can't be reached and the intermediates
+    that are no longer used.
+
+Procedures that are never called are left alone.
+"""
+
+import heapq
+
+from . import cfg
+from . import ir
+from . import promote
+
+MIN = -2**31
+MAX = 2**31 - 1
+FULL = MIN, MAX
+# Labels and procedures whose state grows more often than this are
+# widened.
+WIDEN = 4
+
+
+def propagate(program):
+    """Folds what is known about the values in program in place."""
+    context = Context(program)
+    entries = {None: {x: (0, 0) for x in context.globals}}
+    flows = {}
+    grown = {}
+    changed = True
+    while changed:
+        changed = False
+        for block in reversed(program.blocks):
+            entry = entries.get(block.name)
+            if entry is None or (block.name in flows and
+                                 flows[block.name].entry == entry):
+                continue
+            flow = flows[block.name] = Flow(block, entry, context)
+            for callee, state in flow.calls():
+                old = entries.get(callee)
+                new = state if old is None else join(old, state)
+                if new == old:
+                    continue
+                if old is not None:
+                    grown[callee] = grown.get(callee, 0) + 1
+                    if grown[callee] > WIDEN:
+                        new = widen(old, new)
+                entries[callee] = new
+                changed = True
+    for flow in flows.values():
+        flow.fold()
+    return program
+
+
+def sets(operations):
+    """Returns the names of the variables operations may set."""
+    return set(x.val for operation in operations
+               for x in ir.defs(operation) if isinstance(x, ir.Variable))
+
+
+class Context:
+    """What the blocks of a program know about each other."""
+
+    def __init__(self, program):
+        main = program.blocks[-1]
+        self.globals = set(x.val for x in main.vars_
+                           if isinstance(x, ir.Variable))
+        self.constants = {x.name: x.val for x in main.consts}
+        self.blocks = {x.name: x for x in program.blocks if x.name}
+        self.sets = promote.touches(program, self.globals, sets)
+
+
+class Flow:
+    """The ranges of the values in a block, given those on entry.
+
+    inputs maps the index of the first operation and of each Label that
+    can be reached to the state there.
+    """
+
+    def __init__(self, block, entry, context):
+        self.block = block
+        self.operations = block.operations
+        self.context = context
+        self.locals = set()
+        if block.name is not None:
+            self.locals = set(x.val for x in block.vars_
+                              if isinstance(x, (ir.Variable, ir.Array)))
+        self.globals = context.globals - self.locals
+        self.constants = {k: v for k, v in context.constants.items()
+                          if k not in self.locals}
+        self.leaders = {x: at for at, x in enumerate(self.operations)
+                        if isinstance(x, ir.Label)}
+        self.entry = entry
+        self.inputs = {0: {k: v for k, v in entry.items()
+                           if k not in self.locals}}
+        self.grown = {}
+        # The globals at each call that can run, by its index.
+        self.sites = {}
+        # Leaders are walked in order so that the body of a loop sees
+        # everything that reaches its top at once.
+        self.work = [0]
+        self.queued = {0}
+        while self.work:
+            at = heapq.heappop(self.work)
+            self.queued.remove(at)
+            for _ in self.walk(at):
+                pass
+
+    def walk(self, at):
+        """Runs the operations from the leader at at, yielding the index,
+        operation and state before it of each, up to the next Label."""
+        state = dict(self.inputs[at])
+        for idx in range(at, len(self.operations)):
+            operation = self.operations[idx]
+            if idx != at and isinstance(operation, ir.Label):
+                self.reach(idx, state)
+                return
+            yield idx, operation, state
+            if (isinstance(operation, ir.Call) and operation.arg is None and
+                    operation.name in self.context.blocks):
+                self.sites[idx] = operation.name, {
+                    k: v for k, v in state.items() if k in self.globals}
+            if isinstance(operation, ir.Goto):
+                self.reach(self.leaders[operation.val], state)
+                return
+            if isinstance(operation, ir.Branch):
+                jumps, falls = self.decide(operation, state)
+                if jumps:
+                    self.reach(self.leaders[operation.target],
+                               self.narrow(operation, True, state))
+                if not falls:
+                    return
+                state = self.narrow(operation, False, state)
+            else:
+                self.step(operation, state)
+
+    def reach(self, at, state):
+        """Joins state into the one at the leader at at."""
+        old = self.inputs.get(at)
+        new = dict(state) if old is None else join(old, state)
+        if new == old:
+            return
+        if old is not None:
+            self.grown[at] = self.grown.get(at, 0) + 1
+            if self.grown[at] > WIDEN:
+                new = widen(old, new)
+        self.inputs[at] = new
+        if at not in self.queued:
+            heapq.heappush(self.work, at)
+            self.queued.add(at)
+
+    def replay(self):
+        """Yields each operation that can run with the state before it."""
+        for at in sorted(self.inputs):
+            yield from self.walk(at)
+
+    def calls(self):
+        """Returns the procedure and globals at each call that can run."""
+        return [self.sites[x] for x in sorted(self.sites)]
+
+    def key(self, operand):
+        """Returns the key of operand in a state, or None if it has
+        none."""
+        if isinstance(operand, ir.Intermediate):
+            return operand.idx
+        if isinstance(operand, ir.Variable) and (
+                operand.val in self.locals or operand.val in self.globals):
+            return operand.val
+        return None
+
+    def range(self, operand, state):
+        kind = type(operand)
+        if kind is ir.Number:
+            return operand.val, operand.val
+        if kind is ir.Intermediate:
+            return state.get(operand.idx, FULL)
+        if kind is ir.Variable:
+            if operand.val in self.constants:
+                value = self.constants[operand.val]
+                return value, value
+            return state.get(operand.val, FULL)
+        return FULL
+
+    def assign(self, operand, value, state):
+        key = self.key(operand)
+        if key is None:
+            return
+        if value == FULL or value[0] > value[1]:
+            state.pop(key, None)
+        else:
+            state[key] = value
+
+    def step(self, operation, state):
+        """Updates state for running operation, which isn't a branch."""
+        if isinstance(operation, ir.Operation):
+            self.assign(operation.result, self.evaluate(operation, state),
+                        state)
+        elif isinstance(operation, (ir.Read, ir.Load)):
+            for operand in ir.defs(operation):
+                self.assign(operand, FULL, state)
+        elif isinstance(operation, ir.Check):
+            # Only carries on if the index is in bounds.
+            low, high = self.range(operation.index, state)
+            self.assign(operation.index, (max(low, 0),
+                                          min(high, operation.size - 1)),
+                        state)
+        elif isinstance(operation, ir.Call) and operation.arg is None:
+            changed = self.context.sets.get(operation.name, self.globals)
+            for name in changed & self.globals:
+                state.pop(name, None)
+            for operand in operation.captures:
+                self.assign(operand, FULL, state)
+
+    def evaluate(self, operation, state):
+        """Returns the range of the result of operation."""
+        left = self.range(operation.left, state)
+        if isinstance(operation, ir.Assign) or operation.right is None:
+            return left
+        right = self.range(operation.right, state)
+        if isinstance(operation, ir.Condition):
+            true, false = compare(operation.operation, left, right)
+            return int(not false), int(true)
+        return arithmetic(operation.operation, left, right)
+
+    def decide(self, branch, state):
+        """Returns whether branch can jump and whether it can fall
+        through."""
+        left = self.range(branch.left, state)
+        if isinstance(branch, ir.If):
+            return left[0] <= 0 <= left[1], left != (0, 0)
+        right = None
+        if branch.right is not None:
+            right = self.range(branch.right, state)
+        return compare(branch.operation, left, right)
+
+    def narrow(self, branch, jumped, state):
+        """Returns state narrowed by what holds after branch jumps, or
+        falls through if jumped is False."""
+        state = dict(state)
+        left = self.range(branch.left, state)
+        if isinstance(branch, ir.If):
+            if jumped:
+                self.assign(branch.left, (0, 0), state)
+            elif left[0] == 0:
+                self.assign(branch.left, (1, left[1]), state)
+            elif left[1] == 0:
+                self.assign(branch.left, (left[0], -1), state)
+            return state
+        holds = branch.operation if jumped else ir.NEGATED[branch.operation]
+        if branch.right is None:
+            return state
+        right = self.range(branch.right, state)
+        left, right = bound(holds, left, right)
+        self.assign(branch.left, left, state)
+        self.assign(branch.right, right, state)
+        return state
+
+    def fold(self):
+        """Rewrites the block with what is known."""
+        folded = {}
+        for idx, operation, state in self.replay():
+            folded[idx] = self.rewrite(operation, state)
+        operations = []
+        for idx, operation in enumerate(self.operations):
+            if idx in folded:
+                operations.extend(folded[idx])
+            elif isinstance(operation, (ir.Enter, ir.Exit)):
+                operations.append(operation)
+        operations = [x for at, x in enumerate(operations)
+                      if not (isinstance(x, ir.Goto) and x.val in
+                              cfg.following_labels(operations, at))]
+        self.block.operations = unused(operations)
+        used = set(x.idx for operation in self.block.operations
+                   for x in ir.uses(operation) + ir.defs(operation)
+                   if isinstance(x, ir.Intermediate))
+        kept = [x for x in self.block.vars_
+                if not isinstance(x, ir.Intermediate) or x.idx in used]
+        self.block.vars_ = ir.Variables()
+        self.block.vars_.append(*kept)
+
+    def rewrite(self, operation, state):
+        """Returns what to replace operation with given the state before
+        it."""
+        if isinstance(operation, ir.Branch):
+            jumps, falls = self.decide(operation, state)
+            if not falls:
+                return [ir.Goto(operation.target)]
+            if not jumps:
+                return []
+        elif isinstance(operation, ir.Check):
+            low, high = self.range(operation.index, state)
+            if low >= 0 and high < operation.size:
+                return []
+        elif (isinstance(operation, ir.Operation) and
+              not isinstance(operation, ir.Assign)):
+            low, high = self.evaluate(operation, state)
+            if low == high:
+                return [ir.Assign(operation.result, ir.Number(low), '=')]
+        for name in VALUES.get(type(operation), ()):
+            value = getattr(operation, name)
+            low, high = self.range(value, state)
+            if low == high and isinstance(value, (ir.Variable,
+                                                  ir.Intermediate)):
+                setattr(operation, name, ir.Number(low))
+        return [operation]
+
+
+# The slots of each kind of operation that hold a value read by it.
+VALUES = {
+    ir.Operation: ('left', 'right'),
+    ir.Condition: ('left', 'right'),
+    ir.TwoAddress: ('left', ),
+    ir.Assign: ('left', ),
+    ir.If: ('left', ),
+    ir.Jump: ('left', 'right'),
+    ir.Call: ('arg', ),
+    ir.Load: ('index', ),
+    ir.Store: ('index', 'value'),
+    ir.Check: ('index', ),
+}
+
+
+def unused(operations):
+    """Returns operations without those that only set intermediates that
+    nothing uses."""
+    while True:
+        used = set(x.idx for operation in operations
+                   for x in ir.uses(operation)
+                   if isinstance(x, ir.Intermediate))
+        kept = [x for x in operations
+                if not (isinstance(x, ir.Operation) and
+                        isinstance(x.result, ir.Intermediate) and
+                        x.result.idx not in used and not traps(x))]
+        if len(kept) == len(operations):
+            return kept
+        operations = kept
+
+
+def traps(operation):
+    """Returns whether operation may stop the program."""
+    return operation.operation == '/' and not (
+        isinstance(operation.right, ir.Number) and
+        operation.right.val not in (0, -1))
+
+
+def join(one, other):
+    """Returns the state that holds if one or other does."""
+    return {k: (min(v[0], other[k][0]), max(v[1], other[k][1]))
+            for k, v in one.items() if k in other}
+
+
+def widen(old, new):
+    """Returns new with the ranges that grew since old taken to the
+    limits of int_t."""
+    widened = {}
+    for key, (low, high) in new.items():
+        if low < old[key][0]:
+            low = MIN
+        if high > old[key][1]:
+            high = MAX
+        if (low, high) != FULL:
+            widened[key] = low, high
+    return widened
+
+
+def bounded(low, high):
+    """Returns the range low to high, or FULL if it may overflow."""
+    if low < MIN or high > MAX:
+        return FULL
+    return low, high
+
+
+def divide(left, right):
+    """Divides as C does, rounding towards zero."""
+    quotient = abs(left) // abs(right)
+    return -quotient if (left < 0) != (right < 0) else quotient
+
+
+def arithmetic(operation, left, right):
+    """Returns the range of left operation right."""
+    if operation == '+':
+        return bounded(left[0] + right[0], left[1] + right[1])
+    if operation == '-':
+        return bounded(left[0] - right[1], left[1] - right[0])
+    if operation == '*':
+        products = [x * y for x in left for y in right]
+        return bounded(min(products), max(products))
+    if operation == '/':
+        if right[0] <= 0 <= right[1]:
+            return FULL
+        quotients = [divide(x, y) for x in left for y in right]
+        return bounded(min(quotients), max(quotients))
+    if operation == '&':
+        if left[0] == left[1] and right[0] == right[1]:
+            return left[0] & right[0], left[0] & right[0]
+        if left[0] >= 0 and right[0] >= 0:
+            return 0, min(left[1], right[1])
+    return FULL
+
+
+def compare(operation, left, right):
+    """Returns whether left operation right, as in ir.Jump, can hold
+    and whether it can fail."""
+    if operation in ('odd', 'even'):
+        if left[0] != left[1]:
+            return True, True
+        odd = left[0] % 2 == 1
+        return odd == (operation == 'odd'), odd != (operation == 'odd')
+    if operation in ('>', '>='):
+        return compare(FLIPPED[operation], right, left)
+    if operation == '<':
+        return left[0] < right[1], left[1] >= right[0]
+    if operation == '<=':
+        return left[0] <= right[1], left[1] > right[0]
+    equal = left[0] <= right[1] and right[0] <= left[1]
+    same = left[0] == left[1] == right[0] == right[1]
+    if operation == '=':
+        return equal, not same
+    if operation == '!=':
+        return not same, equal
+    return True, True
+
+
+# The comparison that holds with its operands swapped.
+FLIPPED = {'<': '>', '<=': '>=', '>': '<', '>=': '<=', '=': '=',
+           '!=': '!='}
+
+
+def bound(operation, left, right):
+    """Returns the ranges of left and right narrowed to where left
+    operation right holds."""
+    if operation in ('>', '>='):
+        right, left = bound(FLIPPED[operation], right, left)
+        return left, right
+    if operation in ('<', '<='):
+        margin = 1 if operation == '<' else 0
+        return ((left[0], min(left[1], right[1] - margin)),
+                (max(right[0], left[0] + margin), right[1]))
+    if operation == '=':
+        both = max(left[0], right[0]), min(left[1], right[1])
+        return both, both
+    if operation == '!=':
+        return excluding(left, right), excluding(right, left)
+    return left, right
+
+
+def excluding(values, other):
+    """Returns the range values less the constant other if it is one of
+    its ends."""
+    if other[0] != other[1]:
+        return values
+    if values[0] == other[0]:
+        return values[0] + 1, values[1]
+    if values[1] == other[0]:
+        return values[0], values[1] - 1
+    return values
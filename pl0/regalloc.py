@@ -0,0 +1,113 @@
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Linear scan register allocation for intermediates."""
+
+from . import ir
+from . import util
+
+
+class Interval(util.ReprMixin):
+    __slots__ = 'idx', 'start', 'end', 'crosses_call', 'location'
+
+    def __init__(self, idx, start):
+        self.idx = idx
+        self.start = start
+        self.end = start
+        self.crosses_call = False
+        self.location = None
+
+
+def intervals(operations):
+    """Computes the live interval of each intermediate in a block.
+
+    Positions are indexes into operations.  An interval that is live
+    at the head of a loop is extended to the loop's back edge.
+    """
+    found = {}
+    labels = {}
+    calls = []
+    edges = []
+
+    for at, operation in enumerate(operations):
+        for operand in ir.uses(operation) + ir.defs(operation):
+            if isinstance(operand, ir.Intermediate):
+                interval = found.get(operand.idx)
+                if interval is None:
+                    found[operand.idx] = Interval(operand.idx, at)
+                else:
+                    interval.end = at
+        if isinstance(operation, ir.Label):
+            labels[operation.val] = at
+        elif isinstance(operation, (ir.Call, ir.Read)):
+            calls.append(at)
+        elif isinstance(operation, ir.Goto):
+            edges.append((at, operation.val.val))
+        elif isinstance(operation, ir.Branch):
+            edges.append((at, operation.target.val))
+
+    for at, target in edges:
+        head = labels[target]
+        if head > at:
+            continue
+        for interval in found.values():
+            if interval.start < head <= interval.end < at:
+                interval.end = at
+
+    for interval in found.values():
+        interval.crosses_call = any(interval.start < x < interval.end
+                                    for x in calls)
+
+    return sorted(found.values(), key=lambda x: (x.start, x.idx))
+
+
+def allocate(operations, scratch, preserved):
+    """Assigns a register or None (spilled) to each intermediate.
+
+    scratch registers are clobbered by calls and are only handed to
+    intervals that don't cross one.  Returns the intervals keyed by
+    intermediate index.
+    """
+    active = []
+    free = list(scratch) + list(preserved)
+    result = {}
+
+    def usable(interval, register):
+        return register in preserved or not interval.crosses_call
+
+    for interval in intervals(operations):
+        result[interval.idx] = interval
+
+        for other in sorted(active, key=lambda x: x.end):
+            if other.end >= interval.start:
+                break
+            active.remove(other)
+            free.append(other.location)
+
+        choices = [x for x in free if usable(interval, x)]
+        if choices:
+            interval.location = choices[0]
+            free.remove(choices[0])
+            active.append(interval)
+            continue
+
+        victims = [x for x in active if usable(interval, x.location)]
+        victim = max(victims, key=lambda x: x.end, default=None)
+        if victim is not None and victim.end > interval.end:
+            interval.location = victim.location
+            victim.location = None
+            active.remove(victim)
+            active.append(interval)
+
+    return result
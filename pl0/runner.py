@@ -0,0 +1,118 @@
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Builds generated C into a shared object and runs it in-process.
+
+Shared objects are cached under a key made of the C source, the
+runtime, the compiler flags and the compiler version, so running an
+unchanged program again skips the C compiler entirely.  Like the
+compiler output in pl0.cache, they are kept near LIMIT by removing
+the least recently used before each build.
+"""
+
+import ctypes
+import functools
+import hashlib
+import os
+import subprocess
+import sys
+import tempfile
+
+from . import cache
+
+LIB = os.path.normpath(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+RUNTIME = os.path.join(LIB, 'pl0.cc')
+
+FLAGS = ('-O2', '-shared', '-fPIC')
+# Size limit of the build cache in bytes.
+LIMIT = cache.LIMIT
+# Flags every build gets.  The C backends emit expressions such as
+# a * b + c in signed int arithmetic, and without -fwrapv the compiler
+# may assume they don't overflow and optimise on that.  PL/0 defines
+# them to wrap, as the x86 backend does.
+REQUIRED = ('-fwrapv', )
+
+
+def compiler():
+    return os.environ.get('CC', 'cc')
+
+
+def cache_dir():
+    return os.path.join(cache.root(), 'build')
+
+
+@functools.lru_cache()
+def compiler_version(cc):
+    return subprocess.run([cc, '--version'],
+                          stdout=subprocess.PIPE,
+                          check=True).stdout
+
+
+def key(source, flags, cc):
+    parts = [source.encode(), ' '.join(flags).encode(), compiler_version(cc)]
+    for name in sorted(os.listdir(LIB)):
+        with open(os.path.join(LIB, name), 'rb') as f:
+            parts.append(f.read())
+
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(hashlib.sha256(part).digest())
+    return digest.hexdigest()
+
+
+def build(source, flags=FLAGS, directory=None, extension='.cc',
+          suffix='.so'):
+    """Compiles C source into a shared object, returning its path.
+
+    extension is that of the source, so '.s' builds x86 backend output.
+    Flags without -shared link an executable, which is then best given
+    a different suffix.
+    """
+    cc = compiler()
+    flags = tuple(flags) + REQUIRED
+    directory = directory or cache_dir()
+    path = os.path.join(directory, key(source, flags, cc) + suffix)
+    try:
+        # Marks it as recently used.
+        os.utime(path)
+        return path
+    except FileNotFoundError:
+        pass
+
+    # Before adding to it so that what is built is always kept.
+    cache.Cache(directory, LIMIT).evict()
+    os.makedirs(directory, exist_ok=True)
+    with tempfile.TemporaryDirectory() as work:
+        src = os.path.join(work, 'program' + extension)
+        with open(src, 'w') as f:
+            f.write(source)
+        fd, tmp = tempfile.mkstemp(suffix=suffix + '.tmp', dir=directory)
+        os.close(fd)
+        try:
+            subprocess.run([cc] + list(flags) +
+                           ['-I', LIB, '-o', tmp, src, RUNTIME],
+                           check=True)
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+    return path
+
+
+def run(path):
+    """Loads a shared object built by build() and runs the program."""
+    sys.stdout.flush()
+    library = ctypes.CDLL(path)
+    library.pl0_run()
@@ -0,0 +1,427 @@
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Saves an ir.Program and loads it back.
+
+The text form has one record per line:
+
+    pl0-ir 1
+    block <name> <line> <depth>
+    var <operand>
+    array <name> <size> <slot>
+    const <name> <value>
+    capture <operand>
+    <operation> <fields>
+    end
+
+Operands are written as
+
+    5            ir.Number
+    %3           ir.Intermediate 3
+    @x:0:1       ir.Variable x at depth 0 in slot 1
+    ^p.x:1:0     ir.Captured x of the procedure p
+
+with - for None, and trailing Nones left out of a Variable.  Labels
+are written by name.  Each operation is its class name in lower case
+followed by its fields in the order of its __slots__.
+
+The binary form holds the same records as tuples, written with marshal
+and compressed with zlib after MAGIC and the version.  It is about the
+size of the source and much faster to load than the text or than
+lexing, parsing and lowering the source again.
+
+Loading gives back the same operations, with one Label object per label
+and one Intermediate per index in each block as IRGenerator makes, so
+passes that compare them by identity work on loaded programs too.
+The name of the ir.Program, which IRGenerator sets to the parse tree,
+isn't kept.
+"""
+
+import marshal
+import struct
+import zlib
+
+from . import ir
+
+VERSION = 1
+MAGIC = b'pl0-ir\0'
+HEADER = 'pl0-ir {}'.format(VERSION)
+
+# The operations with a result, left, operation and right.
+OPERATIONS = {
+    'operation': ir.Operation,
+    'twoaddress': ir.TwoAddress,
+    'condition': ir.Condition,
+    'assign': ir.Assign,
+}
+
+
+def recognise(data):
+    """Returns whether the bytes data look like saved IR of any version."""
+    return data.startswith(MAGIC) or data.startswith(b'pl0-ir ')
+
+
+def dumps(program):
+    """Returns program in the text form."""
+    lines = [HEADER]
+    for block in records(program):
+        name, line, depth, vars_, consts, captures, operations = block
+        lines.append('block {} {} {}'.format(word(name), word(line), depth))
+        for var in vars_:
+            if var[0] == 'array':
+                lines.append('array {} {} {}'.format(var[1], var[2],
+                                                     word(var[3])))
+            else:
+                lines.append('var ' + operand(var))
+        for const in consts:
+            lines.append('const {} {}'.format(*const))
+        for captured in captures:
+            lines.append('capture ' + operand(captured))
+        for record in operations:
+            lines.append(operation(record))
+        lines.append('end')
+    return '\n'.join(lines) + '\n'
+
+
+def dumpb(program):
+    """Returns program in the binary form."""
+    return MAGIC + struct.pack('<H', VERSION) + zlib.compress(
+        marshal.dumps(records(program), 4))
+
+
+def loads(data):
+    """Loads a program from either form, given as str or bytes."""
+    if isinstance(data, bytes) and data.startswith(MAGIC):
+        start = len(MAGIC) + 2
+        version, = struct.unpack('<H', data[len(MAGIC):start])
+        if version != VERSION:
+            raise ValueError('not version {} IR'.format(VERSION))
+        return build(marshal.loads(zlib.decompress(data[start:])))
+    if isinstance(data, bytes):
+        data = data.decode()
+    return build(parse(data))
+
+
+def save(path, program, binary=False):
+    if binary:
+        with open(path, 'wb') as f:
+            f.write(dumpb(program))
+    else:
+        with open(path, 'w') as f:
+            f.write(dumps(program))
+
+
+def load(path):
+    with open(path, 'rb') as f:
+        return loads(f.read())
+
+
+def records(program):
+    """Returns program as nested tuples of plain values.
+
+    A block is (name, line, depth, vars, consts, captures, operations),
+    an operation is its class name in lower case followed by its fields
+    and an operand is an int for a Number, (idx, ) for an Intermediate,
+    (val, depth, slot) for a Variable, (val, owner, depth, slot) for a
+    Captured and ('array', val, size, slot) for an Array.  Equal
+    operands and strings are the same object, which marshal writes
+    once.
+    """
+    recorder = Recorder()
+    return [(block.name, block.line, block.depth,
+             [recorder.value(x) for x in block.vars_],
+             [(x.name, x.val) for x in block.consts],
+             [recorder.value(x) for x in block.captures],
+             [recorder.operation(x) for x in block.operations])
+            for block in program.blocks]
+
+
+class Recorder:
+    def __init__(self):
+        self.shared = {}
+
+    def share(self, value):
+        return self.shared.setdefault(value, value)
+
+    def value(self, value):
+        if value is None:
+            return None
+        if isinstance(value, ir.Number):
+            return value.val
+        if isinstance(value, ir.Intermediate):
+            return self.share((value.idx, ))
+        if isinstance(value, ir.Variable):
+            return self.share((value.val, value.depth, value.slot))
+        if isinstance(value, ir.Captured):
+            return self.share((value.val, value.owner, value.depth,
+                               value.slot))
+        if isinstance(value, ir.Array):
+            return ('array', value.val, value.size, value.slot)
+        if isinstance(value, ir.Label):
+            return self.share(value.val)
+        if isinstance(value, list):
+            return [self.value(x) for x in value]
+        if isinstance(value, (bool, str)):
+            return self.share(value)
+        raise ValueError('Can\'t save {!r}'.format(value))
+
+    def operation(self, value):
+        if not isinstance(value, ir.Emittable):
+            raise ValueError('Can\'t save {!r}'.format(value))
+        if isinstance(value, ir.Label):
+            return ('label', self.share(value.val), value.line)
+        if isinstance(value, ir.Check):
+            return ('check', self.value(value.index), value.size, value.line)
+        return (self.share(type(value).__name__.lower()), ) + tuple(
+            self.value(getattr(value, x)) for x in fields(value))
+
+
+def fields(value):
+    """Returns the names of the fields of an operation, in order."""
+    if isinstance(value, ir.Operation):
+        return ir.Operation.__slots__
+    return type(value).__slots__
+
+
+def build(blocks):
+    """Returns the ir.Program that records() made blocks from."""
+    program = ir.Program(None)
+    for name, line, depth, vars_, consts, captures, operations in blocks:
+        program.blocks.append(Builder().block(name, line, depth, vars_,
+                                              consts, captures, operations))
+    return program
+
+
+class Builder:
+    """Makes the objects of one block, sharing labels and
+    intermediates."""
+
+    def __init__(self):
+        self.labels = {}
+        self.intermediates = {}
+
+    def block(self, name, line, depth, vars_, consts, captures, operations):
+        block = ir.Block(name, line, depth)
+        for var in vars_:
+            if var[0] == 'array':
+                block.vars_.append(ir.Array(var[1], var[2], var[3]))
+            else:
+                block.vars_.append(self.operand(var))
+        for const in consts:
+            block.consts.append(ir.Const(*const))
+        block.captures = [self.operand(x) for x in captures]
+        block.operations = [self.operation(x) for x in operations]
+        return block
+
+    def operand(self, value):
+        if value is None:
+            return None
+        if isinstance(value, int):
+            return ir.Number(value)
+        if len(value) == 1:
+            found = self.intermediates.get(value[0])
+            if found is None:
+                found = self.intermediates[value[0]] = ir.Intermediate(
+                    value[0])
+            return found
+        if len(value) == 3:
+            return ir.Variable(*value)
+        return ir.Captured(*value)
+
+    def label(self, name, line=None):
+        found = self.labels.get(name)
+        if found is None:
+            found = self.labels[name] = ir.Label(name, line)
+        elif line is not None:
+            found.line = line
+        return found
+
+    def operation(self, record):
+        kind = record[0]
+        operand = self.operand
+        if kind in OPERATIONS:
+            return OPERATIONS[kind](operand(record[1]), operand(record[2]),
+                                    record[3], operand(record[4]))
+        if kind == 'jump':
+            return ir.Jump(operand(record[1]), record[2], operand(record[3]),
+                           self.label(record[4]), record[5])
+        if kind == 'label':
+            return self.label(record[1], record[2])
+        if kind == 'goto':
+            return ir.Goto(self.label(record[1]))
+        if kind == 'if':
+            return ir.If(operand(record[1]), self.label(record[2]), record[3])
+        if kind == 'call':
+            return ir.Call(record[1], operand(record[2]),
+                           [operand(x) for x in record[3]])
+        if kind == 'read':
+            return ir.Read(operand(record[1]))
+        if kind == 'load':
+            return ir.Load(operand(record[1]), operand(record[2]),
+                           operand(record[3]))
+        if kind == 'store':
+            return ir.Store(operand(record[1]), operand(record[2]),
+                            operand(record[3]))
+        if kind == 'check':
+            return ir.Check(operand(record[1]), record[2], record[3])
+        if kind == 'enter':
+            return ir.Enter()
+        if kind == 'exit':
+            return ir.Exit()
+        raise ValueError('Unknown operation {}'.format(kind))
+
+
+def word(value):
+    """Returns the text of a name, number or None."""
+    return '-' if value is None else str(value)
+
+
+def operand(value):
+    """Returns the text of an operand record."""
+    if value is None:
+        return '-'
+    if isinstance(value, int):
+        return str(value)
+    if len(value) == 1:
+        return '%{}'.format(value[0])
+    if len(value) == 3:
+        name, depth, slot = value
+        if slot is not None:
+            return '@{}:{}:{}'.format(name, word(depth), slot)
+        if depth is not None:
+            return '@{}:{}'.format(name, depth)
+        return '@' + name
+    name, owner, depth, slot = value
+    return '^{}.{}:{}:{}'.format(owner, name, word(depth), word(slot))
+
+
+def operation(record):
+    """Returns the text of an operation record."""
+    kind = record[0]
+    if kind in OPERATIONS:
+        return '{} {} {} {} {}'.format(kind, operand(record[1]),
+                                       operand(record[2]), record[3],
+                                       operand(record[4]))
+    if kind == 'jump':
+        return 'jump {} {} {} {} {}'.format(operand(record[1]), record[2],
+                                            operand(record[3]), record[4],
+                                            flag(record[5]))
+    if kind == 'label':
+        return 'label {} {}'.format(record[1], word(record[2]))
+    if kind == 'goto':
+        return 'goto ' + record[1]
+    if kind == 'if':
+        return 'if {} {} {}'.format(operand(record[1]), record[2],
+                                    flag(record[3]))
+    if kind == 'call':
+        return ' '.join(['call', record[1], operand(record[2])] +
+                        [operand(x) for x in record[3]])
+    if kind == 'check':
+        return 'check {} {} {}'.format(operand(record[1]), record[2],
+                                       word(record[3]))
+    return ' '.join([kind] + [operand(x) for x in record[1:]])
+
+
+def flag(value):
+    return '-' if value is None else str(int(value))
+
+
+def parse(text):
+    """Returns the records of the text form."""
+    lines = text.splitlines()
+    if not lines or lines[0] != HEADER:
+        raise ValueError('not version {} IR'.format(VERSION))
+    blocks = []
+    block = None
+    for number, line in enumerate(lines[1:], 2):
+        parts = line.split()
+        kind = parts[0] if parts else ''
+        try:
+            if kind == 'block':
+                block = (name(parts[1]), number_(parts[2]), int(parts[3]),
+                         [], [], [], [])
+                blocks.append(block)
+            elif kind == 'end':
+                block = None
+            elif kind == 'var':
+                block[3].append(parse_operand(parts[1]))
+            elif kind == 'array':
+                block[3].append(('array', parts[1], int(parts[2]),
+                                 number_(parts[3])))
+            elif kind == 'const':
+                block[4].append((parts[1], int(parts[2])))
+            elif kind == 'capture':
+                block[5].append(parse_operand(parts[1]))
+            else:
+                block[6].append(parse_operation(kind, parts))
+        except (IndexError, KeyError, TypeError, ValueError) as ex:
+            raise ValueError('line {}: bad IR: {}'.format(number, line)) \
+                from ex
+    if block is not None:
+        raise ValueError('missing end')
+    return blocks
+
+
+def parse_operation(kind, parts):
+    if kind in OPERATIONS:
+        return (kind, parse_operand(parts[1]), parse_operand(parts[2]),
+                parts[3], parse_operand(parts[4]))
+    if kind == 'jump':
+        return ('jump', parse_operand(parts[1]), parts[2],
+                parse_operand(parts[3]), parts[4], parse_flag(parts[5]))
+    if kind == 'label':
+        return ('label', parts[1], number_(parts[2]))
+    if kind == 'goto':
+        return ('goto', parts[1])
+    if kind == 'if':
+        return ('if', parse_operand(parts[1]), parts[2], parse_flag(parts[3]))
+    if kind == 'call':
+        return ('call', parts[1], parse_operand(parts[2]),
+                [parse_operand(x) for x in parts[3:]])
+    if kind == 'check':
+        return ('check', parse_operand(parts[1]), int(parts[2]),
+                number_(parts[3]))
+    if kind in ('read', 'load', 'store', 'enter', 'exit'):
+        return (kind, ) + tuple(parse_operand(x) for x in parts[1:])
+    raise ValueError('Unknown operation {}'.format(kind))
+
+
+def parse_operand(text):
+    first = text[0]
+    if first == '%':
+        return (int(text[1:]), )
+    if first == '@':
+        found = text[1:].split(':')
+        while len(found) < 3:
+            found.append('-')
+        return (found[0], number_(found[1]), number_(found[2]))
+    if first == '^':
+        owner, _, rest = text[1:].partition('.')
+        val, depth, slot = rest.split(':')
+        return (val, owner, number_(depth), number_(slot))
+    if text == '-':
+        return None
+    return int(text)
+
+
+def name(text):
+    return None if text == '-' else text
+
+
+def number_(text):
+    return None if text == '-' else int(text)
+
+
+def parse_flag(text):
+    return None if text == '-' else text == '1'
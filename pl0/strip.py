@@ -0,0 +1,97 @@
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Removes the procedures and code of an ir.Program that can't run.
+
+IRGenerator emits every procedure that is declared, and the backends
+emit every block.  strip() removes the operations of each block that
+nothing can reach, as cfg.prune does, and then the procedures that no
+call reachable from the main block names.  Calls in code that can't
+run don't count, and neither do those left in procedures that are
+removed, so after pl0.propagate has folded away an IF the procedures
+only it called go too.
+
+The Report counts from when the program was measured, which the driver
+does before pl0.propagate, and `pl0.driver strip` prints it for each
+program.
+"""
+
+from . import cfg
+from . import ir
+from . import util
+
+
+class Report(util.ReprMixin):
+    """What strip() removed from a program.
+
+    procedures and operations are how many procedures and operations
+    other than labels the program had, removed the names of the
+    procedures removed and kept how many operations are left.
+    """
+    __slots__ = 'procedures', 'operations', 'removed', 'kept'
+
+    def __init__(self, procedures, operations):
+        self.procedures = procedures
+        self.operations = operations
+        self.removed = []
+        self.kept = operations
+
+    def __str__(self):
+        names = ''
+        if self.removed:
+            names = ' ({})'.format(', '.join(self.removed))
+        return 'removed {} of {} procedures{} and {} of {} operations'.format(
+            len(self.removed), self.procedures, names,
+            self.operations - self.kept, self.operations)
+
+
+def measure(program):
+    """Returns a Report of program with nothing removed yet."""
+    return Report(len(program.blocks) - 1, size(program))
+
+
+def strip(program, report=None):
+    """Strips program in place, returning a Report of what was removed
+    since report was measured, by default just now."""
+    report = report or measure(program)
+    for block in program.blocks:
+        cfg.prune(block)
+    called = reachable(program)
+    report.removed = [x.name for x in program.blocks
+                      if x.name is not None and x.name not in called]
+    program.blocks = [x for x in program.blocks
+                      if x.name is None or x.name in called]
+    report.kept = size(program)
+    return report
+
+
+def size(program):
+    return sum(not isinstance(x, ir.Label) for block in program.blocks
+               for x in block.operations)
+
+
+def reachable(program):
+    """Returns the names of the procedures that the main block can call,
+    directly or through others."""
+    blocks = {x.name: x for x in program.blocks}
+    called = set()
+    pending = [None]
+    while pending:
+        for operation in blocks[pending.pop()].operations:
+            if (isinstance(operation, ir.Call) and operation.arg is None and
+                    operation.name in blocks and
+                    operation.name not in called):
+                called.add(operation.name)
+                pending.append(operation.name)
+    return called
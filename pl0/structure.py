@@ -0,0 +1,109 @@
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Rebuilds WHILE and IF blocks from the label and goto IR."""
+
+from . import ir
+from . import util
+
+
+class Unstructured(Exception):
+    pass
+
+
+class Loop(util.ReprMixin):
+    """A while loop.  head runs at the top, then cond, the ir.Branch that
+    leaves the loop when it jumps."""
+    __slots__ = 'head', 'cond', 'body'
+
+    def __init__(self, head, cond, body):
+        self.head = head
+        self.cond = cond
+        self.body = body
+
+
+class Conditional(util.ReprMixin):
+    """An IF.  body runs unless cond, an ir.Branch, jumps."""
+    __slots__ = 'cond', 'body'
+
+    def __init__(self, cond, body):
+        self.cond = cond
+        self.body = body
+
+
+def structure(operations):
+    """Returns operations as a tree of operations, Loops and Conditionals.
+
+    Raises Unstructured if the control flow isn't the shape that
+    IRGenerator emits for WHILE and IF.
+    """
+    heads = set(x.val.val for x in operations if isinstance(x, ir.Goto))
+    items, at = _sequence(operations, 0, len(operations), None, heads)
+    if at != len(operations):
+        raise Unstructured('Stray label {}'.format(operations[at]))
+    return items
+
+
+def _sequence(operations, at, limit, stop, heads):
+    items = []
+
+    while at < limit:
+        operation = operations[at]
+        if isinstance(operation, ir.Label) and operation.val == stop:
+            return items, at
+        if isinstance(operation, ir.Label) and operation.val in heads:
+            loop, at = _loop(operations, at, limit, heads)
+            items.append(loop)
+        elif isinstance(operation, ir.Label):
+            at += 1
+        elif isinstance(operation, ir.Branch):
+            body, at = _sequence(operations, at + 1, limit,
+                                 operation.target.val, heads)
+            items.append(Conditional(operation, body))
+            at += 1
+        elif isinstance(operation, ir.Goto):
+            raise Unstructured('Stray goto {}'.format(operation.val.val))
+        else:
+            items.append(operation)
+            at += 1
+
+    if stop is not None:
+        raise Unstructured('Missing label {}'.format(stop))
+    return items, at
+
+
+def _loop(operations, at, limit, heads):
+    top = operations[at].val
+    head = []
+    at += 1
+    while at < limit and not isinstance(operations[at], ir.Branch):
+        if isinstance(operations[at], (ir.Label, ir.Goto)):
+            raise Unstructured('Branch in the head of {}'.format(top))
+        head.append(operations[at])
+        at += 1
+    if at == limit:
+        raise Unstructured('Loop {} has no exit'.format(top))
+
+    test = operations[at]
+    end = test.target.val
+    stop = at + 1
+    while stop < limit and not (isinstance(operations[stop], ir.Label)
+                                and operations[stop].val == end):
+        stop += 1
+    back = operations[stop - 1]
+    if stop == limit or not isinstance(back, ir.Goto) or back.val.val != top:
+        raise Unstructured('Loop {} has no back edge'.format(top))
+
+    body, at = _sequence(operations, at + 1, stop - 1, None, heads - {top})
+    return Loop(head, test, body), stop + 1
@@ -0,0 +1,141 @@
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Symbol tables for the nested scopes of a PL/0 program.
+
+Each name is declared once in its scope and resolves to a Symbol whose
+depth is that of the scope, 0 for the main program, and whose slot
+numbers the variables and arrays of the scope from 0.  An interpreter
+can keep the variables of an activation in a list indexed by slot, and
+those of an enclosing scope are found by depth.
+
+Undeclared names, names declared twice in one scope and names used as
+the wrong kind of thing are recorded in errors rather than raised, so
+that one pass over a program reports all of them.
+"""
+
+from . import util
+
+# The kinds of Symbol.
+VAR = 'var'
+ARRAY = 'array'
+CONST = 'const'
+PROCEDURE = 'procedure'
+
+# How errors describe each kind.
+DESCRIPTIONS = {
+    VAR: 'a variable',
+    ARRAY: 'an array',
+    CONST: 'a constant',
+    PROCEDURE: 'a procedure',
+}
+
+
+class Symbol(util.ReprMixin):
+    """A declared name.
+
+    value is the size of an array, the value of a constant and the
+    unique name of a procedure.  slot is None for constants and
+    procedures.
+    """
+    __slots__ = 'name', 'kind', 'depth', 'slot', 'value', 'line'
+
+    def __init__(self, name, kind, depth, slot=None, value=None, line=None):
+        self.name = name
+        self.kind = kind
+        self.depth = depth
+        self.slot = slot
+        self.value = value
+        self.line = line
+
+    def storage(self):
+        """Returns whether the symbol has a slot."""
+        return self.kind in (VAR, ARRAY)
+
+
+class Scope(util.ReprMixin):
+    __slots__ = 'depth', 'symbols', 'slots'
+
+    def __init__(self, depth):
+        self.depth = depth
+        self.symbols = {}
+        self.slots = 0
+
+
+class SymbolTable:
+    def __init__(self):
+        self.scopes = []
+        self.errors = []
+        self.undeclared = set()
+
+    def enter(self):
+        self.scopes.append(Scope(len(self.scopes)))
+
+    def leave(self):
+        return self.scopes.pop()
+
+    @property
+    def depth(self):
+        return len(self.scopes) - 1
+
+    def declare(self, token, kind, value=None):
+        """Declares the name of token in the innermost scope and returns
+        its Symbol."""
+        scope = self.scopes[-1]
+        previous = scope.symbols.get(token.val)
+        if previous is not None:
+            self.error(token, '{} is already declared on line {}'.format(
+                token.val, previous.line))
+            return previous
+        symbol = Symbol(token.val, kind, scope.depth, line=token.line,
+                        value=value)
+        if symbol.storage():
+            symbol.slot = scope.slots
+            scope.slots += 1
+        scope.symbols[token.val] = symbol
+        return symbol
+
+    def lookup(self, name):
+        """Returns the Symbol for name in the innermost scope that
+        declares it, or None."""
+        for scope in reversed(self.scopes):
+            symbol = scope.symbols.get(name)
+            if symbol is not None:
+                return symbol
+        return None
+
+    def resolve(self, token, *kinds):
+        """Returns the Symbol for the name of token, which must be one of
+        kinds, or records an error and returns None."""
+        symbol = self.lookup(token.val)
+        if symbol is None:
+            # Once per name is enough.
+            if token.val not in self.undeclared:
+                self.undeclared.add(token.val)
+                self.error(token, '{} is not declared'.format(token.val))
+            return None
+        if symbol.kind not in kinds:
+            self.error(token, '{} is {}, not {}'.format(
+                token.val, DESCRIPTIONS[symbol.kind], ' or '.join(
+                    DESCRIPTIONS[x] for x in kinds)))
+            return None
+        return symbol
+
+    def error(self, token, message):
+        self.errors.append('line {}: {}'.format(token.line, message))
+
+    def check(self):
+        """Raises a ValueError listing the errors, if there are any."""
+        if self.errors:
+            raise ValueError('\n'.join(self.errors))
@@ -0,0 +1,221 @@
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Generates random but valid PL/0 programs of a given shape.
+
+The same shape and seed always give the same program.  Each field of
+Shape scales one dimension of the program and the size of the output
+grows linearly in each of them:
+
+    procedures  procedures after the globals
+    depth       WHILE and IF blocks nested inside each block
+    statements  statements in each BEGIN ... END
+    terms       terms in each expression
+    nesting     parenthesised expressions nested inside each expression
+    variables   globals, and locals in each procedure
+
+Procedures only use globals and their own locals and only call the
+procedures before them, so programs never recurse.  Loops count down
+a variable that nothing else assigns and divisors are non-zero
+constants, so programs always terminate.  Arithmetic may overflow.
+"""
+
+import argparse
+import random
+
+from . import util
+
+CONDITIONS = ('=', '#', '<', '<=', '>', '>=')
+
+# Deeper blocks aren't indented any further, which keeps the size in
+# characters linear in depth.
+MAX_INDENT = 8
+
+
+class Shape(util.ReprMixin):
+    __slots__ = ('procedures', 'depth', 'statements', 'terms', 'nesting',
+                 'variables')
+
+    def __init__(self, procedures=4, depth=2, statements=6, terms=3,
+                 nesting=1, variables=4):
+        self.procedures = procedures
+        self.depth = depth
+        self.statements = statements
+        self.terms = terms
+        self.nesting = nesting
+        self.variables = variables
+
+    def scaled(self, name, factor):
+        """Returns a copy with the field name multiplied by factor."""
+        values = {x: getattr(self, x) for x in self.__slots__}
+        values[name] *= factor
+        return Shape(**values)
+
+
+class Generator:
+    def __init__(self, shape, seed):
+        self.shape = shape
+        self.rng = random.Random(seed)
+        self.lines = []
+        self.indent = 0
+        self.consts = ['k{}'.format(x) for x in range(shape.variables)]
+        self.globals = ['g{}'.format(x) for x in range(shape.variables)]
+        self.scope = []
+        self.procedures = []
+
+    def line(self, text):
+        self.lines.append('    ' * min(self.indent, MAX_INDENT) + text)
+
+    def program(self):
+        shape = self.shape
+        self.line('CONST {};'.format(', '.join(
+            '{} = {}'.format(x, self.rng.randint(1, 100))
+            for x in self.consts)))
+        self.line('VAR {};'.format(', '.join(self.globals + self.counters(
+            'm'))))
+
+        for idx in range(shape.procedures):
+            name = 'p{}'.format(idx)
+            self.line('')
+            self.line('PROCEDURE {};'.format(name))
+            locals_ = ['v{}'.format(x) for x in range(shape.variables)]
+            self.line('VAR {};'.format(', '.join(locals_ + self.counters(
+                'w'))))
+            self.scope = []
+            prologue = [x + ' := ' + self.expression(shape.nesting)
+                        for x in locals_]
+            self.scope = locals_
+            self.block(prologue, 'w')
+            self.lines[-1] += ';'
+            self.procedures.append(name)
+
+        self.line('')
+        self.scope = []
+        self.block(['! ' + x for x in self.globals], 'm', last=True)
+        self.lines[-1] += '.'
+        return '\n'.join(self.lines) + '\n'
+
+    def counters(self, prefix):
+        return ['{}{}'.format(prefix, x) for x in range(self.shape.depth)]
+
+    def block(self, prologue, prefix, last=False):
+        """Writes a BEGIN ... END of shape.statements statements.
+
+        prologue comes first and, with last set, the same lines are
+        also written at the end.
+        """
+        self.compound(prefix, 0, prologue, prologue if last else [])
+
+    def compound(self, prefix, depth, head=(), tail=()):
+        self.line('BEGIN')
+        self.indent += 1
+        count = self.shape.statements
+        nested = self.rng.randrange(count) if depth < self.shape.depth else -1
+        statements = list(head)
+        for idx in range(count):
+            if idx == nested:
+                statements.append(None)
+            else:
+                statements.append(self.statement())
+        statements.extend(tail)
+
+        for idx, statement in enumerate(statements):
+            end = ';' if idx < len(statements) - 1 else ''
+            if statement is None:
+                self.nested(prefix, depth)
+                self.lines[-1] += end
+            else:
+                self.line(statement + end)
+        self.indent -= 1
+        self.line('END')
+
+    def nested(self, prefix, depth):
+        if self.rng.random() < 0.5:
+            self.line('IF {} THEN'.format(self.condition()))
+            self.compound(prefix, depth + 1)
+            return
+
+        counter = '{}{}'.format(prefix, depth)
+        self.line('{} := {};'.format(counter, self.rng.randint(1, 3)))
+        self.line('WHILE {} > 0 DO'.format(counter))
+        self.compound(prefix, depth + 1,
+                      tail=['{0} := {0} - 1'.format(counter)])
+
+    def statement(self):
+        choice = self.rng.random()
+        if choice < 0.1 and self.procedures:
+            return 'CALL ' + self.rng.choice(self.procedures)
+        if choice < 0.2:
+            return '! ' + self.expression(self.shape.nesting)
+        return '{} := {}'.format(self.rng.choice(self.globals + self.scope),
+                                 self.expression(self.shape.nesting))
+
+    def condition(self):
+        if self.rng.random() < 0.2:
+            return 'ODD ' + self.expression(self.shape.nesting)
+        return '{} {} {}'.format(self.expression(self.shape.nesting),
+                                 self.rng.choice(CONDITIONS),
+                                 self.expression(self.shape.nesting))
+
+    def expression(self, nesting):
+        """Returns shape.terms terms, one of them parenthesised."""
+        count = self.shape.terms
+        inner = self.rng.randrange(count) if nesting > 0 else -1
+        parts = []
+        for idx in range(count):
+            if idx:
+                parts.append(self.rng.choice('+-'))
+            parts.append(self.term('({})'.format(self.expression(
+                nesting - 1)) if idx == inner else None))
+        if self.rng.random() < 0.1:
+            parts.insert(0, '-')
+        return ' '.join(parts)
+
+    def term(self, factor):
+        factor = factor or self.factor()
+        choice = self.rng.random()
+        if choice < 0.2:
+            return '{} * {}'.format(factor, self.factor())
+        if choice < 0.3:
+            return '{} / {}'.format(factor, self.rng.choice(
+                self.consts + [str(self.rng.randint(1, 9))]))
+        return factor
+
+    def factor(self):
+        choice = self.rng.random()
+        if choice < 0.3:
+            return str(self.rng.randint(0, 1000))
+        if choice < 0.5:
+            return self.rng.choice(self.consts)
+        return self.rng.choice(self.globals + self.scope)
+
+
+def generate(shape=None, seed=0):
+    """Returns the source of a program of the given shape."""
+    return Generator(shape or Shape(), seed).program()
+
+
+def main():
+    args = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    args.add_argument('--seed', type=int, default=0)
+    for name in Shape.__slots__:
+        args.add_argument('--' + name, type=int,
+                          default=getattr(Shape(), name))
+    pargs = args.parse_args()
+    shape = Shape(**{x: getattr(pargs, x) for x in Shape.__slots__})
+    print(generate(shape, pargs.seed), end='')
+
+
+if __name__ == '__main__':
+    main()
@@ -37,15 +37,13 @@ def typename(obj):
 
 class Node:
     def __init__(self):
-        self._children = []
+        # The names of the children in order, as the keys of a dict so
+        # that setting one is constant time.
+        self._children = {}
 
     def __setattr__(self, name, value):
-        if name.startswith('_'):
-            pass
-        elif name in self._children:
-            pass
-        else:
-            self._children.append(name)
+        if not name.startswith('_'):
+            self._children[name] = None
 
         super().__setattr__(name, value)
 
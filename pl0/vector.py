@@ -0,0 +1,488 @@
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Runs an ir.Program over a batch of inputs at once with NumPy.
+
+Every variable is an int32 array with one lane per input, so each IR
+operation is a single NumPy operation over the whole batch.  WHILE and
+IF run under a mask of the lanes that are active: a loop keeps going
+while any lane is still in it, and assignments, reads, writes and calls
+only touch the active lanes.  Intermediates are computed for every lane
+as inactive lanes never store them.
+
+Lanes finish loops at different times, and a loop that only a few lanes
+are still in would otherwise cost as much as one that all of them are.
+When fewer than COMPACT of the lanes are active, the rest of the loop
+runs on a batch of just those lanes whose variables are gathered from
+the full batch and scattered back afterwards.
+
+Arithmetic wraps and divides like the C runtime.  A lane that divides
+by zero or indexes outside an array stops with an error and the others
+carry on.  Each lane reads from its own input and its writes are
+collected separately.
+
+Usage: python3 -m pl0.vector source.pl0 < inputs
+
+runs source once per line of inputs, where each line holds the
+integers that lane reads, and prints each lane's output on one line.
+"""
+
+import argparse
+import copy
+import re
+import sys
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from . import bounds
+from . import ir
+from . import lex
+from . import parser
+from . import structure
+from . import util
+
+COMPARISONS = {
+    '=': 'equal',
+    '!=': 'not_equal',
+    '<': 'less',
+    '<=': 'less_equal',
+    '>': 'greater',
+    '>=': 'greater_equal',
+}
+
+# Loops continue on a smaller batch once fewer than this fraction of
+# at least MINIMUM lanes are active.
+COMPACT = 0.5
+MINIMUM = 256
+
+ARITHMETIC = {
+    '+': 'add',
+    '-': 'subtract',
+    '*': 'multiply',
+    '&': 'bitwise_and',
+}
+
+
+class Result(util.ReprMixin):
+    """The outputs and errors of each lane.
+
+    The writes of lane i are values[offsets[i]:offsets[i + 1]].  errors
+    maps each lane that stopped early to the reason.
+    """
+    __slots__ = 'values', 'offsets', 'errors'
+
+    def __init__(self, values, offsets, errors):
+        self.values = values
+        self.offsets = offsets
+        self.errors = errors
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def output(self, lane):
+        return self.values[self.offsets[lane]:self.offsets[lane + 1]].tolist()
+
+
+def everyone(mask):
+    """Returns None, meaning every lane, if mask is all set."""
+    return None if mask.all() else mask
+
+
+def gather(cells, lanes):
+    """Returns a copy of cells, a list of lane arrays, with just lanes."""
+    return [x[..., lanes] for x in cells]
+
+
+def scatter(cells, part, lanes):
+    """Copies the lanes of part, from gather(), back into cells."""
+    for whole, x in zip(cells, part):
+        whole[..., lanes] = x
+
+
+class Frame:
+    """The variables of one activation of a block.
+
+    display has a list of lane arrays, indexed by symbol slot, for the
+    block and each block it is nested in, by depth from the globals to
+    its own locals.  temps holds the intermediates.
+    """
+
+    def __init__(self, display):
+        self.display = display
+        self.temps = {}
+
+
+# What each pl0_read() in lib/pl0.cc takes after skipping anything else.
+NUMBER = re.compile(rb'-[0-9]*|[0-9]+')
+
+
+def numbers(data):
+    """Returns the integers that the C runtime's pl0_read() would return for
+    input data, bytes or str, wrapped to int32 as it does."""
+    if isinstance(data, str):
+        data = data.encode()
+    values = []
+    for word in NUMBER.findall(data):
+        value = -int(word[1:] or 0) if word[:1] == b'-' else int(word)
+        values.append((value + (1 << 31)) % (1 << 32) - (1 << 31))
+    return values
+
+
+def inputs_array(inputs):
+    """Returns inputs, a sequence of integer sequences, as a padded int32
+    array and the length of each row."""
+    lengths = np.array([len(x) for x in inputs], dtype=np.int64)
+    width = int(lengths.max()) if len(inputs) else 0
+    if width and (lengths == width).all():
+        return np.array(inputs, dtype=np.int32), lengths
+    data = np.zeros((len(inputs), max(width, 1)), dtype=np.int32)
+    for lane, row in enumerate(inputs):
+        data[lane, :len(row)] = row
+    return data, lengths
+
+
+class Machine:
+    def __init__(self, program, lanes, inputs=None):
+        if np is None:
+            raise ImportError('pl0.vector needs NumPy')
+        self.program = program
+        self.lanes = lanes
+        self.blocks = {x.name: x for x in program.blocks}
+        self.trees = {}
+        for block in program.blocks:
+            try:
+                self.trees[block.name] = structure.structure(block.operations)
+            except structure.Unstructured as ex:
+                raise ValueError('{}: {}'.format(block.name or 'main', ex))
+        self.constants = {x.name: np.int32(x.val)
+                          for x in program.blocks[-1].consts}
+        if inputs is None:
+            inputs = np.zeros((lanes, 1), dtype=np.int32), np.zeros(
+                lanes, dtype=np.int64)
+        self.data, self.lengths = inputs
+        self.cursor = np.zeros(lanes, dtype=np.int64)
+        self.indexes = np.arange(lanes)
+        # The lane numbers of this batch in the one that was run.
+        self.ids = self.indexes
+        self.alive = np.ones(lanes, dtype=bool)
+        self.stopped = False
+        self.errors = {}
+        self.written = []
+        self.masked = None
+        self.selected = None
+
+    def run(self):
+        main = self.program.blocks[-1]
+        self.execute(self.trees[None], Frame([self.allocate(main)]), None)
+        return self.result()
+
+    def allocate(self, block):
+        """Returns the lane arrays of the locals of block by slot."""
+        declared = [x for x in block.vars_
+                    if isinstance(x, (ir.Variable, ir.Array))]
+        cells = [None] * len(declared)
+        for var in declared:
+            shape = (var.size, self.lanes) if isinstance(
+                var, ir.Array) else self.lanes
+            cells[var.slot] = np.zeros(shape, dtype=np.int32)
+        return cells
+
+    def result(self):
+        if self.written:
+            lanes = np.concatenate([x[0] for x in self.written])
+            values = np.concatenate([x[1] for x in self.written])
+        else:
+            lanes = np.zeros(0, dtype=np.int64)
+            values = np.zeros(0, dtype=np.int32)
+        order = np.argsort(lanes, kind='stable')
+        counts = np.bincount(lanes, minlength=self.lanes)
+        offsets = np.zeros(self.lanes + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        return Result(values[order], offsets, self.errors)
+
+    def active(self, mask):
+        """Returns mask less the lanes that have stopped.  None means
+        every lane."""
+        if not self.stopped:
+            return mask
+        return self.alive if mask is None else mask & self.alive
+
+    def stop(self, lanes, reason):
+        """Stops the lanes set in the boolean array lanes."""
+        for lane in self.ids[lanes]:
+            self.errors[int(lane)] = reason
+        self.alive &= ~lanes
+        self.stopped = True
+
+    def execute(self, items, frame, mask):
+        for item in items:
+            if isinstance(item, structure.Loop):
+                self.loop(item, frame, mask)
+            elif isinstance(item, structure.Conditional):
+                inside = self.active(self.truth(item.cond, frame, mask))
+                if inside.any():
+                    self.execute(item.body, frame, everyone(inside))
+            else:
+                getattr(self, 'emit_' + util.typename(item))(item, frame,
+                                                            mask)
+
+    def truth(self, branch, frame, mask):
+        """Returns the lanes in mask for which the ir.Branch branch falls
+        through."""
+        if isinstance(branch, ir.If):
+            cond = self.value(branch.left, frame) != 0
+        else:
+            cond = self.compare(branch.left, ir.NEGATED[branch.operation],
+                                branch.right, frame)
+        if np.ndim(cond) == 0:
+            cond = np.full(self.lanes, bool(cond))
+        return cond if mask is None else cond & mask
+
+    def loop(self, loop, frame, mask):
+        while True:
+            self.execute(loop.head, frame, mask)
+            mask = self.active(self.truth(loop.cond, frame, mask))
+            if not mask.any():
+                return
+            mask = everyone(mask)
+            if (mask is not None and self.lanes >= MINIMUM and
+                    np.count_nonzero(mask) < COMPACT * self.lanes):
+                self.compact(loop, frame, np.flatnonzero(mask))
+                return
+            self.execute(loop.body, frame, mask)
+
+    def compact(self, loop, frame, lanes):
+        """Runs the rest of loop, from its body, on just lanes."""
+        sub = copy.copy(self)
+        sub.lanes = len(lanes)
+        sub.indexes = np.arange(sub.lanes)
+        sub.ids = self.ids[lanes]
+        sub.data = self.data[lanes]
+        sub.lengths = self.lengths[lanes]
+        sub.cursor = self.cursor[lanes]
+        sub.alive = self.alive[lanes]
+        sub.stopped = not sub.alive.all()
+        sub.written = []
+        sub.masked = None
+        inner = Frame([gather(x, lanes) for x in frame.display])
+        inner.temps = {k: v[lanes] if np.ndim(v) else v
+                       for k, v in frame.temps.items()}
+
+        sub.execute(loop.body, inner, None)
+        sub.loop(loop, inner, None)
+
+        for cells, part in zip(frame.display, inner.display):
+            scatter(cells, part, lanes)
+        for idx, value in inner.temps.items():
+            if np.ndim(value) == 0:
+                frame.temps[idx] = value
+                continue
+            merged = np.zeros(self.lanes, dtype=np.int32)
+            if np.ndim(frame.temps.get(idx)):
+                merged[...] = frame.temps[idx]
+            merged[lanes] = value
+            frame.temps[idx] = merged
+        self.cursor[lanes] = sub.cursor
+        self.alive[lanes] = sub.alive
+        self.stopped = self.stopped or sub.stopped
+        self.written.extend(sub.written)
+
+    def value(self, operand, frame):
+        if isinstance(operand, ir.Number):
+            return np.int32(operand.val)
+        if isinstance(operand, ir.Intermediate):
+            return frame.temps[operand.idx]
+        return self.cell(operand, frame)
+
+    def cell(self, operand, frame):
+        if operand.slot is None:
+            return self.constants[operand.val]
+        return frame.display[operand.depth][operand.slot]
+
+    def store(self, operand, frame, mask, value):
+        if isinstance(operand, ir.Intermediate):
+            frame.temps[operand.idx] = value
+            return
+        mask = self.active(mask)
+        target = self.cell(operand, frame)
+        if mask is None:
+            target[...] = value
+            return
+        # Blending with bitwise operations is several times faster than
+        # a masked copy.
+        select = self.select(mask)
+        blend = np.bitwise_xor(target, value, dtype=np.int32)
+        np.bitwise_and(blend, select, out=blend)
+        np.bitwise_xor(target, blend, out=target)
+
+    def select(self, mask):
+        """Returns mask as int32 all ones or zeros, caching the last."""
+        if mask is not self.masked:
+            self.masked = mask
+            self.selected = -mask.view(np.int8).astype(np.int32)
+        return self.selected
+
+    def emit_enter(self, enter, frame, mask):
+        pass
+
+    def emit_exit(self, exit_, frame, mask):
+        pass
+
+    def emit_label(self, label, frame, mask):
+        pass
+
+    def emit_assign(self, assign, frame, mask):
+        self.store(assign.result, frame, mask, self.value(assign.left, frame))
+
+    def emit_operation(self, operation, frame, mask):
+        left = self.value(operation.left, frame)
+        right = self.value(operation.right, frame)
+        name = operation.operation
+        if name == '/':
+            result = self.divide(left, right, mask)
+        else:
+            result = getattr(np, ARITHMETIC[name])(left, right,
+                                                   dtype=np.int32)
+        frame.temps[operation.result.idx] = result
+
+    def emit_condition(self, cond, frame, mask):
+        result = self.compare(cond.left, cond.operation, cond.right, frame)
+        frame.temps[cond.result.idx] = result.astype(np.int32)
+
+    def compare(self, left, operation, right, frame):
+        """Returns whether left operation right holds, where operation is
+        as in ir.Jump."""
+        left = self.value(left, frame)
+        if operation in ('odd', 'even'):
+            return (left & 1) == (operation == 'odd')
+        return getattr(np, COMPARISONS[operation])(left,
+                                                   self.value(right, frame))
+
+    def divide(self, left, right, mask):
+        """Divides rounding towards zero like C, stopping the active
+        lanes that divide by zero."""
+        zero = np.broadcast_to(right == 0, (self.lanes, ))
+        if zero.any():
+            mask = self.active(mask)
+            failed = zero if mask is None else zero & mask
+            if failed.any():
+                self.stop(failed, 'division by zero')
+            right = np.where(zero, np.int32(1), right)
+        quotient = np.floor_divide(left, right, dtype=np.int32)
+        inexact = np.subtract(left, quotient * right, dtype=np.int32) != 0
+        return quotient + (inexact & ((left < 0) != (right < 0)))
+
+    def emit_call(self, call, frame, mask):
+        mask = self.active(mask)
+        if mask is not None and not mask.any():
+            return
+        if call.arg is not None:
+            value = np.broadcast_to(self.value(call.arg, frame),
+                                    (self.lanes, ))
+            lanes = self.indexes if mask is None else np.flatnonzero(mask)
+            self.written.append((self.ids[lanes], value[lanes]))
+            return
+        # The callee sees the same enclosing blocks as the caller, which
+        # is either the block it is declared in or nested in that.
+        callee = self.blocks[call.name]
+        display = frame.display[:callee.depth] + [self.allocate(callee)]
+        self.execute(self.trees[call.name], Frame(display), mask)
+
+    def emit_read(self, read, frame, mask):
+        mask = self.active(mask)
+        lanes = self.indexes if mask is None else np.flatnonzero(mask)
+        at = self.cursor[lanes]
+        more = at < self.lengths[lanes]
+        value = np.zeros(self.lanes, dtype=np.int32)
+        value[lanes] = np.where(
+            more, self.data[lanes, np.minimum(at, self.data.shape[1] - 1)],
+            0)
+        self.cursor[lanes] = at + more
+        self.store(read.val, frame, mask, value)
+
+    def emit_check(self, check, frame, mask):
+        index = self.value(check.index, frame)
+        bad = (index < 0) | (index >= check.size)
+        if np.ndim(bad) == 0:
+            bad = np.full(self.lanes, bool(bad))
+        mask = self.active(mask)
+        if mask is not None:
+            bad = bad & mask
+        if bad.any():
+            self.stop(bad, 'index out of bounds at line {}'.format(
+                check.line))
+
+    def element(self, array, index, frame):
+        """Returns the array and clipped lane indexes for array[index]."""
+        cells = self.cell(array, frame)
+        index = np.clip(np.broadcast_to(index, (self.lanes, )), 0,
+                        len(cells) - 1)
+        return cells, index
+
+    def emit_load(self, load, frame, mask):
+        cells, index = self.element(load.array,
+                                    self.value(load.index, frame), frame)
+        frame.temps[load.result.idx] = cells[index, self.indexes]
+
+    def emit_store(self, store, frame, mask):
+        cells, index = self.element(store.array,
+                                    self.value(store.index, frame), frame)
+        value = np.broadcast_to(self.value(store.value, frame),
+                                (self.lanes, ))
+        mask = self.active(mask)
+        lanes = self.indexes if mask is None else np.flatnonzero(mask)
+        cells[index[lanes], lanes] = value[lanes]
+
+
+def compile_program(source):
+    """Returns the ir.Program for PL/0 source."""
+    return bounds.hoist(ir.IRGenerator().dispatch(parser.parse(lex.lex(
+        source))))
+
+
+def run(program, inputs):
+    """Runs program once per row of inputs, a sequence of integer
+    sequences, and returns a Result."""
+    return Machine(program, len(inputs), inputs_array(inputs)).run()
+
+
+def main():
+    args = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    args.add_argument('source')
+    args.add_argument('--stats', action='store_true',
+                      help='print the lanes per second on stderr')
+    pargs = args.parse_args()
+    with open(pargs.source, 'r') as f:
+        program = compile_program(f.read())
+    inputs = [numbers(line) for line in sys.stdin]
+    start = time.perf_counter()
+    result = run(program, inputs)
+    elapsed = time.perf_counter() - start
+    for lane in range(len(result)):
+        words = [str(x) for x in result.output(lane)]
+        if lane in result.errors:
+            words.append('error: ' + result.errors[lane])
+        print(' '.join(words))
+    if pargs.stats:
+        print('{} lanes in {:.3f}s, {:.0f} lanes/s'.format(
+            len(result), elapsed, len(result) / elapsed if elapsed else 0),
+              file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import subprocess
+
+import pytest
+
+import pl0.driver
+import pl0.runner
+
+
+@pytest.fixture
+def run_all(tmpdir, monkeypatch):
+    """Returns a function that compiles source on each of backends, by
+    default all of them, runs it at -O0 on input and returns the words
+    it wrote by backend."""
+    monkeypatch.setenv('PL0_CACHE_DIR', str(tmpdir))
+
+    def run(source, input=b'', backends=sorted(pl0.driver.BACKENDS)):
+        outputs = {}
+        for backend in backends:
+            output = pl0.driver.compile_source(source, backend)
+            executable = pl0.runner.build(
+                output, ('-O0', ), extension=pl0.driver.EXTENSIONS[backend],
+                suffix='.elf')
+            done = subprocess.run([executable], input=input,
+                                  stdout=subprocess.PIPE, check=True)
+            outputs[backend] = done.stdout.split()
+        return outputs
+
+    return run
@@ -0,0 +1,132 @@
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import pytest
+
+import pl0.batch
+import pl0.driver
+import pl0.runner
+
+PROGRAM = """
+VAR x, y;
+BEGIN
+    ? x;
+    ? y;
+    IF x < 0 THEN WHILE 1 = 1 DO y := y + 1;
+    ! y / x
+END.
+"""
+
+
+@pytest.fixture
+def targets(tmpdir, monkeypatch):
+    monkeypatch.setenv('PL0_CACHE_DIR', str(tmpdir))
+    output = pl0.driver.compile_source(PROGRAM, 'c')
+    executable = pl0.runner.build(output, ('-O2', ), suffix='.elf')
+    return {
+        'serve': executable,
+        'exe': executable,
+        'so': pl0.runner.build(output),
+        'vector': PROGRAM,
+    }
+
+
+def jobs(count):
+    return [pl0.batch.Job(x, str(x), '{} {}\n'.format(x % 5 + 1, x).encode())
+            for x in range(count)]
+
+
+@pytest.mark.parametrize('engine', pl0.batch.ENGINES)
+def test_order(targets, engine):
+    if engine == 'vector':
+        pytest.importorskip('numpy')
+    # A small window so that the jobs are sent in several rounds.
+    outcomes = list(pl0.batch.run(jobs(50), engine, targets[engine], 2,
+                                  chunk=3, window=2))
+    assert [x.job.index for x in outcomes] == list(range(50))
+    assert [x.status for x in outcomes] == ['ok'] * 50
+    assert [int(x.output) for x in outcomes] == [
+        x // (x % 5 + 1) for x in range(50)]
+    assert all(x.latency >= x.seconds for x in outcomes)
+
+
+@pytest.mark.parametrize('engine', ['serve', 'exe', 'so'])
+def test_timeout(targets, engine):
+    job = pl0.batch.Job(0, 'forever', b'-1 1')
+    outcome, = pl0.batch.run([job], engine, targets[engine], 1, timeout=0.5)
+    assert outcome.status == 'timeout'
+    assert 'timed out' in outcome.error
+
+
+@pytest.mark.parametrize('engine', pl0.batch.ENGINES)
+def test_fail(targets, engine):
+    if engine == 'vector':
+        pytest.importorskip('numpy')
+    failing = pl0.batch.Job(1, 'zero', b'0 1')
+    outcomes = list(pl0.batch.run(jobs(1) + [failing] + jobs(3)[2:], engine,
+                                  targets[engine], 1, timeout=5, chunk=2))
+    assert [x.status for x in outcomes] == ['ok', 'fail', 'ok']
+    assert outcomes[1].error
+
+
+@pytest.mark.parametrize('engine', pl0.batch.ENGINES)
+def test_malformed(targets, engine):
+    if engine == 'vector':
+        pytest.importorskip('numpy')
+    # Anything but digits and '-' is skipped, as the runtime's pl0_read()
+    # does, and a job with no numbers reads zeros.
+    batch = [pl0.batch.Job(0, 'words', b'x=2, y=9!'),
+             pl0.batch.Job(1, 'junk', b'abc'),
+             pl0.batch.Job(2, 'big', b'-4294967294 8')]
+    outcomes = list(pl0.batch.run(batch, engine, targets[engine], 1,
+                                  timeout=5, chunk=3))
+    assert [x.status for x in outcomes] == ['ok', 'fail', 'ok']
+    assert outcomes[0].output.split() == [b'4']
+    assert outcomes[2].output.split() == [b'4']
+
+
+def test_vector_timeout(targets):
+    pytest.importorskip('numpy')
+    batch = [pl0.batch.Job(0, 'forever', b'-1 1')] + jobs(3)[1:]
+    outcomes = list(pl0.batch.run(batch, 'vector', PROGRAM, 1, timeout=0.5,
+                                  chunk=3))
+    # The whole task times out.
+    assert [x.status for x in outcomes] == ['timeout'] * 3
+
+
+def test_stats():
+    stats = pl0.batch.Stats(2)
+    for idx, status in enumerate(['ok', 'ok', 'fail', 'timeout']):
+        outcome = pl0.batch.Outcome(pl0.batch.Job(idx, '', b'1 2'), status,
+                                    b'3\n')
+        outcome.latency = idx / 10
+        stats.add(outcome)
+    assert stats.percentile(0.5) == 0.2
+    assert stats.percentile(1.0) == 0.3
+    lines = stats.report().splitlines()
+    assert lines[0].startswith('4 jobs (2 ok, 1 failed, 1 timed out)')
+    assert len(lines) == 3
+
+
+def test_sources(tmpdir):
+    paths = []
+    for idx in range(3):
+        path = tmpdir.join('{}.in'.format(idx))
+        path.write('{}\n'.format(idx))
+        paths.append(str(path))
+    assert [x.data for x in pl0.batch.files(paths)] == [b'0\n', b'1\n', b'2\n']
+    assert [x.name for x in pl0.batch.lines([b'a\n', b'b\n'])] == ['1', '2']
+    assert [len(x) for x in pl0.batch.chunks(range(7), 3)] == [3, 3, 1]
+    with pytest.raises(ValueError):
+        list(pl0.batch.run([], 'jit', ''))
@@ -0,0 +1,166 @@
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import subprocess
+
+import pytest
+
+import pl0.bounds
+import pl0.driver
+import pl0.ir
+import pl0.lex
+import pl0.parser
+import pl0.runner
+
+PROGRAM = """
+CONST size = 10;
+VAR a[size], b[7], i, n, s;
+
+PROCEDURE squares;
+    VAR c[4], j;
+
+    PROCEDURE square;
+    BEGIN
+        c[j] := j * j
+    END;
+BEGIN
+    j := 0;
+    WHILE j < 4 DO
+    BEGIN
+        CALL square;
+        j := j + 1
+    END;
+    ! c[0] + c[1] + c[2] + c[3]
+END;
+
+BEGIN
+    i := 0;
+    WHILE i < size DO
+    BEGIN
+        a[i] := i * 2;
+        i := i + 1
+    END;
+    ? n;
+    s := 0;
+    i := 0;
+    WHILE i < n DO
+    BEGIN
+        s := s + a[i + 1];
+        i := i + 1
+    END;
+    ! s;
+    i := 7;
+    WHILE i > 0 DO
+    BEGIN
+        i := i - 1;
+        b[i] := a[i]
+    END;
+    ! b[0] + b[1] + b[2];
+    CALL squares;
+    ? b[1];
+    ! b[1];
+    ! a[n + 2]
+END.
+"""
+
+
+def lower(source):
+    return pl0.ir.IRGenerator().dispatch(pl0.parser.parse(pl0.lex.lex(
+        source)))
+
+
+def checks(block):
+    return [x for x in block.operations if isinstance(x, pl0.ir.Check)]
+
+
+def run(source, stdin):
+    binary = pl0.runner.build(source, ('-O1', ), suffix='.elf')
+    return subprocess.run([binary], input=stdin, stdout=subprocess.PIPE,
+                          stderr=subprocess.PIPE)
+
+
+def test_lower():
+    program = lower(PROGRAM)
+    square, squares, main = program.blocks
+    assert [(x.val, x.size) for x in main.vars_
+            if isinstance(x, pl0.ir.Array)] == [('a', 10), ('b', 7)]
+    assert [len(checks(x)) for x in program.blocks] == [1, 4, 10]
+    store = [x for x in square.operations if isinstance(x, pl0.ir.Store)][0]
+    assert store.array.key() == ('squares', 'c')
+
+
+def test_hoist():
+    program = pl0.bounds.hoist(lower(PROGRAM))
+    square, squares, main = program.blocks
+    # Constant indexes and those in the loops from 0 to size and from 7
+    # down are checked at compile time.  The loop to n is versioned, so
+    # only its original and a[n + 2] keep their checks.
+    assert [len(checks(x)) for x in program.blocks] == [1, 0, 2]
+    labels = [x.val for x in main.operations if isinstance(x, pl0.ir.Label)]
+    assert labels.count('while14_checked') == 1
+    assert labels.count('while14_v') == 1
+    assert 'while19_v' not in labels
+    assert [x.line for x in checks(main)] == [34, 48]
+
+
+def test_unsafe():
+    program = pl0.bounds.hoist(lower("""
+VAR a[10], i;
+BEGIN
+    i := 0;
+    WHILE i <= 10 DO
+    BEGIN
+        IF i < 10 THEN a[i] := 1;
+        i := i + 1
+    END
+END.
+"""))
+    # a[10] would be out of bounds, so the check stays and the loop isn't
+    # copied.
+    main = program.blocks[-1]
+    assert len(checks(main)) == 1
+    assert [x.val for x in main.operations if isinstance(x, pl0.ir.Label)
+            ] == ['while1', 'if2', 'while1end']
+
+
+@pytest.mark.parametrize('backend', ['c', 'structured'])
+def test_run(tmpdir, monkeypatch, backend):
+    monkeypatch.setenv('PL0_CACHE_DIR', str(tmpdir))
+    output = pl0.driver.compile_source(PROGRAM, backend)
+    done = run(output, b'7 42')
+    assert done.stdout.split() == [b'56', b'6', b'14', b'42', b'18']
+    assert done.returncode == 0
+
+    done = run(output, b'8 42')
+    assert done.stdout.split() == [b'72', b'6', b'14', b'42']
+    assert done.returncode == 2
+    assert b'line 48: index 10 is outside an array of 10' in done.stderr
+
+    # Too long for the copy without checks.
+    done = run(output, b'10')
+    assert done.returncode == 2
+    assert b'line 34' in done.stderr
+
+
+def test_errors():
+    with pytest.raises(ValueError):
+        lower('VAR a[10], i; i := a.')
+    with pytest.raises(ValueError):
+        lower('VAR i; i := i[0].')
+    with pytest.raises(ValueError):
+        lower('VAR a[0]; a[0] := 1.')
+    with pytest.raises(ValueError):
+        lower('VAR n, a[n]; a[0] := 1.')
+    with pytest.raises(ValueError):
+        pl0.driver.compile_source('VAR a[2]; a[0] := 1.', 'x86')
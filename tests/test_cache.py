@@ -0,0 +1,77 @@
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import os
+
+import pl0.cache
+import pl0.driver
+import pl0.lex
+
+SOURCE = """
+VAR x;
+BEGIN
+x := 3;
+! x
+END.
+"""
+
+
+def test_key(tmpdir):
+    cache = pl0.cache.Cache(str(tmpdir))
+    key = cache.key(SOURCE, 'c')
+    assert key == cache.key(SOURCE, 'c')
+    assert key != cache.key(SOURCE, 'x86')
+    assert key != cache.key(SOURCE, 'c', ('-O2', ))
+    assert key != cache.key(SOURCE + ' ', 'c')
+
+
+def test_hit_skips_compiler(tmpdir, monkeypatch):
+    cache = pl0.cache.Cache(str(tmpdir))
+    first = pl0.driver.compile_cached(SOURCE, 'c', cache)
+
+    def fail(src):
+        raise AssertionError('lexed on a cache hit')
+
+    monkeypatch.setattr(pl0.lex, 'lex', fail)
+    assert pl0.driver.compile_cached(SOURCE, 'c', cache) == first
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert cache.stats().entries == 1
+
+
+def test_compile_files(tmpdir):
+    cache = pl0.cache.Cache(str(tmpdir.join('cache')))
+    paths = []
+    for idx in range(3):
+        path = tmpdir.join('p{}.pl0'.format(idx))
+        path.write(SOURCE.replace('3', str(idx)) if idx else 'VAR')
+        paths.append(str(path))
+
+    first = list(pl0.driver.compile_files(paths, cache=cache))
+    second = list(pl0.driver.compile_files(paths, jobs=2, cache=cache))
+    assert first == second
+    assert first[0][1] is None
+    assert 'x = 2;' in first[2][1]
+    # The failing file is never cached.
+    assert (cache.hits, cache.misses) == (2, 4)
+
+
+def test_evict(tmpdir):
+    cache = pl0.cache.Cache(str(tmpdir), limit=250)
+    for idx in range(4):
+        cache.put(str(idx), 'x' * 100)
+        stamp = 1000000000 + idx
+        os.utime(cache.path(str(idx)), (stamp, stamp))
+    assert cache.get('0') is not None
+    cache.evict()
+    assert sorted(os.listdir(str(tmpdir))) == ['0', '3']
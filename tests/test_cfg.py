@@ -0,0 +1,100 @@
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import pl0.cfg
+import pl0.driver
+import pl0.ir
+import pl0.lex
+import pl0.parser
+
+NESTED = """
+VAR i, j, s, a[3];
+BEGIN
+    ? i;
+    s := 0;
+    WHILE i > 0 DO
+    BEGIN
+        j := 0;
+        WHILE a[j] + j < 2 DO j := j + 1;
+        IF ODD i THEN IF i # 3 THEN s := s + j;
+        i := i - 1
+    END;
+    ! s
+END.
+"""
+
+
+def lower(src):
+    return pl0.ir.IRGenerator().dispatch(pl0.parser.parse(pl0.lex.lex(src)))
+
+
+def kinds(operations):
+    return [type(x).__name__ for x in operations]
+
+
+def test_rotate():
+    main = pl0.cfg.simplify(lower(NESTED)).blocks[-1]
+    operations = main.operations
+    assert not any(isinstance(x, pl0.ir.Goto) for x in operations)
+    # Each loop ends with one branch back to its top.
+    backs = [(at, x) for at, x in enumerate(operations)
+             if isinstance(x, pl0.ir.Jump) and
+             operations.index(x.target) < at]
+    assert [x.target.val for _, x in backs] == ['while2', 'while1']
+    assert [(x.operation, x.right.val) for _, x in backs] == [('<', 2),
+                                                              ('>', 0)]
+    # The inner head, a check and a load, is copied with fresh
+    # intermediates.
+    at = backs[0][0]
+    assert kinds(operations[at - 3:at]) == ['Check', 'Load', 'Operation']
+    loads = [x for x in operations if isinstance(x, pl0.ir.Load)]
+    assert loads[0].result is not loads[1].result
+    # The nested IFs end at the same place, so share one label.
+    assert [x.val for x in operations if isinstance(x, pl0.ir.Label)] == [
+        'while1', 'while2', 'while2end', 'if7', 'while1end']
+
+
+def test_thread():
+    block = pl0.ir.Block(None)
+    one, two, three, dead = (pl0.ir.Label(x) for x in ('one', 'two', 'three',
+                                                        'dead'))
+    x = pl0.ir.Variable('x')
+    skip = pl0.ir.Jump(x, '=', pl0.ir.Number(0), one)
+    block.operations = [
+        pl0.ir.Enter(),
+        skip,
+        pl0.ir.Goto(three),
+        one,
+        two,
+        pl0.ir.Goto(three),
+        dead,
+        pl0.ir.Call('write', x),
+        three,
+        pl0.ir.Call('write', pl0.ir.Number(1)),
+        pl0.ir.Exit(),
+    ]
+    pl0.cfg.tidy(block)
+    # The Jump over the Goto is negated, and then jumps to the next
+    # operation, so everything but the write of 1 goes.
+    assert kinds(block.operations) == ['Enter', 'Call', 'Exit']
+    assert block.operations[1].arg.val == 1
+
+
+def test_run(run_all):
+    assert 'goto while2;' in pl0.driver.compile_source(NESTED, 'c')
+    for value, expect in ((0, b'0'), (5, b'4'), (6, b'4')):
+        # The x86 backend doesn't support arrays.
+        outputs = run_all(NESTED, str(value).encode(), ('c', 'structured'))
+        for backend, output in outputs.items():
+            assert output == [expect], backend
@@ -0,0 +1,68 @@
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import json
+import xml.etree.ElementTree as ElementTree
+
+import pl0.check
+
+ECHO = """
+# Expect: 3
+VAR x;
+BEGIN
+? x;
+! x;
+! x + 1
+# Expect: 4
+END.
+"""
+
+LOOP = """
+VAR x;
+WHILE 0 < 1 DO x := x + 1
+.
+"""
+
+
+def test_expectations():
+    assert pl0.check.expectations(ECHO) == ['3', '4']
+    assert pl0.check.expectations(LOOP) == []
+
+
+def test_check(tmpdir, monkeypatch):
+    monkeypatch.setenv('PL0_CACHE_DIR', str(tmpdir.join('cache')))
+    tmpdir.join('echo.pl0').write(ECHO)
+    tmpdir.join('echo.in').write('4')
+    tmpdir.join('wrong.pl0').write(ECHO)
+    tmpdir.join('loop.pl0').write(LOOP)
+    tmpdir.join('bad.pl0').write('VAR')
+
+    tests = pl0.check.discover(str(tmpdir))
+    assert [x.name for x in tests] == ['bad', 'echo', 'loop', 'wrong']
+    assert tests[1].stdin == b'4'
+    results = list(pl0.check.check(tests, jobs=2, timeout=0.5))
+    assert [x.status for x in results] == ['error', 'fail', 'timeout',
+                                           'fail']
+    assert results[0].message.startswith('compile failed')
+
+    tmpdir.join('echo.in').write('3')
+    echo = pl0.check.run(pl0.check.load(str(tmpdir.join('echo.pl0'))))
+    assert echo.status == 'pass'
+    assert echo.output.split() == ['3', '4']
+    assert list(echo.times) == list(pl0.check.STAGES)
+
+    report = ElementTree.fromstring(pl0.check.to_junit(results + [echo]))
+    assert (report.get('tests'), report.get('failures'),
+            report.get('errors')) == ('5', '2', '2')
+    assert json.loads(pl0.check.to_json([echo]))[0]['status'] == 'pass'
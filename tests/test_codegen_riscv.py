@@ -0,0 +1,60 @@
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import pl0.codegen_riscv
+import pl0.driver
+import pl0.ir
+
+PROGRAM = """
+VAR a, b, c, d, x;
+BEGIN
+    ? a; ? b; ? c; ? d;
+    x := (a + b) * (c - d);
+    ! x;
+    ! -x;
+    ! -3 + a;
+    ! -(a * b) / 2
+END.
+"""
+
+
+def test_trees():
+    output = pl0.driver.compile_source(PROGRAM, 'c')
+    assert 'x = (a + b) * (c - d);' in output
+    assert 'int_t t' not in output
+
+
+def test_barriers():
+    a, b, x = (pl0.ir.Variable(x) for x in 'abx')
+    t0, t1, t2 = (pl0.ir.Intermediate(x) for x in range(3))
+    divide = pl0.ir.Operation(t1, a, '/', b)
+    operations = [
+        pl0.ir.Operation(t0, a, '+', b),
+        divide,
+        pl0.ir.Assign(a, x, '='),
+        pl0.ir.Operation(t2, t0, '*', t1),
+    ]
+    # Neither can move past the assignment to a they read.
+    assert pl0.codegen_riscv.trees(operations) == {}
+    operations[2] = pl0.ir.Check(x, 10, 1)
+    # Only the division could trap, so only it stays ahead of the check.
+    trees = pl0.codegen_riscv.trees(operations)
+    assert list(trees) == [0]
+    divide.right = pl0.ir.Number(3)
+    assert sorted(pl0.codegen_riscv.trees(operations)) == [0, 1]
+
+
+def test_run(run_all):
+    for backend, output in run_all(PROGRAM, b'1 2 3 4').items():
+        assert output == [b'-3', b'3', b'-2', b'-1'], backend
@@ -0,0 +1,97 @@
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import io
+
+import pl0.codegen_x86
+import pl0.ir
+import pl0.lex
+import pl0.parser
+import pl0.regalloc
+
+SQUARES = """
+VAR x, squ;
+
+PROCEDURE square;
+VAR y;
+BEGIN
+   y := x;
+   squ:= y * y
+END;
+
+BEGIN
+   x := 1;
+   WHILE x <= 10 DO
+   BEGIN
+      CALL square;
+      ! squ;
+      x := x + 1
+   END
+END.
+"""
+
+DEEP = """
+VAR y;
+BEGIN
+y := ((1+2)*(3+4))*((5+6)*(7+8));
+END.
+"""
+
+
+def lower(src):
+    return pl0.ir.IRGenerator().dispatch(pl0.parser.parse(pl0.lex.lex(src)))
+
+
+def run(src):
+    sink = io.StringIO()
+    pl0.codegen_x86.X86Generator(sink).dispatch(lower(src))
+    return sink.getvalue()
+
+
+def test_squares():
+    out = run(SQUARES)
+    assert '_Z3runv:' in out
+    assert 'call _Z5writei' in out
+    assert 'call square' in out
+    assert 'x:' in out
+    assert 'y:' not in out
+
+
+def test_spill():
+    block = lower(DEEP).blocks[-1]
+    intervals = pl0.regalloc.allocate(block.operations, ('rsi', ), ('rbx', ))
+    locations = [x.location for x in intervals.values()]
+    assert None in locations
+    assert 'rsi' in locations
+
+
+def test_captured():
+    out = run("""
+    PROCEDURE outer;
+        VAR a, b;
+        PROCEDURE inner;
+        BEGIN
+            a := b
+        END;
+    BEGIN
+        b := 5;
+        CALL inner;
+        ! a
+    END;
+    CALL outer.
+    """)
+    inner = out[out.index('inner:'):]
+    inner = inner[:inner.index('ret')]
+    # One capture pointer to read b and one to write a.
+    assert inner.count(', %rcx') == 2
@@ -0,0 +1,75 @@
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import asyncio
+import os
+
+import pl0.client
+import pl0.daemon
+import pl0.driver
+
+GOOD = """
+VAR x;
+BEGIN
+x := 7;
+! x
+END.
+"""
+
+BAD = """
+VAR x;
+BEGIN
+x :=
+END.
+"""
+
+
+def test_roundtrip(tmpdir, monkeypatch):
+    monkeypatch.setenv('PL0_CACHE_DIR', str(tmpdir))
+    path = str(tmpdir.join('pl0d.sock'))
+    server = pl0.daemon.Server(path, 1)
+    server.warm()
+
+    async def go():
+        async with await server.listen():
+            loop = asyncio.get_running_loop()
+            plain = await loop.run_in_executor(
+                None, pl0.client.request, [GOOD, BAD], 'c', path)
+            flagged = await loop.run_in_executor(
+                None, pl0.client.request, [GOOD], 'c', path,
+                ('instrument=counts', ))
+            return plain + flagged
+
+    try:
+        good, bad, instrumented = asyncio.run(go())
+    finally:
+        server.pool.shutdown()
+    assert 'x = 7;' in good['output']
+    assert 'Parse error' in bad['error']
+    assert instrumented['output'] == pl0.driver.compile_source(
+        GOOD, 'c', ('instrument=counts', ))
+    assert instrumented['output'] != good['output']
+
+
+def test_parse_args():
+    assert pl0.client.parse_args(['-o', 'a.cc', '--backend', 'x86',
+                                  'a.pl0']) == ('a.cc', 'x86', None,
+                                                ['a.pl0'], ())
+    assert pl0.client.parse_args(['-j', '4', '--optimize',
+                                  '--instrument=counts', 'a.pl0']) == (
+                                      None, 'c', None, ['a.pl0'],
+                                      ('instrument=counts', 'optimize'))
+    _, _, _, _, flags = pl0.client.parse_args(['--optimize', '--profile-use',
+                                               'p.profile'])
+    assert flags == ('profile=' + os.path.abspath('p.profile'), )
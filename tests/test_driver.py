@@ -0,0 +1,57 @@
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import pl0.driver
+
+GOOD = """
+VAR x;
+BEGIN
+x := {};
+! x
+END.
+"""
+
+BAD = """
+VAR x;
+BEGIN
+x :=
+END.
+"""
+
+
+def write(tmpdir, sources):
+    paths = []
+    for idx, src in enumerate(sources):
+        path = tmpdir.join('p{}.pl0'.format(idx))
+        path.write(src)
+        paths.append(str(path))
+    return paths
+
+
+def test_parallel(tmpdir):
+    paths = write(tmpdir, [GOOD.format(x) for x in range(6)])
+    serial = list(pl0.driver.compile_files(paths))
+    parallel = list(pl0.driver.compile_files(paths, jobs=3))
+    assert serial == parallel
+    assert [x[0] for x in parallel] == paths
+    assert 'x = 5;' in parallel[5][1]
+
+
+def test_failure(tmpdir):
+    paths = write(tmpdir, [GOOD.format(1), BAD, GOOD.format(2)])
+    results = list(pl0.driver.compile_files(paths, jobs=2))
+    assert results[0][2] is None
+    assert 'Parse error' in results[1][2]
+    assert results[1][1] is None
+    assert 'x = 2;' in results[2][1]
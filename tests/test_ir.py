@@ -34,3 +34,81 @@ def run(src):
 
 def test_compound():
     assert run(COMPOUND) != None
+
+
+NESTED = """
+VAR x;
+PROCEDURE a;
+    CONST c = 3;
+    VAR x, y;
+    PROCEDURE b;
+        PROCEDURE d;
+        BEGIN
+            y := x + c
+        END;
+    BEGIN
+        CALL d
+    END;
+BEGIN
+    CALL b
+END;
+PROCEDURE d;
+BEGIN
+    x := 1
+END;
+BEGIN
+    CALL a;
+    CALL d
+END.
+"""
+
+
+def lower(src):
+    return pl0.ir.IRGenerator().dispatch(pl0.parser.parse(pl0.lex.lex(src)))
+
+
+def test_lift():
+    program = lower(NESTED)
+    blocks = {x.name: x for x in program.blocks}
+    # The second d is renamed as it would clash with the first.
+    assert [x.name for x in program.blocks] == ['d', 'b', 'a', 'main_d',
+                                                None]
+
+    assign = blocks['d'].operations[2]
+    operation = blocks['d'].operations[1]
+    assert isinstance(assign.result, pl0.ir.Captured)
+    assert isinstance(operation.left, pl0.ir.Captured)
+    assert operation.right.val == 3
+    assert [x.key() for x in blocks['d'].captures] == [('a', 'x'), ('a', 'y')]
+    # b only passes the pointers on.
+    assert [x.key() for x in blocks['b'].captures] == [('a', 'x'), ('a', 'y')]
+    call = [x for x in blocks['a'].operations
+            if isinstance(x, pl0.ir.Call)][0]
+    assert [type(x) for x in call.captures] == [pl0.ir.Variable] * 2
+    assert blocks['a'].captures == []
+
+    main = [x for x in blocks[None].operations if isinstance(x, pl0.ir.Call)]
+    assert [x.name for x in main] == ['a', 'main_d']
+    assign = blocks['main_d'].operations[1]
+    assert isinstance(assign.result, pl0.ir.Variable)
+
+
+BRANCHES = """
+VAR x;
+BEGIN
+    ? x;
+    WHILE x < 10 DO x := x + 1;
+    IF ODD x THEN ! x;
+    IF x # 3 THEN ! 3
+END.
+"""
+
+
+def test_branches():
+    operations = lower(BRANCHES).blocks[-1].operations
+    jumps = [x for x in operations if isinstance(x, pl0.ir.Jump)]
+    # Each jumps when its condition fails, and no truth value is computed.
+    assert [(x.left.val, x.operation, x.right and x.right.val)
+            for x in jumps if x.expect is None] == [
+                ('x', '>=', 10), ('x', 'even', None), ('x', '=', 3)]
+    assert not any(isinstance(x, pl0.ir.Condition) for x in operations)
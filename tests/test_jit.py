@@ -0,0 +1,117 @@
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import platform
+
+import pytest
+
+import pl0.ir
+import pl0.jit
+import pl0.lex
+import pl0.parser
+
+pytestmark = pytest.mark.skipif(
+    platform.machine() not in ('x86_64', 'AMD64'), reason='x86-64 only')
+
+SQUARES = """
+VAR x, squ;
+
+PROCEDURE square;
+BEGIN
+   squ:= x * x
+END;
+
+BEGIN
+   x := 1;
+   WHILE x <= 10 DO
+   BEGIN
+      CALL square;
+      ! squ;
+      x := x + 1
+   END
+END.
+"""
+
+MANY = """
+VAR i;
+BEGIN
+  i := 0;
+  WHILE i < 10000 DO BEGIN ! i; i := i + 1 END
+END.
+"""
+
+SUM = """
+VAR n, x, sum;
+BEGIN
+  ? n;
+  sum := 0;
+  WHILE n > 0 DO BEGIN ? x; sum := sum + x; n := n - 1 END;
+  ! sum;
+  ? x;
+  ! x
+END.
+"""
+
+DIVIDE = """
+VAR a, b;
+BEGIN
+  a := 7;
+  b := 0;
+  a := a / b
+END.
+"""
+
+
+def run(src):
+    return pl0.jit.jit(pl0.ir.IRGenerator().dispatch(
+        pl0.parser.parse(pl0.lex.lex(src))))
+
+
+def test_squares():
+    compiled = run(SQUARES)
+    assert compiled.run() == [x * x for x in range(1, 11)]
+    assert compiled.globals == {'x': 11, 'squ': 100}
+    assert compiled.stats.code_size > 0
+
+
+def test_flush():
+    assert run(MANY).run() == list(range(10000))
+
+
+def test_read():
+    values = list(range(10000))
+    assert run(SUM).run(inputs=[len(values)] + values) == [sum(values), 0]
+
+
+def test_divide_by_zero():
+    compiled = run(DIVIDE)
+    with pytest.raises(ZeroDivisionError):
+        compiled.run()
+    assert compiled.globals == {'a': 7, 'b': 0}
+
+
+def test_branches():
+    compiled = run("""
+VAR x;
+BEGIN
+    ? x;
+    WHILE x < 0 DO x := x + 1;
+    IF ODD x THEN ! 1;
+    IF x # 3 THEN ! 2;
+    IF x = 3 THEN ! 3
+END.
+""")
+    assert compiled.run(inputs=[-2]) == [2]
+    assert compiled.run(inputs=[3]) == [1, 3]
+    assert compiled.run(inputs=[11]) == [1, 2]
@@ -25,6 +25,7 @@ def test():
     assert run('<=') == ['<=']
     assert run('> 5') == ['>', 5]
     assert run('  baz bar  foo\n') == ['baz', 'bar', 'foo']
+    assert run('? x') == ['?', 'x']
 
 
 def test_comments():
@@ -110,6 +110,14 @@ BEGIN
 END.
 """
 
+READ = """
+VAR x;
+BEGIN
+? x;
+! x
+END.
+"""
+
 COMPOUND = """
 VAR y;
 BEGIN
@@ -137,5 +145,24 @@ def test_muldiv():
     assert run(MULDIV) != None
 
 
+def test_read():
+    statement = run(READ).block.statement
+    assert isinstance(statement._0, pl0.parser.Read)
+    assert statement._0.ident.val == 'x'
+
+
 def test_compound():
     assert run(COMPOUND) != None
+
+
+def test_arrays():
+    program = run('VAR a[10], i; BEGIN a[i + 1] := a[i]; ? a[2] END.')
+    variables = program.block.vars
+    assert [(x.val, getattr(y, 'val', y))
+            for x, y in variables.children.values()] == [('a', 10),
+                                                         ('i', True)]
+    assign = program.block.statement._0
+    assert isinstance(assign, pl0.parser.Assign)
+    assert assign.index is not None
+    assert isinstance(assign.expr.terms._0.factors._0, pl0.parser.Index)
+    assert program.block.statement._1.index is not None
@@ -0,0 +1,113 @@
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import subprocess
+
+import pl0.driver
+import pl0.ir
+import pl0.lex
+import pl0.parser
+import pl0.pgo
+import pl0.runner
+
+PROGRAM = """
+VAR x, rare, odds;
+
+PROCEDURE count;
+BEGIN
+    IF x = 50 THEN
+        rare := rare + 1;
+    IF ODD x THEN
+        odds := odds + 1
+END;
+
+BEGIN
+    x := 0;
+    WHILE x < 100 DO
+    BEGIN
+        CALL count;
+        x := x + 1
+    END;
+    ! rare;
+    ! odds
+END.
+"""
+
+
+def lower(source):
+    return pl0.ir.IRGenerator().dispatch(pl0.parser.parse(pl0.lex.lex(
+        source)))
+
+
+def run(source):
+    binary = pl0.runner.build(source, ('-O1', ), suffix='.elf')
+    done = subprocess.run([binary], stdout=subprocess.PIPE, check=True)
+    return done.stdout.split()
+
+
+def test_estimate():
+    program = lower(PROGRAM)
+    counts = pl0.pgo.measure(program)
+    assert not counts.measured
+    count, main = program.blocks
+    # The loop runs an estimated 10 times.
+    assert counts.runs[count.operations[0]] == 10
+    branch = [x for x in count.operations if isinstance(x, pl0.ir.Branch)][0]
+    assert counts.taken[branch] == 0.5
+
+
+def test_profile(tmpdir, monkeypatch):
+    monkeypatch.setenv('PL0_CACHE_DIR', str(tmpdir.join('cache')))
+    path = str(tmpdir.join('pl0.profile'))
+    monkeypatch.setenv('PL0_PROFILE', path)
+    expect = run(pl0.driver.compile_source(PROGRAM, 'c',
+                                           ('instrument=counts', )))
+    assert expect == [b'1', b'50']
+
+    program = lower(PROGRAM)
+    loaded = pl0.pgo.load(path, PROGRAM, program)
+    counts = pl0.pgo.measure(program, loaded)
+    assert counts.measured
+    assert counts.runs[program.blocks[0].operations[0]] == 100
+
+    output = pl0.driver.compile_source(PROGRAM, 'c', ('profile=' + path, ))
+    # count is inlined, the loop unrolled and the rare IF moved out of
+    # line.
+    assert '\ncount();' not in output
+    assert output.count('goto while') == pl0.pgo.UNROLL + 1
+    assert 'cold' in output
+    assert '__builtin_expect' in output
+    assert run(output) == expect
+
+    for backend in ('structured', 'x86'):
+        output = pl0.driver.compile_source(PROGRAM, backend,
+                                           ('profile=' + path, ))
+        binary = pl0.runner.build(output, ('-O1', ),
+                                  extension=pl0.driver.EXTENSIONS[backend],
+                                  suffix='.elf')
+        done = subprocess.run([binary], stdout=subprocess.PIPE, check=True)
+        assert done.stdout.split() == expect
+
+
+def test_stale(tmpdir, monkeypatch, capsys):
+    monkeypatch.setenv('PL0_CACHE_DIR', str(tmpdir.join('cache')))
+    path = str(tmpdir.join('pl0.profile'))
+    monkeypatch.setenv('PL0_PROFILE', path)
+    run(pl0.driver.compile_source(PROGRAM, 'c', ('instrument=counts', )))
+
+    changed = PROGRAM.replace('50', '51')
+    assert pl0.pgo.load(path, changed, lower(changed)) is None
+    assert 'different source' in capsys.readouterr().err
+    output = pl0.driver.compile_source(changed, 'c', ('profile=' + path, ))
+    assert run(output) == [b'1', b'50']
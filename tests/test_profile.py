@@ -0,0 +1,89 @@
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import io
+import subprocess
+
+import pytest
+
+import pl0.driver
+import pl0.ir
+import pl0.lex
+import pl0.parser
+import pl0.profile
+import pl0.runner
+
+PROGRAM = """
+VAR x, odds;
+
+PROCEDURE count;
+BEGIN
+    IF ODD x THEN
+        odds := odds + 1
+END;
+
+BEGIN
+    x := 0;
+    odds := 0;
+    WHILE x < 10 DO
+    BEGIN
+        CALL count;
+        x := x + 1
+    END;
+    ! odds
+END.
+"""
+
+
+def plan(source):
+    ast = pl0.parser.parse(pl0.lex.lex(source))
+    return pl0.profile.plan(pl0.ir.IRGenerator().dispatch(ast))
+
+
+def test_plan():
+    sites = [(x.kind, x.name, x.line) for x in plan(PROGRAM)]
+    assert sites == [('procedure', 'count', 4),
+                     ('branch', 'if1', 6),
+                     ('procedure', 'main', 0),
+                     ('loop', 'while3', 13)]
+
+
+def test_instrument_needs_c():
+    with pytest.raises(ValueError):
+        pl0.driver.compile_source(PROGRAM, 'x86', ('instrument=counts', ))
+
+
+@pytest.mark.parametrize('mode', ['counts', 'cycles'])
+def test_profile(tmpdir, monkeypatch, mode):
+    monkeypatch.setenv('PL0_CACHE_DIR', str(tmpdir.join('cache')))
+    monkeypatch.setenv('PL0_PROFILE', str(tmpdir.join('pl0.profile')))
+    source = pl0.driver.compile_source(PROGRAM, 'c',
+                                       ('instrument=' + mode, ))
+    binary = pl0.runner.build(source, ('-O2', ), suffix='.elf')
+    done = subprocess.run([binary], stdout=subprocess.PIPE, check=True)
+    assert done.stdout.split() == [b'5']
+
+    profile = pl0.profile.load(str(tmpdir.join('pl0.profile')))
+    assert profile.source == pl0.profile.fingerprint(PROGRAM)
+    assert profile.cycles == (mode == 'cycles')
+    assert profile.find('procedure', 'count').counts == [10, 0]
+    assert profile.find('loop', 'while3').counts == [1, 10]
+    assert profile.find('branch', 'if1').counts == [10, 5]
+    if mode == 'cycles':
+        main = profile.find('procedure', 'main')
+        assert main.inclusive >= main.self_ > 0
+
+    sink = io.StringIO()
+    pl0.profile.report(profile, sink)
+    assert 'count (line 4)' in sink.getvalue()
@@ -0,0 +1,91 @@
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import pl0.ir
+import pl0.lex
+import pl0.parser
+import pl0.promote
+
+PROGRAM = """
+VAR i, s, t, u;
+
+PROCEDURE bump;
+BEGIN
+    t := t + 1
+END;
+
+PROCEDURE local;
+    VAR i;
+BEGIN
+    i := 3;
+    WHILE i > 0 DO BEGIN s := s + i; i := i - 1 END
+END;
+
+BEGIN
+    ? i;
+    WHILE i > 0 DO
+    BEGIN
+        s := s + u;
+        CALL bump;
+        CALL local;
+        i := i - 1
+    END;
+    ! s;
+    ! t;
+    ! i
+END.
+"""
+
+
+def lower(src):
+    return pl0.ir.IRGenerator().dispatch(pl0.parser.parse(pl0.lex.lex(src)))
+
+
+def variables(operations):
+    found = set()
+    for operation in operations:
+        for operand in pl0.ir.uses(operation) + pl0.ir.defs(operation):
+            if isinstance(operand, pl0.ir.Variable):
+                found.add(operand.val)
+    return found
+
+
+def test_promote():
+    program = pl0.promote.promote(lower(PROGRAM))
+    blocks = {x.name: x for x in program.blocks}
+    main = blocks[None].operations
+    top = [x.val for x in main if isinstance(x, pl0.ir.Label)][0]
+    start = [idx for idx, x in enumerate(main)
+             if isinstance(x, pl0.ir.Label) and x.val == top][0]
+    end = [idx for idx, x in enumerate(main)
+           if isinstance(x, pl0.ir.Label) and x.val == top + 'end'][0]
+    # local uses s, so only i and u are kept in intermediates, and
+    # only i is stored back.
+    assert variables(main[start:end]) == {'s'}
+    before = main[start - 2:start]
+    assert [x.left.val for x in before] == ['i', 'u']
+    after = main[end + 1]
+    assert (after.result.val, after.left) == ('i', before[0].result)
+    assert isinstance(main[end + 2], pl0.ir.Call)
+    # The loop in local counts down its own i and adds to the global s,
+    # which is only read before it and written after.
+    accesses = [x for x in blocks['local'].operations
+                if 's' in variables([x])]
+    assert len(accesses) == 2
+    assert (accesses[0].left.val, accesses[1].result.val) == ('s', 's')
+
+
+def test_run(run_all):
+    for backend, output in run_all(PROGRAM, b'4').items():
+        assert output == [b'24', b'4', b'0'], backend
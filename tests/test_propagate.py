@@ -0,0 +1,103 @@
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import pl0.ir
+import pl0.lex
+import pl0.parser
+import pl0.propagate
+
+PROGRAM = """
+CONST debug = 0, scale = 3;
+VAR mode, n, i, s;
+
+PROCEDURE step;
+BEGIN
+    IF mode = 1 THEN s := s + i;
+    IF mode = 2 THEN s := s + i * scale;
+    IF debug = 1 THEN ! i
+END;
+
+PROCEDURE shadow;
+    VAR mode;
+BEGIN
+    mode := 1;
+    WHILE mode < 4 DO mode := mode + 1;
+    IF mode = 4 THEN s := s + 100
+END;
+
+BEGIN
+    mode := 2;
+    ? n;
+    i := 0;
+    WHILE i < n DO BEGIN CALL step; i := i + 1 END;
+    WHILE debug # 0 DO ! 0;
+    CALL shadow;
+    ! s;
+    ! mode
+END.
+"""
+
+
+def lower(src):
+    return pl0.ir.IRGenerator().dispatch(pl0.parser.parse(pl0.lex.lex(src)))
+
+
+def names(operations):
+    return set(x.val for operation in operations
+               for x in pl0.ir.uses(operation)
+               if isinstance(x, pl0.ir.Variable))
+
+
+def branches(operations):
+    return [x for x in operations if isinstance(x, pl0.ir.Branch)]
+
+
+def test_propagate():
+    program = pl0.propagate.propagate(lower(PROGRAM))
+    blocks = {x.name: x.operations for x in program.blocks}
+    # step is only called with mode 2, so only the second IF is left,
+    # with no test, and scale is folded in.
+    assert not branches(blocks['step'])
+    assert names(blocks['step']) == {'s', 'i'}
+    assert [x.right.val for x in blocks['step']
+            if isinstance(x, pl0.ir.Operation) and
+            x.operation == '*'] == [3]
+    # The loop that never runs goes, and step doesn't change mode.
+    main = blocks[None]
+    assert [x.target.val for x in branches(main)] == ['while11end']
+    writes = [x.arg for x in main if isinstance(x, pl0.ir.Call) and
+              x.name == 'write']
+    assert isinstance(writes[1], pl0.ir.Number) and writes[1].val == 2
+    # The local mode leaves the loop at 4, so only the loop's test is
+    # left.
+    assert [x.target.val for x in branches(blocks['shadow'])] == [
+        'while7end']
+
+
+def test_ranges():
+    full = pl0.propagate.FULL
+    assert pl0.propagate.arithmetic('/', (-7, 7), (2, 2)) == (-3, 3)
+    assert pl0.propagate.arithmetic('/', (1, 1), (-1, 1)) == full
+    assert pl0.propagate.arithmetic('*', (1 << 20, 1 << 20),
+                                    (1 << 12, 1 << 12)) == full
+    assert pl0.propagate.compare('<', (0, 3), (4, 9)) == (True, False)
+    assert pl0.propagate.compare('>=', (0, 3), (3, 9)) == (True, True)
+    assert pl0.propagate.compare('odd', (5, 5), None) == (True, False)
+    assert pl0.propagate.bound('>', (0, 10), (5, 5)) == ((6, 10), (5, 5))
+    assert pl0.propagate.bound('!=', (0, 10), (0, 0)) == ((1, 10), (0, 0))
+
+
+def test_run(run_all):
+    for backend, output in run_all(PROGRAM, b'4').items():
+        assert output == [b'118', b'2'], backend
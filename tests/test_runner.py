@@ -0,0 +1,115 @@
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import os
+import select
+import signal
+import subprocess
+
+import pl0.driver
+import pl0.runner
+
+SQUARES = """
+VAR x;
+BEGIN
+   x := 1;
+   WHILE x <= 3 DO
+   BEGIN
+      ! x * x;
+      x := x + 1
+   END
+END.
+"""
+
+PROMPT = """
+VAR x;
+BEGIN
+   ! 7;
+   ? x;
+   ! 100 / x
+END.
+"""
+
+
+def test_cached(tmpdir, capfd):
+    source = pl0.driver.compile_source(SQUARES)
+    path = pl0.runner.build(source, directory=str(tmpdir))
+    inode = os.stat(path).st_ino
+    assert pl0.runner.build(source, directory=str(tmpdir)) == path
+    # Not built again, which would have replaced the file.
+    assert os.stat(path).st_ino == inode
+    assert os.listdir(str(tmpdir)) == [os.path.basename(path)]
+
+    pl0.runner.run(path)
+    assert capfd.readouterr().out.split() == ['1', '4', '9']
+
+
+def test_evict(tmpdir, monkeypatch):
+    monkeypatch.setattr(pl0.runner, 'LIMIT', 1)
+    first = pl0.runner.build(pl0.driver.compile_source(SQUARES),
+                             directory=str(tmpdir))
+    second = pl0.runner.build(pl0.driver.compile_source(PROMPT),
+                              directory=str(tmpdir))
+    # The newest is kept, however large.
+    assert not os.path.exists(first)
+    assert os.listdir(str(tmpdir)) == [os.path.basename(second)]
+
+
+def test_key():
+    cc = pl0.runner.compiler()
+    assert pl0.runner.key('a', ('-O2', ), cc) != pl0.runner.key(
+        'a', ('-O0', ), cc)
+    assert pl0.runner.key('a', ('-O2', ), cc) != pl0.runner.key(
+        'b', ('-O2', ), cc)
+
+
+def test_prompt(tmpdir):
+    path = pl0.runner.build(pl0.driver.compile_source(PROMPT), ('-O2', ),
+                            directory=str(tmpdir), suffix='.elf')
+    process = subprocess.Popen([path], stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE)
+    try:
+        # The prompt is written before the program waits for input.
+        assert select.select([process.stdout], [], [], 10)[0]
+        assert process.stdout.readline() == b'7\n'
+        out, _ = process.communicate(b'5\n', timeout=10)
+    finally:
+        process.kill()
+    assert out == b'20\n'
+    # Dividing by zero still keeps what was written before it.
+    done = subprocess.run([path], input=b'0', stdout=subprocess.PIPE)
+    assert done.returncode == -signal.SIGFPE
+    assert done.stdout == b'7\n'
+
+
+def test_names(run_all):
+    # The runtime's own functions don't take names from programs.
+    variable = 'VAR flush; BEGIN flush := 3; ! flush END.'
+    procedure = """
+    VAR x;
+    PROCEDURE read;
+        VAR read;
+    BEGIN
+        ? read;
+        x := read + 1
+    END;
+    BEGIN
+        CALL read;
+        ! x
+    END.
+    """
+    for backend, output in run_all(variable).items():
+        assert output == [b'3'], backend
+    for backend, output in run_all(procedure, b'41').items():
+        assert output == [b'42'], backend
@@ -0,0 +1,101 @@
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import pytest
+
+import pl0.cache
+import pl0.check
+import pl0.driver
+import pl0.ir
+import pl0.serialize
+
+ARRAYS = """
+VAR a[10], i, n, s;
+BEGIN
+    ? n;
+    i := 0;
+    WHILE i < n DO BEGIN a[i] := i; s := s + a[i]; i := i + 1 END;
+    IF ODD s THEN ! -s
+END.
+"""
+
+
+@pytest.mark.parametrize('test', pl0.check.discover(), ids=lambda x: x.name)
+def test_round_trip(test):
+    program = pl0.driver.lower(test.source)
+    text = pl0.serialize.dumps(program)
+    binary = pl0.serialize.dumpb(program)
+    assert pl0.serialize.dumps(pl0.serialize.loads(text)) == text
+    assert pl0.serialize.dumps(pl0.serialize.loads(binary)) == text
+    for backend in sorted(pl0.driver.BACKENDS):
+        for flags in ((), ('optimize', )):
+            assert pl0.driver.compile_program(
+                pl0.serialize.loads(binary), backend,
+                flags) == pl0.driver.compile_source(test.source, backend,
+                                                    flags)
+
+
+def test_shared():
+    program = pl0.serialize.loads(pl0.serialize.dumpb(pl0.driver.lower(
+        ARRAYS)))
+    operations = program.blocks[-1].operations
+    labels = [x for x in operations if isinstance(x, pl0.ir.Label)]
+    # Checks and loads survive, and jumps point at the labels in the
+    # operations as IRGenerator makes them.
+    assert any(isinstance(x, pl0.ir.Check) for x in operations)
+    assert any(isinstance(x, pl0.ir.Load) for x in operations)
+    for operation in operations:
+        if isinstance(operation, pl0.ir.Goto):
+            assert any(operation.val is x for x in labels)
+        elif isinstance(operation, pl0.ir.Branch):
+            assert any(operation.target is x for x in labels)
+    intermediates = [x for x in program.blocks[-1].vars_
+                     if isinstance(x, pl0.ir.Intermediate)]
+    results = [x.result for x in operations
+               if isinstance(x, pl0.ir.Operation) and
+               isinstance(x.result, pl0.ir.Intermediate)]
+    assert results
+    assert all(any(x is y for y in intermediates) for x in results)
+    assert pl0.driver.compile_program(program) == pl0.driver.compile_source(
+        ARRAYS)
+
+
+def test_errors():
+    binary = pl0.serialize.dumpb(pl0.driver.lower(ARRAYS))
+    with pytest.raises(ValueError):
+        pl0.serialize.loads(binary[:7] + b'\x02\x00' + binary[9:])
+    with pytest.raises(ValueError):
+        pl0.serialize.loads('pl0-ir 2\n')
+    with pytest.raises(ValueError) as info:
+        pl0.serialize.loads('pl0-ir 1\nblock - - 0\nnope %1\nend\n')
+    assert 'line 3' in str(info.value)
+    with pytest.raises(ValueError):
+        pl0.driver.compile_program(pl0.driver.lower(ARRAYS), 'c',
+                                   ('instrument=counts', ))
+
+
+def test_files(tmpdir):
+    source = tmpdir.join('arrays.pl0')
+    source.write(ARRAYS)
+    text = tmpdir.join('arrays.ir')
+    text.write(pl0.serialize.dumps(pl0.driver.lower(ARRAYS)))
+    binary = tmpdir.join('arrays.irb')
+    pl0.serialize.save(str(binary), pl0.driver.lower(ARRAYS), binary=True)
+    cache = pl0.cache.Cache(str(tmpdir.join('cache')))
+    paths = [str(x) for x in (source, text, binary)]
+    for _ in range(2):
+        results = list(pl0.driver.compile_files(paths, cache=cache))
+        assert [x[2] for x in results] == [None] * 3
+        assert len(set(x[1] for x in results)) == 1
+    assert (cache.hits, cache.misses) == (3, 3)
@@ -0,0 +1,94 @@
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import pl0.driver
+import pl0.ir
+import pl0.propagate
+import pl0.strip
+
+LIBRARY = """
+CONST verbose = 0;
+VAR x, y;
+
+PROCEDURE log;
+BEGIN
+    ! x
+END;
+
+PROCEDURE square;
+BEGIN
+    y := x * x;
+    IF verbose = 1 THEN CALL log
+END;
+
+PROCEDURE cube;
+BEGIN
+    CALL square;
+    y := y * x
+END;
+
+PROCEDURE unused;
+    PROCEDURE inner;
+    BEGIN
+        CALL unused
+    END;
+BEGIN
+    CALL inner
+END;
+
+BEGIN
+    ? x;
+    CALL square;
+    ! y
+END.
+"""
+
+
+def test_strip():
+    program = pl0.driver.lower(LIBRARY)
+    report = pl0.strip.strip(program)
+    # Without propagation the call to log could still run.
+    assert report.removed == ['cube', 'inner', 'unused']
+    assert [x.name for x in program.blocks] == ['log', 'square', None]
+    assert (report.operations, report.kept) == (25, 14)
+
+
+def test_unreachable():
+    block = pl0.ir.Block(None)
+    done = pl0.ir.Label('done')
+    block.operations = [pl0.ir.Enter(), pl0.ir.Goto(done),
+                        pl0.ir.Call('write', pl0.ir.Number(1)), done,
+                        pl0.ir.Exit()]
+    program = pl0.ir.Program(None)
+    program.blocks = [block]
+    report = pl0.strip.strip(program)
+    assert (report.operations, report.kept) == (4, 3)
+    assert str(report) == 'removed 0 of 0 procedures and 1 of 4 operations'
+
+
+def test_report():
+    program = pl0.driver.lower(LIBRARY)
+    report = pl0.strip.measure(program)
+    pl0.propagate.propagate(program)
+    pl0.strip.strip(program, report)
+    assert str(report) == ('removed 4 of 5 procedures (log, cube, inner, '
+                           'unused) and 16 of 25 operations')
+
+
+def test_run(run_all):
+    for backend in pl0.driver.BACKENDS:
+        output = pl0.driver.compile_source(LIBRARY, backend)
+        assert 'cube' not in output and 'log' not in output
+    for backend, output in run_all(LIBRARY, b'7').items():
+        assert output == [b'49'], backend
@@ -0,0 +1,67 @@
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import io
+
+import pytest
+
+import pl0.codegen_riscv
+import pl0.ir
+import pl0.lex
+import pl0.parser
+import pl0.structure
+
+NESTED = """
+VAR x, y;
+BEGIN
+  x := 0;
+  WHILE x < 10 DO BEGIN
+    y := 0;
+    WHILE y < x DO BEGIN
+      IF ODD y THEN ! y;
+      y := y + 1
+    END;
+    x := x + 1
+  END
+END.
+"""
+
+
+def lower(src):
+    return pl0.ir.IRGenerator().dispatch(pl0.parser.parse(pl0.lex.lex(src)))
+
+
+def test_nested():
+    tree = pl0.structure.structure(lower(NESTED).blocks[-1].operations)
+    loops = [x for x in tree if isinstance(x, pl0.structure.Loop)]
+    assert len(loops) == 1
+    inner = [x for x in loops[0].body if isinstance(x, pl0.structure.Loop)]
+    assert len(inner) == 1
+    assert any(
+        isinstance(x, pl0.structure.Conditional) for x in inner[0].body)
+
+
+def test_unstructured():
+    label = pl0.ir.Label('top')
+    with pytest.raises(pl0.structure.Unstructured):
+        pl0.structure.structure([pl0.ir.Goto(label)])
+
+
+def test_emit():
+    sink = io.StringIO()
+    pl0.codegen_riscv.StructuredGenerator(sink).dispatch(lower(NESTED))
+    out = sink.getvalue()
+    assert 'goto' not in out
+    assert 'while (x < 10) {' in out
+    assert 'static int_t x;' in out
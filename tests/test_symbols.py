@@ -0,0 +1,109 @@
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import pytest
+
+import pl0.ir
+import pl0.lex
+import pl0.parser
+import pl0.symbols
+
+PROGRAM = """
+CONST k = 2;
+VAR a, b[k], c;
+
+PROCEDURE p;
+    VAR c, d;
+
+    PROCEDURE q;
+    BEGIN
+        d := a + c
+    END;
+BEGIN
+    CALL q
+END;
+
+BEGIN
+    CALL p
+END.
+"""
+
+
+def lower(source):
+    return pl0.ir.IRGenerator().dispatch(pl0.parser.parse(pl0.lex.lex(
+        source)))
+
+
+def test_table():
+    table = pl0.symbols.SymbolTable()
+    table.enter()
+    x = table.declare(pl0.lex.Ident('x', 1), pl0.symbols.VAR)
+    k = table.declare(pl0.lex.Ident('k', 1), pl0.symbols.CONST, 3)
+    a = table.declare(pl0.lex.Ident('a', 2), pl0.symbols.ARRAY, 4)
+    table.enter()
+    y = table.declare(pl0.lex.Ident('x', 3), pl0.symbols.VAR)
+    assert [(s.depth, s.slot) for s in (x, k, a, y)] == [(0, 0), (0, None),
+                                                         (0, 1), (1, 0)]
+    assert table.lookup('x') is y
+    assert table.lookup('k') is k
+    assert table.resolve(pl0.lex.Ident('a', 4), pl0.symbols.VAR) is None
+    table.leave()
+    assert table.lookup('x') is x
+    assert table.lookup('y') is None
+    assert table.errors == ['line 4: a is an array, not a variable']
+
+
+def test_slots():
+    program = lower(PROGRAM)
+    q, p, main = program.blocks
+    assert [(x.depth, x.slot) for x in main.vars_
+            if isinstance(x, pl0.ir.Variable)] == [(0, 0), (0, 2)]
+    assert [x.slot for x in main.vars_ if isinstance(x, pl0.ir.Array)] == [1]
+    assert (p.depth, q.depth) == (1, 2)
+    add = [x for x in q.operations if isinstance(x, pl0.ir.Operation)][0]
+    # a is a global and c the local of p that hides the global c.
+    assert (add.left.val, add.left.depth, add.left.slot) == ('a', 0, 0)
+    assert isinstance(add.right, pl0.ir.Captured)
+    assert (add.right.depth, add.right.slot) == (1, 0)
+    assign = [x for x in q.operations if isinstance(x, pl0.ir.Assign)][0]
+    assert (assign.result.depth, assign.result.slot) == (1, 1)
+
+
+def test_errors():
+    with pytest.raises(ValueError) as info:
+        lower("""
+VAR x, y, x;
+PROCEDURE p;
+BEGIN
+    z := 1
+END;
+PROCEDURE p;
+    CONST y = 1;
+BEGIN
+    y := z;
+    CALL x
+END;
+BEGIN
+    CALL q
+END.
+""")
+    # All of them at once, and z only once.
+    assert str(info.value).splitlines() == [
+        'line 2: x is already declared on line 2',
+        'line 5: z is not declared',
+        'line 7: p is already declared on line 3',
+        'line 10: y is a constant, not a variable',
+        'line 11: x is a variable, not a procedure',
+        'line 14: q is not declared',
+    ]
@@ -0,0 +1,37 @@
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import pl0.driver
+import pl0.lex
+import pl0.synth
+
+
+def test_seeded():
+    assert pl0.synth.generate(seed=3) == pl0.synth.generate(seed=3)
+    assert pl0.synth.generate(seed=3) != pl0.synth.generate(seed=4)
+
+
+def test_compiles():
+    for seed in range(5):
+        source = pl0.synth.generate(seed=seed)
+        for backend in sorted(pl0.driver.BACKENDS):
+            assert pl0.driver.compile_source(source, backend)
+
+
+def test_scales():
+    base = pl0.synth.Shape()
+    size = len(list(pl0.lex.lex(pl0.synth.generate(base))))
+    for field in pl0.synth.Shape.__slots__:
+        double = pl0.synth.generate(base.scaled(field, 2))
+        assert len(list(pl0.lex.lex(double))) > size
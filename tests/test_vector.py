@@ -0,0 +1,96 @@
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import pytest
+
+import pl0.check
+import pl0.vector
+
+np = pytest.importorskip('numpy')
+
+COLLATZ = """
+VAR x, next, steps, a[4];
+
+PROCEDURE count;
+BEGIN
+    steps := 0;
+    WHILE x > 1 DO
+    BEGIN
+        next := x / 2;
+        IF ODD x THEN next := 3 * x + 1;
+        x := next;
+        steps := steps + 1
+    END
+END;
+
+BEGIN
+    ? x;
+    ! 100 / x;
+    CALL count;
+    ! steps;
+    ? x;
+    a[x] := 7;
+    ! a[x]
+END.
+"""
+
+
+def collatz(x):
+    steps = 0
+    while x > 1:
+        x = 3 * x + 1 if x % 2 else x // 2
+        steps += 1
+    return steps
+
+
+# bench runs for too long on one lane.
+@pytest.mark.parametrize(
+    'test', [x for x in pl0.check.discover() if x.name != 'bench'],
+    ids=lambda x: x.name)
+def test_programs(test):
+    inputs = [[int(x) for x in test.stdin.split()]]
+    result = pl0.vector.run(pl0.vector.compile_program(test.source), inputs)
+    assert result.errors == {}
+    assert [str(x) for x in result.output(0)] == test.expect
+
+
+@pytest.mark.parametrize('minimum', [1, 1 << 30])
+def test_lanes(monkeypatch, minimum):
+    # With minimum 1 loops are compacted as soon as lanes diverge.
+    monkeypatch.setattr(pl0.vector, 'MINIMUM', minimum)
+    inputs = [[x, x % 5] for x in range(1, 300)] + [[0, 1], [-7, 3]]
+    result = pl0.vector.run(pl0.vector.compile_program(COLLATZ), inputs)
+    assert len(result) == len(inputs)
+    for lane, (x, index) in enumerate(inputs[:-2]):
+        if index < 4:
+            assert result.output(lane) == [100 // x, collatz(x), 7]
+        else:
+            assert result.output(lane) == [100 // x, collatz(x)]
+            assert 'out of bounds' in result.errors[lane]
+    # Divides by zero, and rounds towards zero like C.
+    assert result.output(len(inputs) - 2) == []
+    assert result.errors[len(inputs) - 2] == 'division by zero'
+    assert result.output(len(inputs) - 1) == [-14, 0, 7]
+    assert sorted(result.errors) == [
+        lane for lane, x in enumerate(inputs) if x[1] == 4
+    ] + [len(inputs) - 2]
+
+
+def test_wraps():
+    program = pl0.vector.compile_program(
+        'VAR x; BEGIN ? x; ! x * x; ! x / 3 END.')
+    result = pl0.vector.run(program, [[65536], [-65536], [46341]])
+    assert result.output(0) == [0, 21845]
+    assert result.output(1) == [0, -21845]
+    assert result.output(2) == [-2147479015, 15447]